@@ -0,0 +1,316 @@
+"""
+Reproducible benchmarks of simulation, likelihood, compensator, intensity and fitting.
+
+Every case runs in a fresh interpreter so the reported peak memory belongs to that case alone.
+Data and models are generated from fixed seeds, so two runs of the same arguments on different commits time the same work:
+
+    python Benchmarks.py --preset quick --output before.json
+    python Benchmarks.py --preset quick --output after.json --compare before.json
+"""
+__author__ = 'tjohnson'
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import scipy
+
+import ClusterSimulator
+import DecayFunctions
+import EventStore
+import GenuineMultivariateHawkesProcess
+import GenuineMultivariateHawkesProcessFitter
+import ImmigrationDescendantParameters
+import MarkDistributions
+import ThinningSimulator
+
+CASES=['simulate','simulateReference','logLikelihood','compensator','lambda','lambdaGrid','fit']
+
+#The reference simulator rescans the history on every step, larger sizes are skipped
+REFERENCE_SIMULATE_MAX_EVENTS=2000
+#Number of query times for the lambda cases
+NUM_QUERY_TIMES=1000
+#Branching matrices are scaled to this spectral radius
+SPECTRAL_RADIUS=0.5
+#Expected number of events per unit time, summed over components
+TOTAL_EVENT_RATE=1.0
+
+MARK_FAMILIES={
+    'pareto':(MarkDistributions.ParetoMarkDistribution,[3.6,5.6,0.47,0.22,0.0]),
+    'void':(MarkDistributions.VoidMarkDistribution,[]),
+    'exponential':(MarkDistributions.ExponentialMarkDistribution1Param,[1.0,0.5]),
+}
+
+#(factory,params,referenceCapable), the reference simulator calls getW once per pair of events and only runs for
+#families where it is closed form, the Mittag-Leffler getW is a quadrature
+DECAY_FAMILIES={
+    'exponential':(DecayFunctions.ExponentialDecayFunction,[0.5],True),
+    'powerLaw':(lambda params: DecayFunctions.PowerLawDecayFunction(params,tolerance=1e-4),[1.5,2.0],True),
+    'mittagLeffler':(lambda params: DecayFunctions.MittagLefflerDecayFunction(params,tolerance=1e-4),[0.7,2.0],False),
+}
+
+#Fit cases of these decay families run on at most this many events and components, every evaluation with a new
+#Mittag-Leffler beta recomputes its exponential terms
+FIT_MAX_SIZES={'mittagLeffler':(100,2)}
+
+PRESETS={
+    'quick':{'events':[1000,10000],'components':[1,2,5],'repeats':3},
+    'full':{'events':[1000,10000,100000,1000000],'components':[1,2,5,10,20,50],'repeats':3},
+}
+
+
+def buildProcess(numComponents,markFamily,decayFamily,seed):
+    """
+    Stable model with a random branching matrix of spectral radius SPECTRAL_RADIUS and immigration rates giving
+    TOTAL_EVENT_RATE events per unit time in stationarity (E[g]=1, so the mean rates are (I-q)^-1 nu).
+    Every component gets its own decay function and mark distribution instance.
+    :return: hawkesProcess,parameter vector in the layout of GenuineMultivariateHawkesProcessFitter
+    """
+    randomState=np.random.RandomState(seed)
+    q=randomState.uniform(0.1,1.0,[numComponents,numComponents])
+    q*=SPECTRAL_RADIUS/np.max(np.abs(np.linalg.eigvals(q)))
+    nu=(np.eye(numComponents)-q).dot(np.ones(numComponents))*TOTAL_EVENT_RATE/numComponents
+
+    decayClass,decayParams,referenceCapable=DECAY_FAMILIES[decayFamily]
+    markClass,markParams=MARK_FAMILIES[markFamily]
+    decayFunctions=[decayClass(decayParams) for j in range(0,numComponents)]
+    markDistributions=[markClass(markParams) for j in range(0,numComponents)]
+
+    params=list(nu)+list(q.ravel())+list(decayParams)*numComponents+list(markParams)*numComponents
+    immigrationDescendantParameters=ImmigrationDescendantParameters.ImmigrationDescendantParameters(numComponents,params)
+    hawkesProcess=GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        immigrationDescendantParameters,decayFunctions,markDistributions)
+    return hawkesProcess,np.array(params,dtype=float)
+
+
+def buildEvents(hawkesProcess,numEvents,seed):
+    """First numEvents events of a cluster simulation long enough to contain them, observed until the last of them"""
+    endTime=1.5*numEvents/TOTAL_EVENT_RATE
+    while True:
+        events=ClusterSimulator.ClusterSimulator(hawkesProcess).simulate(endTime,seed,numWorkers=1)
+        if len(events)>=numEvents:
+            return EventStore.EventStore(events.times[0:numEvents],events.components[0:numEvents],events.marks[0:numEvents],
+                                         hawkesProcess.numComponents,startTime=events.startTime,
+                                         endTime=float(events.times[numEvents-1]) if numEvents>0 else events.startTime)
+        endTime*=2.0
+
+
+def getPeakMemoryMB():
+    """Peak resident set size of this process, ru_maxrss is in kilobytes on Linux"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+
+def runCase(case):
+    """
+    Run one benchmark case in this process.
+    :param case: dict with keys case,events,components,marks,decay,repeats,seed
+    :return: dict of measurements
+    """
+    hawkesProcess,params=buildProcess(case['components'],case['marks'],case['decay'],case['seed'])
+    numEvents=case['events']
+    name=case['case']
+
+    if name=='simulate':
+        operation=lambda: ThinningSimulator.ThinningSimulator(hawkesProcess).simulate(numEvents,case['seed'])
+        evaluations=None
+    elif name=='simulateReference':
+        def operation():
+            random.seed(case['seed'])
+            hawkesProcess.simulate(numEvents)
+        evaluations=None
+    else:
+        events=buildEvents(hawkesProcess,numEvents,case['seed'])
+        if name=='logLikelihood':
+            operation=lambda: hawkesProcess.getLogLikelihood(events)
+            evaluations=1
+        elif name=='compensator':
+            operation=lambda: [hawkesProcess.getCompensator(j,events) for j in range(0,hawkesProcess.numComponents)]
+            evaluations=hawkesProcess.numComponents
+        elif name=='lambda':
+            queryTimes=np.random.RandomState(case['seed']).uniform(events.times[0],events.times[-1],NUM_QUERY_TIMES)
+            operation=lambda: [hawkesProcess.getLambda(j,events,t) for t in queryTimes for j in range(0,hawkesProcess.numComponents)]
+            evaluations=NUM_QUERY_TIMES*hawkesProcess.numComponents
+        elif name=='lambdaGrid':
+            queryTimes=np.linspace(events.times[0],events.times[-1],NUM_QUERY_TIMES)
+            operation=lambda: hawkesProcess.getLambdaOnGrid(events,queryTimes)
+            evaluations=NUM_QUERY_TIMES*hawkesProcess.numComponents
+        elif name=='fit':
+            fitter=GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(hawkesProcess)
+            initialGuess=params*np.random.RandomState(case['seed']).uniform(0.8,1.2,len(params))
+            fitResult={}
+            def operation():
+                fitResult['info']=fitter.maximizeLikelihood(events,initialGuess)[2]
+            evaluations=None
+        else:
+            raise ValueError("Unknown benchmark case %s" % name)
+
+    setupMemory=getPeakMemoryMB()
+    wallTimes=[]
+    for repeat in range(0,case['repeats']):
+        startTime=time.time()
+        operation()
+        wallTimes.append(time.time()-startTime)
+
+    bestTime=min(wallTimes)
+    if name=='fit':
+        evaluations=fitResult['info']['funcalls']
+    return {
+        'wallTime':bestTime,
+        'medianWallTime':float(np.median(wallTimes)),
+        'wallTimes':wallTimes,
+        'evaluations':evaluations,
+        'evaluationsPerSecond':evaluations/bestTime if evaluations is not None and bestTime>0 else None,
+        'eventsPerSecond':numEvents/bestTime if bestTime>0 else None,
+        'setupMemoryMB':setupMemory,
+        'peakMemoryMB':getPeakMemoryMB(),
+    }
+
+
+def runCaseInSubprocess(case,timeout,verbose):
+    """Run one case in a fresh interpreter, killing it after timeout seconds"""
+    fileHandle,resultPath=tempfile.mkstemp(suffix='.json')
+    os.close(fileHandle)
+    try:
+        command=[sys.executable,os.path.abspath(__file__),'--run-case',json.dumps(case),'--result-path',resultPath]
+        with open(os.devnull,'w') as devnull:
+            process=subprocess.Popen(command,stdout=None if verbose else devnull,cwd=os.path.dirname(os.path.abspath(__file__)))
+            timer=threading.Timer(timeout,process.kill) if timeout else None
+            if timer is not None:
+                timer.start()
+            try:
+                returnCode=process.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+        result=dict(case)
+        if returnCode==0:
+            with open(resultPath) as f:
+                result.update(json.load(f))
+            result['status']='ok'
+        elif timeout and returnCode<0:
+            result['status']='timeout'
+        else:
+            result['status']='failed (exit code %s)' % returnCode
+        return result
+    finally:
+        os.remove(resultPath)
+
+
+def getCases(arguments):
+    """
+    Cases of the requested sizes, skipping simulateReference above REFERENCE_SIMULATE_MAX_EVENTS or without a
+    reference-capable decay family and clipping fit sizes to FIT_MAX_SIZES (each clipped size once)
+    """
+    cases=[]
+    for name in arguments.cases:
+        for numComponents in arguments.components:
+            for numEvents in arguments.events:
+                if name=='simulateReference' and numEvents>REFERENCE_SIMULATE_MAX_EVENTS:
+                    continue
+                for markFamily in arguments.marks:
+                    for decayFamily in arguments.decays:
+                        if name=='simulateReference' and not DECAY_FAMILIES[decayFamily][2]:
+                            continue
+                        case={'case':name,'events':numEvents,'components':numComponents,'marks':markFamily,
+                              'decay':decayFamily,'repeats':1 if name=='fit' else arguments.repeats,'seed':arguments.seed}
+                        if name=='fit' and decayFamily in FIT_MAX_SIZES:
+                            maxEvents,maxComponents=FIT_MAX_SIZES[decayFamily]
+                            case['events']=min(numEvents,maxEvents)
+                            case['components']=min(numComponents,maxComponents)
+                        if case not in cases:
+                            cases.append(case)
+    return cases
+
+
+def getCaseKey(result):
+    return tuple(result[key] for key in ['case','events','components','marks','decay'])
+
+
+def getMetadata(arguments):
+    try:
+        commit=subprocess.check_output(['git','rev-parse','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.STDOUT).strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit=None
+    return {
+        'commit':commit,
+        'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'scipy':scipy.__version__,
+        'platform':platform.platform(),
+        'processor':platform.processor(),
+        'arguments':vars(arguments),
+    }
+
+
+def printComparison(results,baselinePath):
+    """Ratio of best wall times against a previous results file, >1 means slower than the baseline"""
+    with open(baselinePath) as f:
+        baseline=dict((getCaseKey(result),result) for result in json.load(f)['results'] if result['status']=='ok')
+    print "%-18s %9s %4s %-12s %-12s %10s %10s %7s" % ('case','events','K','marks','decay','baseline','current','ratio')
+    for result in results:
+        key=getCaseKey(result)
+        if result['status']!='ok' or key not in baseline:
+            continue
+        baselineTime=baseline[key]['wallTime']
+        ratio=result['wallTime']/baselineTime if baselineTime>0 else float('nan')
+        print "%-18s %9d %4d %-12s %-12s %10.4f %10.4f %7.2f" % (key+(baselineTime,result['wallTime'],ratio))
+
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--preset',choices=sorted(PRESETS.keys()),default='quick')
+    parser.add_argument('--cases',nargs='+',choices=CASES,default=CASES)
+    parser.add_argument('--events',nargs='+',type=int,help='Event counts, overrides the preset')
+    parser.add_argument('--components',nargs='+',type=int,help='Component counts, overrides the preset')
+    parser.add_argument('--marks',nargs='+',choices=sorted(MARK_FAMILIES.keys()),default=sorted(MARK_FAMILIES.keys()))
+    parser.add_argument('--decays',nargs='+',choices=sorted(DECAY_FAMILIES.keys()),default=sorted(DECAY_FAMILIES.keys()))
+    parser.add_argument('--repeats',type=int,help='Timed repetitions per case (fit runs once), overrides the preset')
+    parser.add_argument('--seed',type=int,default=1)
+    parser.add_argument('--timeout',type=float,default=600.0,help='Seconds before a case is killed, 0 for no limit')
+    parser.add_argument('--output',default='benchmarks.json')
+    parser.add_argument('--compare',help='Previous results file to compare wall times against')
+    parser.add_argument('--verbose',action='store_true',help='Show the output of the benchmarked code')
+    parser.add_argument('--run-case',help=argparse.SUPPRESS)
+    parser.add_argument('--result-path',help=argparse.SUPPRESS)
+    arguments=parser.parse_args()
+
+    if arguments.run_case is not None:
+        result=runCase(json.loads(arguments.run_case))
+        with open(arguments.result_path,'w') as f:
+            json.dump(result,f)
+        return
+
+    preset=PRESETS[arguments.preset]
+    for key in ['events','components','repeats']:
+        if getattr(arguments,key) is None:
+            setattr(arguments,key,preset[key])
+
+    results=[]
+    for case in getCases(arguments):
+        result=runCaseInSubprocess(case,arguments.timeout,arguments.verbose)
+        results.append(result)
+        if result['status']=='ok':
+            evaluationsPerSecond='-' if result['evaluationsPerSecond'] is None else '%.1f/s' % result['evaluationsPerSecond']
+            print "%-18s %9d %4d %-12s %-12s %10.4fs %14s %8.1fMB" % (getCaseKey(result)+(result['wallTime'],evaluationsPerSecond,result['peakMemoryMB']))
+        else:
+            print "%-18s %9d %4d %-12s %-12s %s" % (getCaseKey(result)+(result['status'],))
+        sys.stdout.flush()
+
+    with open(arguments.output,'w') as f:
+        json.dump({'metadata':getMetadata(arguments),'results':results},f,indent=1)
+
+    if arguments.compare is not None:
+        printComparison(results,arguments.compare)
+
+
+if __name__=="__main__":
+    main()
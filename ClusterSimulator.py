@@ -0,0 +1,118 @@
+__author__ = 'tjohnson'
+import multiprocessing
+import numpy as np
+import EventStore
+import ThinningSimulator
+
+#Immigrants are split into chunks of this size, each with its own seed, independent of the number of workers
+IMMIGRANTS_PER_CHUNK=1000
+
+
+def _simulateClusters(args):
+    """Pool task: generate the offspring clusters of one chunk of immigrants"""
+    hawkesProcess,endTime,seed,times,components,marks=args
+    randomState=np.random.RandomState(seed)
+    numComponents=hawkesProcess.numComponents
+    q=hawkesProcess.immigrationDescendantParameters.q
+
+    allTimes=[times]
+    allComponents=[components]
+    allMarks=[marks]
+    while len(times)>0:
+        impacts=np.zeros(len(times))
+        for k in range(0,numComponents):
+            mask=components==k
+            impacts[mask]=hawkesProcess.markDistributions[k].getImpactFunctionArray(marks[mask])
+
+        childTimes=[]
+        childComponents=[]
+        childMarks=[]
+        for j in range(0,numComponents):
+            #Each parent has Poisson(q[j,k]*g_k(x)) children in component j, the decay function integrates to one
+            numChildren=randomState.poisson(q[j,components]*impacts)
+            totalChildren=np.sum(numChildren)
+            if totalChildren==0:
+                continue
+
+            #Inverse transform sampling of the delay through the decay quantile function
+            delays=hawkesProcess.decayFunctions[j].getQArray(1.0-randomState.random_sample(totalChildren))
+            newTimes=np.repeat(times,numChildren)+delays
+            newMarks=hawkesProcess.markDistributions[j].getRandomValues(totalChildren,randomState)
+
+            inHorizon=newTimes<endTime
+            childTimes.append(newTimes[inHorizon])
+            childComponents.append(np.repeat(j,np.sum(inHorizon)).astype(np.int32))
+            childMarks.append(np.asarray(newMarks,dtype=float)[inHorizon])
+
+        if len(childTimes)==0:
+            break
+        times=np.concatenate(childTimes)
+        components=np.concatenate(childComponents)
+        marks=np.concatenate(childMarks)
+        allTimes.append(times)
+        allComponents.append(components)
+        allMarks.append(marks)
+
+    return np.concatenate(allTimes),np.concatenate(allComponents),np.concatenate(allMarks)
+
+
+class ClusterSimulator:
+    def __init__(self,hawkesProcess):
+        """
+        Simulation through the immigrant/descendant representation (Liniger thesis p. 26):
+        immigrants arrive in component j as a Poisson process with rate nu[j], and every event of component k with
+        mark x has Poisson(q[j,k]*g_k(x)) direct descendants in component j, delayed by draws from w_j.
+        Clusters are independent, so they are generated in parallel chunks.
+        """
+        self.hawkesProcess=hawkesProcess
+
+    def simulate(self,endTime,randomState=None,numWorkers=None):
+        """
+        :param endTime: Simulate on [0,endTime), starting from an empty history
+        :param randomState: Seed or numpy.random.RandomState. The result does not depend on numWorkers
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to run in this process
+        :return: EventStore with observation window [0,endTime]
+        """
+        if self.hawkesProcess.immigrationDescendantParameters.getSpectralRadius()>=1.0:
+            raise ValueError("Branching matrix is not subcritical, clusters would be infinite")
+
+        randomState=ThinningSimulator.getRandomState(randomState)
+        numComponents=self.hawkesProcess.numComponents
+        nu=self.hawkesProcess.immigrationDescendantParameters.nu
+
+        immigrantTimes=[]
+        immigrantComponents=[]
+        immigrantMarks=[]
+        for j in range(0,numComponents):
+            numImmigrants=randomState.poisson(nu[j]*endTime)
+            immigrantTimes.append(randomState.uniform(0.0,endTime,numImmigrants))
+            immigrantComponents.append(np.repeat(j,numImmigrants).astype(np.int32))
+            immigrantMarks.append(np.asarray(self.hawkesProcess.markDistributions[j].getRandomValues(numImmigrants,randomState),dtype=float))
+        immigrantTimes=np.concatenate(immigrantTimes)
+        immigrantComponents=np.concatenate(immigrantComponents)
+        immigrantMarks=np.concatenate(immigrantMarks)
+
+        tasks=[]
+        for chunkStart in range(0,len(immigrantTimes),IMMIGRANTS_PER_CHUNK):
+            chunk=slice(chunkStart,chunkStart+IMMIGRANTS_PER_CHUNK)
+            seed=randomState.randint(0,2**31-1)
+            tasks.append((self.hawkesProcess,endTime,seed,immigrantTimes[chunk],immigrantComponents[chunk],immigrantMarks[chunk]))
+
+        if numWorkers==1 or len(tasks)<=1:
+            results=map(_simulateClusters,tasks)
+        else:
+            pool=multiprocessing.Pool(numWorkers)
+            try:
+                results=pool.map(_simulateClusters,tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        if len(results)==0:
+            return EventStore.EventStore([],[],[],numComponents,startTime=0.0,endTime=endTime)
+
+        times=np.concatenate([result[0] for result in results])
+        components=np.concatenate([result[1] for result in results])
+        marks=np.concatenate([result[2] for result in results])
+        order=np.argsort(times,kind='mergesort')
+        return EventStore.EventStore(times[order],components[order],marks[order],numComponents,startTime=0.0,endTime=endTime)
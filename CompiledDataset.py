@@ -0,0 +1,89 @@
+__author__ = 'tjohnson'
+import collections
+import numpy as np
+import EventStore
+
+#Default bound on the memory held by the cache of a CompiledDataset
+DEFAULT_MAX_CACHE_BYTES=256*2**20
+
+
+def _getSize(value):
+    """Approximate memory of a cached value in bytes"""
+    if isinstance(value,np.ndarray):
+        return value.nbytes
+    if isinstance(value,(tuple,list)):
+        return sum(_getSize(item) for item in value)
+    return 64
+
+
+def _getReadOnly(array):
+    view=np.asarray(array).view()
+    view.flags.writeable=False
+    return view
+
+
+class CompiledDataset(EventStore.EventStore):
+    def __init__(self,timeComponentMarkTriplets,numComponents=None,maxCacheBytes=DEFAULT_MAX_CACHE_BYTES):
+        """
+        Read-only EventStore built once per fit, holding the data-only indexes (per-component indices) and an LRU cache
+        of quantities that depend on one parameter block only, such as the impacts of one component's marks or the decay window bounds of one target component.
+        The likelihood code looks these up through getCached with keys that include the parameters they depend on,
+        so an evaluation where only other blocks changed reuses them. Memory of the cache is bounded by maxCacheBytes.
+        """
+        eventStore=EventStore.asEventStore(timeComponentMarkTriplets,numComponents)
+        if numComponents is None:
+            numComponents=eventStore.numComponents
+        componentOrder=eventStore.componentOrder
+        componentOffsets=eventStore.componentOffsets
+        if componentOrder is None or eventStore.numComponents!=numComponents:
+            indexed=EventStore.EventStore(eventStore.times,eventStore.components,eventStore.marks,numComponents,checkSorted=False)
+            indexed.getComponentIndices(0)
+            componentOrder=indexed.componentOrder
+            componentOffsets=indexed.componentOffsets
+
+        EventStore.EventStore.__init__(self,_getReadOnly(eventStore.times),_getReadOnly(eventStore.components),
+                                       _getReadOnly(eventStore.marks),numComponents,
+                                       _getReadOnly(componentOrder),_getReadOnly(componentOffsets),
+                                       eventStore.startTime,eventStore.endTime,checkSorted=False)
+
+        self.maxCacheBytes=maxCacheBytes
+        self.clearCache()
+
+    def clearCache(self):
+        self.cache=collections.OrderedDict()
+        self.cacheBytes=0
+        self.cacheHits=0
+        self.cacheMisses=0
+
+    def getCached(self,key,compute):
+        """
+        Value stored under key, computed with compute() on a miss.
+        Least recently used entries are evicted beyond maxCacheBytes, values larger than that are not stored.
+        """
+        if key in self.cache:
+            self.cacheHits+=1
+            value,size=self.cache.pop(key)
+            self.cache[key]=(value,size)
+            return value
+
+        self.cacheMisses+=1
+        value=compute()
+        size=_getSize(value)
+        if size<=self.maxCacheBytes:
+            self.cache[key]=(value,size)
+            self.cacheBytes+=size
+            while self.cacheBytes>self.maxCacheBytes:
+                evictedKey,(evictedValue,evictedSize)=self.cache.popitem(last=False)
+                self.cacheBytes-=evictedSize
+        return value
+
+    def getCacheInfo(self):
+        return {'hits':self.cacheHits,'misses':self.cacheMisses,'entries':len(self.cache),
+                'bytes':self.cacheBytes,'maxBytes':self.maxCacheBytes}
+
+
+def asCompiledDataset(timeComponentMarkTriplets,numComponents=None,maxCacheBytes=DEFAULT_MAX_CACHE_BYTES):
+    """Accept a CompiledDataset (returned as is), an EventStore or a list of (time,component,mark) triplets"""
+    if isinstance(timeComponentMarkTriplets,CompiledDataset):
+        return timeComponentMarkTriplets
+    return CompiledDataset(timeComponentMarkTriplets,numComponents,maxCacheBytes)
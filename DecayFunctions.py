@@ -1,14 +1,75 @@
 __author__ = 'tjohnson'
 import math
+import numpy as np
+import scipy.special
+
+#Accuracy of the rate quadrature used as the exact evaluation of MittagLefflerDecayFunction
+EXACT_QUADRATURE_TOLERANCE=1e-12
+#Largest (time,rate) matrix evaluated at once by the quadrature
+QUADRATURE_CHUNK_ELEMENTS=2**22
+#Points of the table MittagLefflerDecayFunction.getQArray interpolates before its Newton steps
+QUANTILE_TABLE_SIZE=2000
+#Log grid on which getApproximationError compares the sum of exponentials with the exact survival function
+APPROXIMATION_ERROR_POINTS=200
+#Doublings or halvings of the estimated step tried before the tolerance is bracketed
+MAX_STEP_SEARCH_STEPS=8
+#Bisections in log(step) once bracketed, the step ends within 2^(2^-STEP_BISECTIONS) of the largest one within tolerance
+STEP_BISECTIONS=4
+
+
+def getExponentialTerms(decayFunction):
+    """
+    (weights,rates) if the decay function is evaluated as w(t)=sum_i weights[i]*rates[i]*exp(-rates[i]*t),
+    which allows the recursive likelihood and intensity, None otherwise
+    """
+    if not hasattr(decayFunction,'getExponentialTerms'):
+        return None
+    return decayFunction.getExponentialTerms()
+
+
+def getStackedExponentialTerms(decayFunctions):
+    """
+    The exponential terms of all components' decay functions in one list, for the recursive intensity state and the
+    closed-form forecasts: term i belongs to component termComponents[i] and contributes
+    termWeights[i]*exp(-rates[i]*t) (termWeights=weights*rates) to its decay function.
+    Every decay function needs exponential terms (getExponentialTerms not None).
+    :return: (termComponents,termWeights,rates)
+    """
+    termComponents=[]
+    termWeights=[]
+    rates=[]
+    for j,decayFunction in enumerate(decayFunctions):
+        weights,componentRates=getExponentialTerms(decayFunction)
+        termComponents.append(np.repeat(j,len(weights)))
+        termWeights.append(weights*componentRates)
+        rates.append(componentRates)
+    return np.concatenate(termComponents),np.concatenate(termWeights),np.concatenate(rates)
+
+
+def getWBarArray(decayFunction,t):
+    """
+    getWBarArray as the likelihood evaluates it: from the sum-of-exponentials representation if the decay function
+    has one, so that the compensator matches the intensity
+    """
+    terms=getExponentialTerms(decayFunction)
+    if terms is None:
+        return decayFunction.getWBarArray(t)
+    survival=np.zeros(len(t))
+    for termWeight,rate in zip(*terms):
+        survival+=termWeight*np.exp(-rate*t)
+    return 1.0-survival
 
 class ExponentialDecayFunction:
     """
     Exponential decay function from Liniger thesis p. 32
     """
 
-    def __init__(self,params):
+    def __init__(self,params,epsilon=1e-5):
+        """
+        :param epsilon: Decay mass ignored beyond the quantile getQ(), bounds the error of the truncated evaluations
+        """
         self.setParams(params)
-        self.epsilon=1e-5 #For Q function
+        self.epsilon=epsilon #For Q function
 
     @staticmethod
     def getNumParameters():
@@ -25,6 +86,10 @@ class ExponentialDecayFunction:
         """
         self.alpha=params[0]
 
+    def getParams(self):
+        """Current parameters in the order of setParams"""
+        return [self.alpha]
+
     def getW(self,t):
         """
         Get value of decay function
@@ -40,6 +105,360 @@ class ExponentialDecayFunction:
 
         return 1.0-math.exp(-self.alpha*t)
 
-    def getQ(self):
-        """Get value of quantile function"""
-        return -math.log(self.epsilon)/self.alpha
+    def getWArray(self,t):
+        """getW for an array of times"""
+        return self.alpha*np.exp(-self.alpha*np.asarray(t,dtype=float))
+
+    def getWBarArray(self,t):
+        """getWBar for an array of times"""
+        return 1.0-np.exp(-self.alpha*np.asarray(t,dtype=float))
+
+    def getQ(self,epsilon=None):
+        """
+        Get value of quantile function: the time after which only epsilon of the decay mass is left,
+        i.e. getWBar(getQ(epsilon))=1-epsilon. Defaults to self.epsilon
+        """
+        if epsilon is None:
+            epsilon=self.epsilon
+        return -math.log(epsilon)/self.alpha
+
+    def getQArray(self,epsilon):
+        """getQ for an array of epsilons"""
+        return -np.log(np.asarray(epsilon,dtype=float))/self.alpha
+
+    def getExponentialTerms(self):
+        """A single exponential, see getExponentialTerms"""
+        return np.ones(1),np.array([self.alpha],dtype=float)
+
+
+class _CompletelyMonotoneDecayFunction:
+    """
+    Base of decay functions whose survival function is a mixture of exponentials,
+        1-wBar(t)=int_0^inf exp(-r*t)*m(r)dr, w(t)=int_0^inf r*exp(-r*t)*m(r)dr
+    with a mixing density m of the decay rate r. Discretizing the mixture with the trapezoidal rule in u=log(r)
+    gives a sum of exponential decays; the rule converges like exp(-2*pi*d/h) in the step h, d being the width of
+    the strip around the real axis in which the integrand is analytic.
+
+    Subclasses provide setParams/getParams, getMixingDensity, getLowerTailMass, getAnalyticStripWidth and
+    the exact getWArray/getWBarArray/getQArray.
+    """
+
+    def __init__(self,params,epsilon=1e-5,numExponentialTerms=None,tolerance=None):
+        """
+        :param epsilon: Decay mass ignored beyond the quantile getQ(), bounds the error of the truncated evaluations
+        :param numExponentialTerms,tolerance: Give one to evaluate the likelihood and intensities through the
+            sum-of-exponentials representation (getExponentialTerms), recursively in O(N*terms) instead of over the
+            quantile window; tolerance is the target error of 1-wBar. Without either the kernel is evaluated exactly.
+        """
+        if numExponentialTerms is not None and numExponentialTerms<2:
+            raise ValueError("At least two exponential terms are needed")
+        self.epsilon=epsilon #For Q function
+        self.numExponentialTerms=numExponentialTerms
+        self.tolerance=tolerance
+        self.setParams(params)
+
+    def _clearCache(self):
+        self._cache={}
+
+    def _getCached(self,key,compute):
+        if key not in self._cache:
+            self._cache[key]=compute()
+        return self._cache[key]
+
+    def getW(self,t):
+        """Get value of decay function"""
+        return float(self.getWArray(np.array([t],dtype=float))[0])
+
+    def getWBar(self,t):
+        """Get value of cumulative decay function"""
+        return float(self.getWBarArray(np.array([t],dtype=float))[0])
+
+    def getQ(self,epsilon=None):
+        """
+        Get value of quantile function: the time after which only epsilon of the decay mass is left,
+        i.e. getWBar(getQ(epsilon))=1-epsilon. Defaults to self.epsilon
+        """
+        if epsilon is None:
+            epsilon=self.epsilon
+        return self._getCached(('q',epsilon),lambda: float(self.getQArray(np.array([epsilon],dtype=float))[0]))
+
+    def getQuadratureTerms(self,minRate,maxRate,step):
+        """
+        Trapezoidal rule for the rate mixture on [minRate,maxRate] with step in log(rate), as (weights,rates).
+        The mass below minRate is added to the first weight and the rest of the mass to the last, so the weights sum to one.
+        """
+        numTerms=max(int(math.ceil((math.log(maxRate)-math.log(minRate))/step))+1,2)
+        logRates=np.linspace(math.log(minRate),math.log(maxRate),numTerms)
+        rates=np.exp(logRates)
+        weights=(logRates[1]-logRates[0])*self.getMixingDensity(rates)*rates
+        weights[0]+=self.getLowerTailMass(minRate)
+        weights[-1]+=max(1.0-np.sum(weights),0.0)
+        return weights,rates
+
+    def getStepForTolerance(self,tolerance):
+        """Estimated step in log(rate) for which the trapezoidal rule error is about tolerance"""
+        return 2.0*math.pi*self.getAnalyticStripWidth()/(math.log(1.0/tolerance)+self.getLogStripGrowth())
+
+    def getLogStripGrowth(self):
+        """Log of how much larger the integrand gets at the edge of the analytic strip, raises the error constant"""
+        return 0.0
+
+    def getApproximationRange(self):
+        """
+        Rates that matter between the times at which epsilon of the decay mass has passed and at which epsilon is left:
+        slower rates are nearly constant and faster ones have decayed over that range
+        """
+        shortestTime=self.getQ(1.0-self.epsilon)
+        longestTime=self.getQ()
+        return self.epsilon/longestTime,-math.log(self.epsilon)/shortestTime
+
+    def getExponentialTerms(self):
+        """
+        Sum-of-exponentials representation as (weights,rates), None unless numExponentialTerms or tolerance was given.
+        w(t) is approximated by sum_i weights[i]*rates[i]*exp(-rates[i]*t); with tolerance getApproximationError is
+        at most tolerance (or as small as the search below reaches).
+        """
+        if self.numExponentialTerms is None and self.tolerance is None:
+            return None
+
+        def compute():
+            minRate,maxRate=self.getApproximationRange()
+            if self.numExponentialTerms is not None:
+                step=(math.log(maxRate)-math.log(minRate))/(self.numExponentialTerms-1)
+                return self.getQuadratureTerms(minRate,maxRate,step)
+            return self.__getTermsForTolerance(minRate,maxRate,self.tolerance)
+
+        return self._getCached('exponentialTerms',compute)
+
+    def __getTermsForTolerance(self,minRate,maxRate,tolerance):
+        """
+        Terms with about the largest step whose approximation error is at most tolerance. getStepForTolerance only
+        estimates the error constant, so its step is doubled or halved until the error crosses tolerance and the
+        bracket is then bisected in log(step). Below the reachable error the smallest step tried is used.
+        """
+        times=self.__getApproximationTimes()
+        survival=1.0-self.getWBarArray(times)
+
+        def getTermsAndError(step):
+            weights,rates=self.getQuadratureTerms(minRate,maxRate,step)
+            return (weights,rates),np.max(np.abs(np.exp(-np.outer(times,rates)).dot(weights)-survival))
+
+        step=self.getStepForTolerance(tolerance)
+        terms,error=getTermsAndError(step)
+        goodStep,goodTerms,badStep=None,None,None
+        if error<=tolerance:
+            goodStep,goodTerms=step,terms
+            for searchStep in range(0,MAX_STEP_SEARCH_STEPS):
+                step*=2.0
+                terms,error=getTermsAndError(step)
+                if error>tolerance:
+                    badStep=step
+                    break
+                goodStep,goodTerms=step,terms
+        else:
+            badStep=step
+            for searchStep in range(0,MAX_STEP_SEARCH_STEPS):
+                step*=0.5
+                terms,error=getTermsAndError(step)
+                if error<=tolerance:
+                    goodStep,goodTerms=step,terms
+                    break
+                badStep=step
+            if goodStep is None:
+                return terms
+        if badStep is None:
+            return goodTerms
+
+        for bisection in range(0,STEP_BISECTIONS):
+            step=math.sqrt(goodStep*badStep)
+            terms,error=getTermsAndError(step)
+            if error<=tolerance:
+                goodStep,goodTerms=step,terms
+            else:
+                badStep=step
+        return goodTerms
+
+    def __getApproximationTimes(self,numPoints=APPROXIMATION_ERROR_POINTS):
+        return np.logspace(math.log10(self.getQ(1.0-self.epsilon)),math.log10(self.getQ()),numPoints)
+
+    def getApproximationError(self,numPoints=APPROXIMATION_ERROR_POINTS):
+        """Largest error of 1-wBar(t) of getExponentialTerms, on a log grid between the epsilon quantiles"""
+        weights,rates=self.getExponentialTerms()
+        times=self.__getApproximationTimes(numPoints)
+        approximation=np.exp(-np.outer(times,rates)).dot(weights)
+        return np.max(np.abs(approximation-(1.0-self.getWBarArray(times))))
+
+
+class PowerLawDecayFunction(_CompletelyMonotoneDecayFunction):
+    """
+    Power-law (Lomax) decay function, the heavy tailed alternative of Liniger thesis p. 32:
+        w(t)=rho/psi*(1+t/psi)^-(rho+1), 1-wBar(t)=(1+t/psi)^-rho
+    The survival function is the Laplace transform of a Gamma(rho,psi) distributed decay rate.
+    """
+
+    @staticmethod
+    def getNumParameters():
+        return 2
+
+    @staticmethod
+    def getParameterBounds():
+        return [[1e-5,None],[1e-5,None]]
+
+    def setParams(self,params):
+        """
+        Set parameters with an iterable to support log-likelihood calculation
+        This will set rho=params[0], psi=params[1]
+        """
+        self.rho=params[0]
+        self.psi=params[1]
+        self._clearCache()
+
+    def getParams(self):
+        """Current parameters in the order of setParams"""
+        return [self.rho,self.psi]
+
+    def getW(self,t):
+        return self.rho/self.psi*(1.0+t/self.psi)**(-self.rho-1.0)
+
+    def getWBar(self,t):
+        return 1.0-(1.0+t/self.psi)**(-self.rho)
+
+    def getWArray(self,t):
+        """getW for an array of times"""
+        return self.rho/self.psi*(1.0+np.asarray(t,dtype=float)/self.psi)**(-self.rho-1.0)
+
+    def getWBarArray(self,t):
+        """getWBar for an array of times"""
+        return -np.expm1(-self.rho*np.log1p(np.asarray(t,dtype=float)/self.psi))
+
+    def getQ(self,epsilon=None):
+        if epsilon is None:
+            epsilon=self.epsilon
+        return self.psi*(epsilon**(-1.0/self.rho)-1.0)
+
+    def getQArray(self,epsilon):
+        """getQ for an array of epsilons"""
+        return self.psi*np.expm1(-np.log(np.asarray(epsilon,dtype=float))/self.rho)
+
+    def getMixingDensity(self,rates):
+        """Gamma(rho,psi) density of the decay rate"""
+        rates=np.asarray(rates,dtype=float)
+        return np.exp(self.rho*math.log(self.psi)+(self.rho-1.0)*np.log(rates)-self.psi*rates-scipy.special.gammaln(self.rho))
+
+    def getLowerTailMass(self,rate):
+        return scipy.special.gammainc(self.rho,self.psi*rate)
+
+    def getAnalyticStripWidth(self):
+        #Analytic up to pi/2, but the Laplace integrand grows like cos(d)^-rho towards it
+        return math.pi/4.0
+
+    def getLogStripGrowth(self):
+        return 0.5*self.rho*math.log(2.0)
+
+
+class MittagLefflerDecayFunction(_CompletelyMonotoneDecayFunction):
+    """
+    Mittag-Leffler decay function, the density of the Mittag-Leffler distribution with index beta in (0,1):
+        1-wBar(t)=E_beta(-(t/tau)^beta)
+    It decays like t^(beta-1) near zero and t^-(beta+1) in the tail, interpolating between a stretched exponential
+    and a power law; beta=1 would be the exponential decay function with alpha=1/tau.
+    The survival function is a mixture of exponentials with rate density
+        m(r)=tau/pi*sin(beta*pi)*(r*tau)^(beta-1)/((r*tau)^(2*beta)+2*(r*tau)^beta*cos(beta*pi)+1)
+    and the exact evaluation is that mixture to EXACT_QUADRATURE_TOLERANCE.
+    """
+
+    @staticmethod
+    def getNumParameters():
+        return 2
+
+    @staticmethod
+    def getParameterBounds():
+        return [[0.1,0.99],[1e-5,None]]
+
+    def setParams(self,params):
+        """
+        Set parameters with an iterable to support log-likelihood calculation
+        This will set beta=params[0], tau=params[1]
+        """
+        self.beta=params[0]
+        self.tau=params[1]
+        self._clearCache()
+
+    def getParams(self):
+        """Current parameters in the order of setParams"""
+        return [self.beta,self.tau]
+
+    def getMixingDensity(self,rates):
+        scaledRates=np.asarray(rates,dtype=float)*self.tau
+        poweredRates=scaledRates**self.beta
+        return self.tau/math.pi*math.sin(self.beta*math.pi)*poweredRates/scaledRates/(poweredRates*poweredRates+2.0*poweredRates*math.cos(self.beta*math.pi)+1.0)
+
+    def getLowerTailMass(self,rate):
+        """m(r)~tau/pi*sin(beta*pi)*(r*tau)^(beta-1) for small rates"""
+        return min(math.sin(self.beta*math.pi)/(math.pi*self.beta)*(rate*self.tau)**self.beta,1.0)
+
+    def getAnalyticStripWidth(self):
+        #Poles of the density in log(rate) at distance pi*(1-beta)/beta from the real axis
+        return min(math.pi/2.0,math.pi*(1.0-self.beta)/self.beta)
+
+    def __getExactTerms(self):
+        def compute():
+            tailMass=EXACT_QUADRATURE_TOLERANCE*math.pi*self.beta/math.sin(self.beta*math.pi)
+            minRate=tailMass**(1.0/self.beta)/self.tau
+            maxRate=tailMass**(-1.0/self.beta)/self.tau
+            return self.getQuadratureTerms(minRate,maxRate,self.getStepForTolerance(EXACT_QUADRATURE_TOLERANCE))
+        return self._getCached('exactTerms',compute)
+
+    def __getQuadratureSums(self,t,function):
+        """sum_i weights[i]*function(rates[i],t), chunked over t"""
+        weights,rates=self.__getExactTerms()
+        t=np.asarray(t,dtype=float)
+        flatTimes=t.ravel()
+        result=np.zeros(len(flatTimes))
+        chunkSize=max(QUADRATURE_CHUNK_ELEMENTS//len(rates),1)
+        for start in range(0,len(flatTimes),chunkSize):
+            chunk=flatTimes[start:start+chunkSize]
+            result[start:start+chunkSize]=function(rates[np.newaxis,:],chunk[:,np.newaxis]).dot(weights)
+        return result.reshape(t.shape)
+
+    def getWArray(self,t):
+        """getW for an array of times"""
+        return self.__getQuadratureSums(t,lambda rates,times: rates*np.exp(-rates*times))
+
+    def getWBarArray(self,t):
+        """getWBar for an array of times"""
+        return self.__getQuadratureSums(t,lambda rates,times: -np.expm1(-rates*times))
+
+    def __getSurvivalTransform(self,t):
+        """log(-log(1-wBar(t))), increasing in t, computed without cancellation at both ends"""
+        wBar=self.getWBarArray(t)
+        survival=self.__getQuadratureSums(t,lambda rates,times: np.exp(-rates*times))
+        minusLogSurvival=np.where(wBar<0.5,-np.log1p(-np.minimum(wBar,0.5)),-np.log(np.maximum(survival,1e-300)))
+        return np.log(np.maximum(minusLogSurvival,1e-300))
+
+    def __getQuantileTable(self):
+        """log(t) against the survival transform, over survival functions 1-1e-14 to 1e-14"""
+        def compute():
+            logTau=math.log(self.tau)
+            minLogTime=logTau+(math.log(1e-14)+scipy.special.gammaln(1.0+self.beta))/self.beta
+            maxLogTime=logTau+(math.log(1e14)-scipy.special.gammaln(1.0-self.beta))/self.beta+math.log(10.0)
+            logTimes=np.linspace(minLogTime,maxLogTime,QUANTILE_TABLE_SIZE)
+            return self.__getSurvivalTransform(np.exp(logTimes)),logTimes
+        return self._getCached('quantileTable',compute)
+
+    def getQArray(self,epsilon):
+        """getQ for an array of epsilons, interpolated in a table of the survival function and refined by Newton steps"""
+        epsilon=np.clip(np.asarray(epsilon,dtype=float),1e-14,1.0-1e-14)
+        targets=np.log(-np.log(epsilon))
+        transforms,logTimes=self.__getQuantileTable()
+        logQuantiles=np.interp(targets,transforms,logTimes)
+
+        for newtonStep in range(0,2):
+            times=np.exp(logQuantiles)
+            survivalTransforms=self.__getSurvivalTransform(times)
+            survival=np.exp(-np.exp(survivalTransforms))
+            #d/dlog(t) of log(-log(S)) is t*w(t)/(S*(-log S))
+            slopes=times*self.getWArray(times)/(survival*np.exp(survivalTransforms))
+            logQuantiles=logQuantiles-(survivalTransforms-targets)/np.maximum(slopes,1e-12)
+
+        return np.exp(logQuantiles)
@@ -0,0 +1,39 @@
+__author__ = 'tjohnson'
+
+import unittest
+import DecayFunctions
+
+
+class ExponentialTermsTest(unittest.TestCase):
+    def assertWithinTolerance(self,decayFunctionClass,params,tolerance):
+        decayFunction=decayFunctionClass(params,tolerance=tolerance)
+        self.assertLessEqual(decayFunction.getApproximationError(),tolerance,
+                             "%s%s at tolerance %g" % (decayFunctionClass.__name__,params,tolerance))
+        return len(decayFunction.getExponentialTerms()[1])
+
+    def testMittagLefflerWithinTolerance(self):
+        for beta in [0.3,0.5,0.7,0.9]:
+            for tolerance in [1e-2,1e-4,1e-6]:
+                self.assertWithinTolerance(DecayFunctions.MittagLefflerDecayFunction,[beta,2.0],tolerance)
+
+    def testPowerLawWithinTolerance(self):
+        for rho in [0.5,1.5,4.0]:
+            for tolerance in [1e-2,1e-4,1e-6,1e-8]:
+                self.assertWithinTolerance(DecayFunctions.PowerLawDecayFunction,[rho,2.0],tolerance)
+
+    def testLooserToleranceUsesFewerTerms(self):
+        #The terms are not much tighter than asked: a 100 times looser tolerance saves terms
+        for decayFunctionClass,params in [(DecayFunctions.PowerLawDecayFunction,[1.5,2.0]),
+                                          (DecayFunctions.MittagLefflerDecayFunction,[0.7,2.0])]:
+            self.assertLess(self.assertWithinTolerance(decayFunctionClass,params,1e-4),
+                            self.assertWithinTolerance(decayFunctionClass,params,1e-6))
+
+    def testTermsFollowParameters(self):
+        decayFunction=DecayFunctions.PowerLawDecayFunction([1.5,2.0],tolerance=1e-4)
+        decayFunction.getExponentialTerms()
+        decayFunction.setParams([3.0,0.5])
+        self.assertLessEqual(decayFunction.getApproximationError(),1e-4)
+
+
+if __name__=='__main__':
+    unittest.main()
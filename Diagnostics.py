@@ -0,0 +1,89 @@
+__author__ = 'tjohnson'
+import numpy as np
+import scipy.stats
+import EventStore
+import MultiSequenceDataset
+
+#Autocorrelation lags of the Ljung-Box test by default
+DEFAULT_LJUNG_BOX_LAGS=20
+
+
+def getRescaledInterEventTimes(hawkesProcess,events):
+    """
+    Time-rescaling residuals: for every component j the compensator increments Lambda_j(t_{i+1})-Lambda_j(t_i)
+    between consecutive events of j, which are iid Exp(1) if the model is correct.
+
+    The compensators at all event times come from one getLambdaOnGrid pass, recursive for decay functions with
+    exponential terms and over the decay quantile window otherwise (older events count with wBar=1, as the
+    truncated getCompensator), so the cost is that of a likelihood evaluation rather than one getCompensator per event.
+
+    :param events: EventStore, triplets or a MultiSequenceDataset, whose sequences are rescaled separately and
+        concatenated
+    :return: List of K arrays
+    """
+    if isinstance(events,MultiSequenceDataset.MultiSequenceDataset):
+        sequenceTimes=[getRescaledInterEventTimes(hawkesProcess,sequence) for sequence in events]
+        return [np.concatenate([np.zeros(0)]+[times[j] for times in sequenceTimes]) for j in range(0,hawkesProcess.numComponents)]
+
+    eventStore=EventStore.asEventStore(events,hawkesProcess.numComponents)
+    lambdas,compensators=hawkesProcess.getLambdaOnGrid(eventStore,eventStore.times,returnCompensator=True)
+    rescaledTimes=[]
+    for j in range(0,hawkesProcess.numComponents):
+        indices=eventStore.getComponentIndices(j)
+        rescaledTimes.append(np.diff(compensators[indices,j]))
+    return rescaledTimes
+
+
+def getKolmogorovSmirnov(rescaledTimes):
+    """Kolmogorov-Smirnov test of the rescaled times against Exp(1), (statistic,pValue)"""
+    statistic,pValue=scipy.stats.kstest(rescaledTimes,'expon')
+    return statistic,pValue
+
+
+def getLjungBox(rescaledTimes,numLags=DEFAULT_LJUNG_BOX_LAGS):
+    """
+    Ljung-Box test for serial correlation of the rescaled times,
+    Q=n(n+2)*sum_{k=1..h} rho_k^2/(n-k), chi-squared with h degrees of freedom
+    :return: (statistic,pValue,autocorrelations) with the autocorrelations at lags 1..h
+    """
+    n=len(rescaledTimes)
+    numLags=min(numLags,n-1)
+    if numLags<1:
+        return np.nan,np.nan,np.zeros(0)
+    centered=rescaledTimes-np.mean(rescaledTimes)
+    variance=centered.dot(centered)
+    autocorrelations=np.array([centered[lag:].dot(centered[:n-lag]) for lag in range(1,numLags+1)])/variance
+    statistic=n*(n+2.0)*np.sum(autocorrelations**2/(n-np.arange(1,numLags+1)))
+    return statistic,scipy.stats.chi2.sf(statistic,numLags),autocorrelations
+
+
+def getQQ(rescaledTimes,numPoints=None):
+    """
+    Exp(1) QQ plot data, (theoreticalQuantiles,empiricalQuantiles) at plotting positions (i-0.5)/n,
+    thinned to numPoints evenly spaced order statistics if given
+    """
+    sortedTimes=np.sort(rescaledTimes)
+    n=len(sortedTimes)
+    positions=np.arange(n)
+    if numPoints is not None and numPoints<n:
+        positions=np.unique(np.linspace(0,n-1,numPoints).astype(np.int64))
+    return -np.log1p(-(positions+0.5)/n),sortedTimes[positions]
+
+
+def getGoodnessOfFit(hawkesProcess,events,numLags=DEFAULT_LJUNG_BOX_LAGS,numQQPoints=None):
+    """
+    getRescaledInterEventTimes with the tests of every component
+    :return: List of K dicts with keys rescaledTimes, ksStatistic, ksPValue, ljungBoxStatistic, ljungBoxPValue,
+        autocorrelations, qqTheoretical and qqEmpirical
+    """
+    results=[]
+    for rescaledTimes in getRescaledInterEventTimes(hawkesProcess,events):
+        result={'rescaledTimes':rescaledTimes}
+        if len(rescaledTimes)>0:
+            result['ksStatistic'],result['ksPValue']=getKolmogorovSmirnov(rescaledTimes)
+        else:
+            result['ksStatistic'],result['ksPValue']=np.nan,np.nan
+        result['ljungBoxStatistic'],result['ljungBoxPValue'],result['autocorrelations']=getLjungBox(rescaledTimes,numLags)
+        result['qqTheoretical'],result['qqEmpirical']=getQQ(rescaledTimes,numQQPoints)
+        results.append(result)
+    return results
@@ -0,0 +1,246 @@
+__author__ = 'tjohnson'
+import numpy as np
+import CompiledDataset
+import ExponentialSums
+import GenuineMultivariateHawkesProcessFitter
+
+#Newton steps of the decay rate M-step and their convergence tolerance in log(alpha)
+MAX_NEWTON_STEPS=50
+NEWTON_TOLERANCE=1e-12
+
+
+class EMFitter:
+    def __init__(self,hawkesProcess):
+        """
+        Expectation-maximization for the immigrant/descendant (branching) form of the process, Liniger thesis p. 26.
+        Every event of component j is an immigrant with probability nu_j/lambda_j(t) or a child of an earlier event s
+        with probability q[j,k]*g_k(x)*w_j(t-s)/lambda_j(t). Given these responsibilities nu and q have closed-form
+        updates and every exponential decay rate a one-dimensional Newton M-step (q profiled out, finite horizon of
+        the compensator included), so an iteration costs one likelihood evaluation and every iterate stays feasible.
+
+        Responsibilities are never stored per (child,parent) pair: their sums are windowed exponential sums
+        (ExponentialSums) over the parents inside the decay quantile getQ(), the same window as getLogLikelihood,
+        so memory is O(N*sources) per target component. Requires exponential decay functions.
+
+        The parameter vector has the layout of GenuineMultivariateHawkesProcessFitter, components sharing a decay
+        function instance share its rate.
+        """
+        if not hawkesProcess.hasExponentialDecayFunctions():
+            raise ValueError("EM updates require ExponentialDecayFunction for every component, got %s"
+                             % ', '.join(decayFunction.__class__.__name__ for decayFunction in hawkesProcess.decayFunctions))
+        self.hawkesProcess=hawkesProcess
+        self.fitter=GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(hawkesProcess)
+        self.numParams=self.fitter.numParams
+        self.parameterBounds=self.fitter.parameterBounds
+
+    def __getColumnWeights(self,componentIdx,eventStore,impacts):
+        """Source event times of component j and their impacts g_k(x), one column per source component"""
+        sources=self.hawkesProcess.immigrationDescendantParameters.getSourceComponents(componentIdx)
+
+        def compute():
+            componentIndices=[eventStore.getComponentIndices(k) for k in sources]
+            positions=np.sort(np.concatenate(componentIndices+[np.zeros(0,dtype=np.int64)]))
+            columns=np.zeros(len(positions),dtype=np.int64)
+            for column,indices in enumerate(componentIndices):
+                columns[np.searchsorted(positions,indices)]=column
+            return positions,columns
+
+        positions,columns=eventStore.getCached(('emColumns',tuple(sources)),compute)
+        columnWeights=np.zeros([len(positions),len(sources)])
+        columnWeights[np.arange(len(positions)),columns]=impacts[positions]
+        return sources,eventStore.times[positions],columnWeights
+
+    def __getProfileObjective(self,logAlpha,childCount,ageSum,exposureTerms):
+        """
+        f(alpha)=C*log(alpha)-alpha*A-sum_{j,k} n_jk*log(E_jk(alpha)), the expected complete log-likelihood with q
+        at its optimum n_jk/E_jk(alpha) for every (target,source) pair, E_jk(alpha)=sum_s g*(1-exp(-alpha*(T-s)))
+        :return: (f,df/dlogAlpha,d2f/dlogAlpha2)
+        """
+        alpha=np.exp(logAlpha)
+        value=childCount*logAlpha-alpha*ageSum
+        firstDerivative=childCount/alpha-ageSum
+        secondDerivative=-childCount/alpha**2
+        for counts,timesToEnd,columnWeights in exposureTerms:
+            decays=np.exp(-alpha*timesToEnd)
+            exposures=np.maximum(np.sum(columnWeights,axis=0)-decays.dot(columnWeights),1e-300)
+            exposureDerivatives=(timesToEnd*decays).dot(columnWeights)
+            exposureSecondDerivatives=-(timesToEnd**2*decays).dot(columnWeights)
+            value-=counts.dot(np.log(exposures))
+            firstDerivative-=counts.dot(exposureDerivatives/exposures)
+            secondDerivative-=counts.dot((exposureSecondDerivatives*exposures-exposureDerivatives**2)/exposures**2)
+        return value,alpha*firstDerivative,alpha*firstDerivative+alpha**2*secondDerivative
+
+    def __maximizeDecayRate(self,alpha,childCount,ageSum,exposureTerms,bounds):
+        """Newton steps in log(alpha) on __getProfileObjective, halved until the objective does not decrease"""
+        lowerBound,upperBound=bounds
+        logAlpha=np.log(alpha)
+        value,gradient,curvature=self.__getProfileObjective(logAlpha,childCount,ageSum,exposureTerms)
+        for step in range(0,MAX_NEWTON_STEPS):
+            direction=-gradient/curvature if curvature<0 else np.sign(gradient)
+            accepted=False
+            while abs(direction)>NEWTON_TOLERANCE:
+                candidate=logAlpha+direction
+                if lowerBound is not None:
+                    candidate=max(candidate,np.log(lowerBound))
+                if upperBound is not None:
+                    candidate=min(candidate,np.log(upperBound))
+                candidateValue,candidateGradient,candidateCurvature=self.__getProfileObjective(candidate,childCount,ageSum,exposureTerms)
+                if candidateValue>=value:
+                    accepted=True
+                    break
+                direction*=0.5
+            if not accepted:
+                break
+            stepLength=abs(candidate-logAlpha)
+            logAlpha,value,gradient,curvature=candidate,candidateValue,candidateGradient,candidateCurvature
+            if stepLength<=NEWTON_TOLERANCE:
+                break
+        return np.exp(logAlpha)
+
+    def __clip(self,value,bounds):
+        lowerBound,upperBound=bounds
+        if lowerBound is not None:
+            value=max(value,lowerBound)
+        if upperBound is not None:
+            value=min(value,upperBound)
+        return value
+
+    def emStep(self,params,eventStore):
+        """
+        One EM iteration from params
+        :return: (newParams,logLikelihood) where logLikelihood is getLogLikelihood at params, a by-product of the E-step
+        """
+        hawkesProcess=self.hawkesProcess
+        numComponents=hawkesProcess.numComponents
+        immigrationDescendantParameters=hawkesProcess.immigrationDescendantParameters
+        decayIndices,markIndices=self.fitter.getComponentParameterIndices()
+        self.fitter.setParameterValues(params)
+
+        impacts=np.zeros(len(eventStore))
+        logLikelihood=0.0
+        for k in range(0,numComponents):
+            indices=eventStore.getComponentIndices(k)
+            marks=eventStore.marks[indices]
+            impacts[indices]=hawkesProcess.markDistributions[k].getImpactFunctionArray(marks)
+            logLikelihood+=np.sum(np.log(hawkesProcess.markDistributions[k].getDensityFunctionArray(marks)))
+
+        firstTime,lastTime=eventStore.getObservationWindow()
+        nu=immigrationDescendantParameters.nu
+        q=immigrationDescendantParameters.q
+
+        #Expected number of immigrants and of children per (target,source) pair, and of children per decay rate
+        #with their summed ages, pooled over components sharing a decay function
+        immigrantCounts=np.zeros(numComponents)
+        childCounts=[]
+        decayCounts={}
+        decayAges={}
+        decayExposureTerms={}
+        for j in range(0,numComponents):
+            alpha=hawkesProcess.decayFunctions[j].alpha
+            window=hawkesProcess.decayFunctions[j].getQ()
+            sources,times,columnWeights=self.__getColumnWeights(j,eventStore,impacts)
+            sourceQ=q[j,sources]
+            decayKey=tuple(decayIndices[j])
+
+            #Compensator at params, untruncated like getLogLikelihood
+            remainders=np.exp(-alpha*(lastTime-times)).dot(columnWeights)
+            logLikelihood-=nu[j]*(lastTime-firstTime)+sourceQ.dot(np.sum(columnWeights,axis=0)-remainders)
+
+            targetTimes=eventStore.times[eventStore.getComponentIndices(j)]
+            if len(targetTimes)==0:
+                childCounts.append(np.zeros(len(sources)))
+                continue
+            windowBounds=ExponentialSums.getWindowBounds(times,window,targetTimes)
+            sums=ExponentialSums.getWindowedExponentialSums(times,columnWeights,alpha,window,targetTimes,windowBounds=windowBounds)
+            ageSums=ExponentialSums.getWindowedExponentialSums(times,columnWeights,alpha,window,targetTimes,timeWeighted=True,windowBounds=windowBounds)
+
+            lambdas=nu[j]+alpha*sums.dot(sourceQ)
+            inverseLambdas=1.0/lambdas
+            logLikelihood+=np.sum(np.log(lambdas))
+
+            immigrantCounts[j]=nu[j]*np.sum(inverseLambdas)
+            childCounts.append(alpha*sourceQ*inverseLambdas.dot(sums))
+            decayCounts[decayKey]=decayCounts.get(decayKey,0.0)+np.sum(childCounts[j])
+            decayAges[decayKey]=decayAges.get(decayKey,0.0)+alpha*inverseLambdas.dot(ageSums).dot(sourceQ)
+            decayExposureTerms.setdefault(decayKey,[]).append((childCounts[j],lastTime-times,columnWeights))
+
+        #M-step: the decay rate maximizes the expected complete log-likelihood with q profiled out, including the
+        #finite horizon of the compensator, then nu and q are closed-form given the new rates
+        newParams=np.array(params,dtype=float)
+        for decayKey in decayCounts:
+            if decayAges[decayKey]>0:
+                alpha=self.__maximizeDecayRate(newParams[decayKey[0]],decayCounts[decayKey],decayAges[decayKey],
+                                               decayExposureTerms[decayKey],self.parameterBounds[decayKey[0]])
+                newParams[decayKey[0]]=self.__clip(alpha,self.parameterBounds[decayKey[0]])
+
+        for j in range(0,numComponents):
+            alpha=newParams[decayIndices[j][0]]
+            sources,times,columnWeights=self.__getColumnWeights(j,eventStore,impacts)
+            exposures=np.sum(columnWeights,axis=0)-np.exp(-alpha*(lastTime-times)).dot(columnWeights)
+
+            targetParameterIndices=immigrationDescendantParameters.getTargetParameterIndices(j)
+            values=[immigrantCounts[j]/(lastTime-firstTime)]
+            values.extend(np.where(exposures>0,childCounts[j]/np.maximum(exposures,1e-300),0.0))
+            for idx,value in zip(targetParameterIndices,values):
+                newParams[idx]=self.__clip(value,self.parameterBounds[idx])
+
+        return newParams,logLikelihood
+
+    def maximizeLikelihood(self,timeComponentMarkTriples,initialGuess,tolerance=1e-8,maxIterations=1000,optimizeMarks=True,maxRounds=10,
+                           parameterTolerance=1e-6):
+        """
+        EM iterations for nu, q and the decay rates with the mark parameters fixed, until an iteration improves the
+        log-likelihood by less than tolerance*(1+|logLikelihood|) and changes no parameter by more than
+        parameterTolerance*(1+|parameter|), as EM can progress slowly along flat directions. With optimizeMarks the mark parameters are then
+        fitted by L-BFGS-B, warm-started from their current values with the other parameters fixed, and the two
+        phases alternate until a round improves by less than the same tolerance, at most maxRounds times.
+
+        :return: (bestParams,negativeLogLikelihood,infoDict) with infoDict keys iterations, rounds, converged,
+            logLikelihoods (one per EM iteration) and gradientNorm, the norm of the negative log-likelihood gradient at
+            bestParams over the optimized parameters, with the components blocked by an active bound set to zero
+        """
+        eventStore=CompiledDataset.asCompiledDataset(timeComponentMarkTriples,self.hawkesProcess.numComponents)
+        decayIndices,markIndices=self.fitter.getComponentParameterIndices()
+        markBlock=sorted(set(idx for indices in markIndices for idx in indices))
+        optimizeMarks=optimizeMarks and len(markBlock)>0
+
+        params=np.array(initialGuess,dtype=float)
+        logLikelihoods=[]
+        numIterations=0
+        numRounds=0
+        converged=False
+        value=None
+        while numRounds<maxRounds and not converged:
+            numRounds+=1
+            roundStartValue=value
+
+            emConverged=False
+            while numIterations<maxIterations and not emConverged:
+                numIterations+=1
+                newParams,logLikelihood=self.emStep(params,eventStore)
+                logLikelihoods.append(logLikelihood)
+                parameterChange=np.max(np.abs(newParams-params)/(1.0+np.abs(params)))
+                emConverged=(len(logLikelihoods)>1 and logLikelihood-logLikelihoods[-2]<=tolerance*(1.0+abs(logLikelihood))
+                             and parameterChange<=parameterTolerance)
+                params=newParams
+            value=self.fitter.getNegativeLogLikelihood(params,eventStore)
+
+            if optimizeMarks:
+                objective=lambda x: self.fitter.getNegativeLogLikelihoodAndGradient(x,eventStore)
+                params[markBlock]=GenuineMultivariateHawkesProcessFitter._optimizeParameterBlock(self.fitter,params,markBlock,objective)
+                value=self.fitter.getNegativeLogLikelihood(params,eventStore)
+
+            roundConverged=roundStartValue is not None and roundStartValue-value<=tolerance*(1.0+abs(value))
+            converged=emConverged and (not optimizeMarks or roundConverged)
+            if numIterations>=maxIterations:
+                break
+
+        value,gradient=self.fitter.getNegativeLogLikelihoodAndGradient(params,eventStore)
+        for idx,(lowerBound,upperBound) in enumerate(self.parameterBounds):
+            if (lowerBound is not None and params[idx]<=lowerBound and gradient[idx]>0) or (upperBound is not None and params[idx]>=upperBound and gradient[idx]<0):
+                gradient[idx]=0.0
+        if not optimizeMarks:
+            gradient[markBlock]=0.0
+        self.fitter.setParameterValues(params)
+        return params,value,{'iterations':numIterations,'rounds':numRounds,'converged':converged,'logLikelihoods':np.array(logLikelihoods),
+                             'gradientNorm':np.sqrt(np.sum(gradient**2))}
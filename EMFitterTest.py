@@ -0,0 +1,51 @@
+__author__ = 'tjohnson'
+
+import unittest
+import numpy as np
+import ClusterSimulator
+import DecayFunctions
+import EMFitter
+import GenuineMultivariateHawkesProcess
+import GenuineMultivariateHawkesProcessFitter
+import ImmigrationDescendantParameters
+import MarkDistributions
+
+
+def buildProcess(markDistributions):
+    return GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        ImmigrationDescendantParameters.ImmigrationDescendantParameters(2,[0.2,0.1,0.3,0.2,0.1,0.4]),
+        [DecayFunctions.ExponentialDecayFunction([1.0]),DecayFunctions.ExponentialDecayFunction([0.5])],
+        markDistributions)
+
+
+class EMFitterTest(unittest.TestCase):
+    def assertMatchesLbfgs(self,hawkesProcess,initialGuess):
+        events=ClusterSimulator.ClusterSimulator(hawkesProcess).simulate(2000.0,17,numWorkers=1)
+        emParams,emValue,emInfo=EMFitter.EMFitter(hawkesProcess).maximizeLikelihood(events,initialGuess,tolerance=1e-10)
+        fitter=GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(hawkesProcess)
+        lbfgsParams,lbfgsValue,lbfgsInfo=fitter.maximizeLikelihood(events,initialGuess)
+
+        self.assertTrue(emInfo['converged'])
+        #EM never decreases the likelihood
+        self.assertTrue(np.all(np.diff(emInfo['logLikelihoods'])>=-1e-8*np.abs(emInfo['logLikelihoods'][1:])))
+        self.assertAlmostEqual(emValue/lbfgsValue,1.0,places=6)
+        np.testing.assert_allclose(emParams,lbfgsParams,rtol=1e-2,atol=1e-3)
+
+    def testMatchesLbfgsWithoutMarks(self):
+        hawkesProcess=buildProcess([MarkDistributions.VoidMarkDistribution([]),MarkDistributions.VoidMarkDistribution([])])
+        self.assertMatchesLbfgs(hawkesProcess,[0.3,0.3,0.2,0.2,0.2,0.2,0.8,0.8])
+
+    def testMatchesLbfgsWithMarks(self):
+        hawkesProcess=buildProcess([MarkDistributions.ExponentialMarkDistribution1Param([1.0,0.5]),
+                                    MarkDistributions.ExponentialMarkDistribution1Param([2.0,0.3])])
+        self.assertMatchesLbfgs(hawkesProcess,[0.3,0.3,0.2,0.2,0.2,0.2,0.8,1.5,0.2,0.8,1.5,0.2])
+
+    def testRequiresExponentialDecayFunctions(self):
+        hawkesProcess=GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+            ImmigrationDescendantParameters.ImmigrationDescendantParameters(1,[0.2,0.3]),
+            [DecayFunctions.PowerLawDecayFunction([2.0,1.0])],[MarkDistributions.VoidMarkDistribution([])])
+        self.assertRaises(ValueError,EMFitter.EMFitter,hawkesProcess)
+
+
+if __name__=='__main__':
+    unittest.main()
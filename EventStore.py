@@ -0,0 +1,185 @@
+__author__ = 'tjohnson'
+import numpy as np
+
+FILE_MAGIC='PYHAWKES'
+FILE_VERSION=2
+#magic, version (uint32), numComponents (uint32), numEvents (uint64), then from version 2 the observation window
+#startTime, endTime (float64, NaN when not set)
+HEADER_DTYPES={1:[('magic','S8'),('version','<u4'),('numComponents','<u4'),('numEvents','<u8')],
+               2:[('magic','S8'),('version','<u4'),('numComponents','<u4'),('numEvents','<u8'),('startTime','<f8'),('endTime','<f8')]}
+
+
+class EventStore:
+    def __init__(self,times,components,marks,numComponents=None,componentOrder=None,componentOffsets=None,startTime=None,endTime=None,
+                 checkSorted=True):
+        """
+        Columnar storage of an event history, usable wherever a list of (time,component,mark) triplets is accepted.
+        Times must be sorted.
+
+        :param times: Event times (float64)
+        :param components: Component index of every event (int32)
+        :param marks: Event marks (float64)
+        :param numComponents: Number of process components, defaults to max(components)+1
+        :param componentOrder,componentOffsets: Per-component index, computed on demand if not given
+        :param startTime,endTime: Observation window [startTime,endTime] the compensator integrates over,
+            the first and last event times if not given (Liniger p. 41)
+        :param checkSorted: Raise ValueError for unsorted times; off for columns known to be sorted, such as load()
+        """
+        self.times=np.asarray(times,dtype=np.float64)
+        self.components=np.asarray(components,dtype=np.int32)
+        self.marks=np.asarray(marks,dtype=np.float64)
+        if checkSorted and len(self.times)>1 and np.any(self.times[1:]<self.times[:-1]):
+            raise ValueError("Event times must be sorted, see EventStore.fromTriplets")
+
+        if numComponents is None:
+            numComponents=int(self.components.max())+1 if len(self.components)>0 else 0
+        self.numComponents=numComponents
+
+        self.componentOrder=componentOrder
+        self.componentOffsets=componentOffsets
+
+        if len(self.times)>0 and ((startTime is not None and self.times[0]<startTime) or (endTime is not None and self.times[-1]>endTime)):
+            raise ValueError("Events outside the observation window [%s,%s]" % (startTime,endTime))
+        self.startTime=startTime
+        self.endTime=endTime
+
+    @staticmethod
+    def fromTriplets(timeComponentMarkTriplets,numComponents=None,startTime=None,endTime=None):
+        """Build an EventStore from a list of (time,component,mark) triplets, stably sorted by time"""
+        numEvents=len(timeComponentMarkTriplets)
+        times=np.empty(numEvents,dtype=np.float64)
+        components=np.empty(numEvents,dtype=np.int32)
+        marks=np.empty(numEvents,dtype=np.float64)
+        for idx,(t,d,x) in enumerate(timeComponentMarkTriplets):
+            times[idx]=t
+            components[idx]=d
+            marks[idx]=x
+        if numEvents>1 and np.any(times[1:]<times[:-1]):
+            order=np.argsort(times,kind='mergesort')
+            times,components,marks=times[order],components[order],marks[order]
+        return EventStore(times,components,marks,numComponents,startTime=startTime,endTime=endTime)
+
+    def toTriplets(self):
+        """Legacy list of (time,component,mark) triplets"""
+        return zip(self.times.tolist(),self.components.tolist(),self.marks.tolist())
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return iter(self.toTriplets())
+
+    def __getitem__(self,idx):
+        """An integer index gives a (time,component,mark) triplet, a slice gives an EventStore view with the same observation window"""
+        if isinstance(idx,slice):
+            return EventStore(self.times[idx],self.components[idx],self.marks[idx],self.numComponents,
+                              startTime=self.startTime,endTime=self.endTime)
+        return float(self.times[idx]),int(self.components[idx]),float(self.marks[idx])
+
+    def __buildComponentIndex(self):
+        self.componentOrder=np.argsort(self.components,kind='mergesort').astype(np.int64)
+        counts=np.bincount(self.components,minlength=self.numComponents)
+        self.componentOffsets=np.concatenate([[0],np.cumsum(counts)]).astype(np.int64)
+
+    def getObservationWindow(self):
+        """(startTime,endTime), defaulting to the first and last event times; None for an unknown bound"""
+        startTime=self.startTime
+        endTime=self.endTime
+        if startTime is None and len(self.times)>0:
+            startTime=float(self.times[0])
+        if endTime is None and len(self.times)>0:
+            endTime=float(self.times[-1])
+        return startTime,endTime
+
+    def getObservationLength(self):
+        """
+        Length of getObservationWindow, which the immigration term of the compensator integrates over.
+        0 for a store without events or window; raises ValueError for one without events and only one bound.
+        """
+        startTime,endTime=self.getObservationWindow()
+        if startTime is None and endTime is None:
+            return 0.0
+        if startTime is None or endTime is None:
+            raise ValueError("Observation window [%s,%s] without events needs both bounds" % (startTime,endTime))
+        return endTime-startTime
+
+    def getComponentIndices(self,componentIdx):
+        """Sorted positions of the events of one component"""
+        if componentIdx>=self.numComponents:
+            return np.zeros(0,dtype=np.int64)
+        if self.componentOrder is None:
+            self.__buildComponentIndex()
+        return self.componentOrder[self.componentOffsets[componentIdx]:self.componentOffsets[componentIdx+1]]
+
+    def getCached(self,key,compute):
+        """Cache hook used by the likelihood code, see CompiledDataset. A plain EventStore keeps nothing"""
+        return compute()
+
+    def save(self,path):
+        """
+        Write to a binary file that load() can memory-map. The header holds the observation window, the layout after it:
+        times (float64), marks (float64), componentOrder (int64), componentOffsets (int64), components (int32)
+        """
+        if self.componentOrder is None:
+            self.__buildComponentIndex()
+
+        header=np.zeros(1,dtype=HEADER_DTYPES[FILE_VERSION])
+        header['magic']=FILE_MAGIC
+        header['version']=FILE_VERSION
+        header['numComponents']=self.numComponents
+        header['numEvents']=len(self)
+        header['startTime']=np.nan if self.startTime is None else self.startTime
+        header['endTime']=np.nan if self.endTime is None else self.endTime
+
+        with open(path,'wb') as f:
+            f.write(header.tostring())
+            f.write(np.ascontiguousarray(self.times,dtype='<f8').tostring())
+            f.write(np.ascontiguousarray(self.marks,dtype='<f8').tostring())
+            f.write(np.ascontiguousarray(self.componentOrder,dtype='<i8').tostring())
+            f.write(np.ascontiguousarray(self.componentOffsets,dtype='<i8').tostring())
+            f.write(np.ascontiguousarray(self.components,dtype='<i4').tostring())
+
+    @staticmethod
+    def load(path,mmap=True):
+        """
+        Open a file written by save(), with its observation window (version 1 files have none).
+        With mmap the columns are read-only memory maps, so opening is O(1) and the pages are shared between
+        processes opening the same file.
+        """
+        header=np.fromfile(path,dtype=HEADER_DTYPES[1],count=1)
+        if len(header)!=1 or header['magic'][0]!=FILE_MAGIC:
+            raise ValueError("%s is not an event store file" % path)
+        version=int(header['version'][0])
+        if version not in HEADER_DTYPES:
+            raise ValueError("Unsupported event store version %s" % version)
+        header=np.fromfile(path,dtype=HEADER_DTYPES[version],count=1)
+
+        numComponents=int(header['numComponents'][0])
+        numEvents=int(header['numEvents'][0])
+        startTime=endTime=None
+        if version>=2:
+            startTime=None if np.isnan(header['startTime'][0]) else float(header['startTime'][0])
+            endTime=None if np.isnan(header['endTime'][0]) else float(header['endTime'][0])
+
+        columns=[]
+        offset=np.dtype(HEADER_DTYPES[version]).itemsize
+        for dtype,count in [('<f8',numEvents),('<f8',numEvents),('<i8',numEvents),('<i8',numComponents+1),('<i4',numEvents)]:
+            if count==0:
+                columns.append(np.zeros(0,dtype=dtype))
+            elif mmap:
+                columns.append(np.memmap(path,dtype=dtype,mode='r',offset=offset,shape=(count,)))
+            else:
+                with open(path,'rb') as f:
+                    f.seek(offset)
+                    columns.append(np.fromfile(f,dtype=dtype,count=count))
+            offset+=count*np.dtype(dtype).itemsize
+
+        times,marks,componentOrder,componentOffsets,components=columns
+        return EventStore(times,components,marks,numComponents,componentOrder,componentOffsets,startTime,endTime,checkSorted=False)
+
+
+def asEventStore(events,numComponents=None):
+    """Accept either an EventStore or a legacy list of (time,component,mark) triplets"""
+    if isinstance(events,EventStore):
+        return events
+    return EventStore.fromTriplets(events,numComponents)
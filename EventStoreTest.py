@@ -0,0 +1,60 @@
+__author__ = 'tjohnson'
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import EventStore
+
+
+class EventStoreTest(unittest.TestCase):
+    def setUp(self):
+        randomState=np.random.RandomState(7)
+        self.times=np.sort(randomState.uniform(5.0,95.0,200))
+        self.components=randomState.randint(0,3,200).astype(np.int32)
+        self.marks=randomState.exponential(1.0,200)
+        fileHandle,self.path=tempfile.mkstemp(suffix='.events')
+        os.close(fileHandle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def assertSameEvents(self,eventStore,expected):
+        self.assertEqual(eventStore.numComponents,expected.numComponents)
+        np.testing.assert_array_equal(eventStore.times,expected.times)
+        np.testing.assert_array_equal(eventStore.components,expected.components)
+        np.testing.assert_array_equal(eventStore.marks,expected.marks)
+        for k in range(0,expected.numComponents):
+            np.testing.assert_array_equal(eventStore.getComponentIndices(k),expected.getComponentIndices(k))
+        self.assertEqual(eventStore.getObservationWindow(),expected.getObservationWindow())
+
+    def testSaveLoadRoundTrip(self):
+        for startTime,endTime in [(None,None),(0.0,100.0),(0.0,None)]:
+            eventStore=EventStore.EventStore(self.times,self.components,self.marks,4,startTime=startTime,endTime=endTime)
+            eventStore.save(self.path)
+            for mmap in [True,False]:
+                loaded=EventStore.EventStore.load(self.path,mmap)
+                self.assertSameEvents(loaded,eventStore)
+                self.assertEqual((loaded.startTime,loaded.endTime),(startTime,endTime))
+
+    def testSaveLoadEmpty(self):
+        eventStore=EventStore.EventStore(np.zeros(0),np.zeros(0),np.zeros(0),2,startTime=0.0,endTime=10.0)
+        eventStore.save(self.path)
+        self.assertSameEvents(EventStore.EventStore.load(self.path),eventStore)
+
+    def testSliceKeepsWindow(self):
+        eventStore=EventStore.EventStore(self.times,self.components,self.marks,3,startTime=0.0,endTime=100.0)
+        self.assertEqual(eventStore[10:20].getObservationWindow(),(0.0,100.0))
+        self.assertEqual(eventStore[10:20][5],eventStore[15])
+
+    def testFromTripletsSortsByTime(self):
+        triplets=zip(self.times.tolist(),self.components.tolist(),self.marks.tolist())
+        shuffled=[triplets[idx] for idx in np.random.RandomState(3).permutation(len(triplets))]
+        self.assertSameEvents(EventStore.EventStore.fromTriplets(shuffled,3),EventStore.EventStore(self.times,self.components,self.marks,3))
+
+    def testUnsortedTimesRaise(self):
+        self.assertRaises(ValueError,EventStore.EventStore,self.times[::-1],self.components,self.marks)
+
+
+if __name__=='__main__':
+    unittest.main()
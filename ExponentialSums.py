@@ -0,0 +1,128 @@
+__author__ = 'tjohnson'
+import numpy as np
+
+#Largest alpha*(t-s) folded into one block before moving the reference time; keeps exp() well inside float range
+MAX_BLOCK_EXPONENT=500.0
+#Window used when no truncation is wanted, exp(-450) is far below double precision relative to the newest term
+UNTRUNCATED_WINDOW_EXPONENT=450.0
+#Cost of one re-referenced block in evaluated pairs; windows holding fewer pairs than the blocks would cost are summed directly
+BLOCK_COST_PAIRS=1000
+#Pairs evaluated at once by the direct summation
+MAX_DIRECT_PAIRS=2**21
+
+
+def getWindowBounds(eventTimes,window,queryTimes,includeT=False):
+    """For every query time t the index range [first,last) of the events with t-window <= s < t (s <= t if includeT)"""
+    firstEvents=np.searchsorted(eventTimes,queryTimes-window,side='left')
+    lastEvents=np.searchsorted(eventTimes,queryTimes,side='right' if includeT else 'left')
+    return firstEvents,lastEvents
+
+
+def getWindowedExponentialSums(eventTimes,weights,alpha,window,queryTimes,includeT=False,timeWeighted=False,windowBounds=None):
+    """
+    For every query time t returns the sum over events s with t-window <= s < t (s <= t if includeT) of
+        weights[s]*exp(-alpha*(t-s))
+    which is the sum getLambda builds for an exponential decay function.
+    With timeWeighted the summand is additionally multiplied by (t-s), as needed for the derivative in alpha.
+
+    The recursion S(t')=exp(-alpha*(t'-t))*S(t)+... is unrolled into cumulative sums of weights*exp(alpha*(s-r))
+    for a reference time r, re-referenced in blocks so the exponent never exceeds MAX_BLOCK_EXPONENT.
+    Cost is O((N+M)log N) without a Python loop over events. When the blocks would be short compared to the
+    spacing of the query times, the pairs inside the windows are summed directly instead.
+
+    :param eventTimes: Sorted event times (N)
+    :param weights: Weight of each event, shape (N) or (N,F)
+    :param alpha: Decay rate
+    :param window: Events older than this are ignored (the decay function quantile), None for no truncation
+    :param queryTimes: Sorted query times (M)
+    :param windowBounds: getWindowBounds(eventTimes,window,queryTimes,includeT) if already known
+    :return: Array of shape (M) or (M,F)
+    """
+    eventTimes=np.asarray(eventTimes,dtype=float)
+    queryTimes=np.asarray(queryTimes,dtype=float)
+    weights=np.asarray(weights,dtype=float)
+
+    result=np.zeros((len(queryTimes),)+weights.shape[1:])
+    if len(eventTimes)==0 or len(queryTimes)==0:
+        return result
+
+    if window is None:
+        window=UNTRUNCATED_WINDOW_EXPONENT/alpha
+    windowExponent=alpha*window
+    if windowExponent>=MAX_BLOCK_EXPONENT:
+        raise ValueError("Decay window %s too long for decay rate %s" % (window,alpha))
+    blockLength=(MAX_BLOCK_EXPONENT-windowExponent)/alpha
+
+    columnShape=(-1,)+(1,)*(weights.ndim-1)
+    if windowBounds is None:
+        windowBounds=getWindowBounds(eventTimes,window,queryTimes,includeT)
+    firstEvents,lastEvents=windowBounds
+
+    #Fast decays (alpha*window close to MAX_BLOCK_EXPONENT) leave short blocks holding few queries each,
+    #their windows then hold few events and direct summation is cheaper than the blocks' Python overhead
+    numBlocks=min((queryTimes[-1]-queryTimes[0])/blockLength+1.0,len(queryTimes))
+    if np.sum(lastEvents-firstEvents)<numBlocks*BLOCK_COST_PAIRS:
+        return _getDirectSums(eventTimes,weights,alpha,queryTimes,windowBounds,timeWeighted)
+
+    numQueries=len(queryTimes)
+    blockStart=0
+    while blockStart<numQueries:
+        referenceTime=queryTimes[blockStart]-window
+        blockEnd=max(np.searchsorted(queryTimes,queryTimes[blockStart]+blockLength,side='left'),blockStart+1)
+
+        eventStart=firstEvents[blockStart]
+        eventEnd=lastEvents[blockEnd-1]
+        if eventEnd>eventStart:
+            blockEventTimes=eventTimes[eventStart:eventEnd]-referenceTime
+            growingWeights=weights[eventStart:eventEnd]*np.exp(alpha*blockEventTimes).reshape(columnShape)
+
+            cumulative=np.zeros((eventEnd-eventStart+1,)+weights.shape[1:])
+            np.cumsum(growingWeights,axis=0,out=cumulative[1:])
+
+            lo=firstEvents[blockStart:blockEnd]-eventStart
+            hi=lastEvents[blockStart:blockEnd]-eventStart
+            blockQueryTimes=(queryTimes[blockStart:blockEnd]-referenceTime).reshape(columnShape)
+
+            sums=cumulative[hi]-cumulative[lo]
+            if timeWeighted:
+                momentCumulative=np.zeros_like(cumulative)
+                np.cumsum(growingWeights*blockEventTimes.reshape(columnShape),axis=0,out=momentCumulative[1:])
+                sums=blockQueryTimes*sums-(momentCumulative[hi]-momentCumulative[lo])
+
+            result[blockStart:blockEnd]=np.exp(-alpha*blockQueryTimes)*sums
+
+        blockStart=blockEnd
+
+    return result
+
+
+def _getDirectSums(eventTimes,weights,alpha,queryTimes,windowBounds,timeWeighted):
+    """getWindowedExponentialSums by evaluating every (query,event) pair of the windows, in chunks of MAX_DIRECT_PAIRS"""
+    firstEvents,lastEvents=windowBounds
+    counts=lastEvents-firstEvents
+    cumulativeCounts=np.cumsum(counts)
+    result=np.zeros((len(queryTimes),)+weights.shape[1:])
+
+    start=0
+    while start<len(queryTimes):
+        previousCount=cumulativeCounts[start-1] if start>0 else 0
+        end=max(np.searchsorted(cumulativeCounts,previousCount+MAX_DIRECT_PAIRS,side='right'),start+1)
+        chunkCounts=counts[start:end]
+        numPairs=np.sum(chunkCounts)
+        if numPairs>0:
+            queryIndices=np.repeat(np.arange(0,end-start),chunkCounts)
+            offsets=np.arange(numPairs)-np.repeat(np.cumsum(chunkCounts)-chunkCounts,chunkCounts)
+            eventIndices=np.repeat(firstEvents[start:end],chunkCounts)+offsets
+            timeDifferences=queryTimes[start:end][queryIndices]-eventTimes[eventIndices]
+            factors=np.exp(-alpha*timeDifferences)
+            if timeWeighted:
+                factors*=timeDifferences
+            values=weights[eventIndices]*factors.reshape((-1,)+(1,)*(weights.ndim-1))
+            if weights.ndim==1:
+                result[start:end]=np.bincount(queryIndices,weights=values,minlength=end-start)
+            else:
+                for column in range(0,weights.shape[1]):
+                    result[start:end,column]=np.bincount(queryIndices,weights=values[:,column],minlength=end-start)
+        start=end
+
+    return result
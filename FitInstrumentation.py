@@ -0,0 +1,111 @@
+__author__ = 'tjohnson'
+import time
+import numpy as np
+
+EVALUATION_TRACE_DTYPE=[('evaluation','i8'),('elapsedTime','f8'),('wallTime','f8'),('lambdaTime','f8'),
+                        ('markDensityTime','f8'),('compensatorTime','f8'),('negativeLogLikelihood','f8'),('gradientNorm','f8')]
+ITERATION_TRACE_DTYPE=[('iteration','i8'),('evaluations','i8'),('elapsedTime','f8'),('negativeLogLikelihood','f8'),('gradientNorm','f8')]
+
+
+def printProgress(record):
+    """Callback printing every record, roughly what the fitter used to print unconditionally"""
+    if record['kind']=='evaluation':
+        print "Evaluation %(evaluation)d: %(negativeLogLikelihood)s in %(wallTime).4fs" % record
+    else:
+        print "Iteration %(iteration)d after %(evaluations)d evaluations: %(negativeLogLikelihood)s" % record
+
+
+class FitInstrumentation:
+    def __init__(self,sampleEvery=1,callbacks=None,recordParameters=False):
+        """
+        Collects a trace of an optimization, pass it as the instrumentation argument of
+        GenuineMultivariateHawkesProcessFitter.maximizeLikelihood. Without one the fitter records nothing.
+
+        Every sampleEvery-th objective evaluation is timed with the lambda, mark density and compensator terms
+        split (see GenuineMultivariateHawkesProcess.getLogLikelihoodTerms); the others only increment the count.
+        Every optimizer iteration is recorded.
+
+        :param callbacks: Functions called with a dict for every recorded evaluation and iteration,
+            with key kind set to 'evaluation' or 'iteration' and the other keys named as the trace fields
+        :param recordParameters: Also keep the parameter vector of every iteration
+        """
+        self.sampleEvery=sampleEvery
+        self.callbacks=list(callbacks or [])
+        self.recordParameters=recordParameters
+        self.reset()
+
+    def reset(self):
+        """Drop the recorded trace"""
+        self.numEvaluations=0
+        self.numIterations=0
+        self.startTime=time.time()
+        self.evaluations=[]
+        self.iterations=[]
+        self.parameters=[]
+        self.lastValue=float('nan')
+        self.lastGradientNorm=float('nan')
+
+    def addCallback(self,callback):
+        self.callbacks.append(callback)
+
+    def __notify(self,kind,fields,values):
+        if len(self.callbacks)==0:
+            return
+        record=dict(zip([name for name,dtype in fields],values))
+        record['kind']=kind
+        for callback in self.callbacks:
+            callback(record)
+
+    def wrapObjective(self,objective):
+        """
+        Instrument an objective of the form objective(params,termTimes=None) returning value or (value,gradient),
+        like GenuineMultivariateHawkesProcessFitter.getNegativeLogLikelihood(AndGradient) with the events bound
+        """
+        def instrumentedObjective(params):
+            self.numEvaluations+=1
+            if self.numEvaluations%self.sampleEvery!=0:
+                result=objective(params)
+                self.__setLastResult(result)
+                return result
+
+            termTimes={}
+            startTime=time.time()
+            result=objective(params,termTimes)
+            wallTime=time.time()-startTime
+            self.__setLastResult(result)
+
+            values=(self.numEvaluations,startTime-self.startTime,wallTime,termTimes.get('lambda',0.0),
+                    termTimes.get('markDensity',0.0),termTimes.get('compensator',0.0),self.lastValue,self.lastGradientNorm)
+            self.evaluations.append(values)
+            self.__notify('evaluation',EVALUATION_TRACE_DTYPE,values)
+            return result
+
+        return instrumentedObjective
+
+    def __setLastResult(self,result):
+        if isinstance(result,tuple):
+            self.lastValue=result[0]
+            self.lastGradientNorm=np.sqrt(np.sum(np.square(result[1])))
+        else:
+            self.lastValue=result
+
+    def recordIteration(self,params):
+        """Optimizer callback, the value is that of the latest evaluation (the accepted line search point)"""
+        self.numIterations+=1
+        values=(self.numIterations,self.numEvaluations,time.time()-self.startTime,self.lastValue,self.lastGradientNorm)
+        self.iterations.append(values)
+        if self.recordParameters:
+            self.parameters.append(np.array(params,dtype=float))
+        self.__notify('iteration',ITERATION_TRACE_DTYPE,values)
+
+    def getEvaluationTrace(self):
+        """Structured array with the fields of EVALUATION_TRACE_DTYPE, one row per sampled evaluation"""
+        return np.array(self.evaluations,dtype=EVALUATION_TRACE_DTYPE)
+
+    def getIterationTrace(self):
+        """Structured array with the fields of ITERATION_TRACE_DTYPE, one row per iteration"""
+        return np.array(self.iterations,dtype=ITERATION_TRACE_DTYPE)
+
+    def getParameterTrace(self):
+        """Parameters after every iteration, shape (iterations,parameters); requires recordParameters"""
+        return np.array(self.parameters)
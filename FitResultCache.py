@@ -0,0 +1,292 @@
+__author__ = 'tjohnson'
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import scipy
+import EventStore
+import MultiSequenceDataset
+
+#Default bound on the total size of the cache directory
+DEFAULT_MAX_BYTES=256*2**20
+ENTRY_SUFFIX='.fit.json'
+#Attributes of decay functions, mark distributions and branching parameters that change the likelihood besides
+#the fitted parameters
+STRUCTURAL_ATTRIBUTES=('epsilon','numExponentialTerms','tolerance','impactFunctionClass','edgeTargets','edgeSources')
+#Fitter methods maximizeLikelihood can run, with the keyword of their starting parameter vector
+FIT_METHODS={'maximizeLikelihood':'initialGuess','maximizeLikelihoodMultiSequence':'initialGuess',
+             'maximizeLikelihoodSeparable':'initialGuess'}
+#Fitter keyword arguments that do not change the fit result and are left out of the key
+NON_SEMANTIC_SETTINGS=('instrumentation','numWorkers')
+
+
+def _toJson(value):
+    """Plain JSON value of numbers, arrays, classes and containers, for fingerprints and stored fit info"""
+    if isinstance(value,np.ndarray):
+        return value.tolist()
+    if isinstance(value,np.generic):
+        return value.item()
+    if isinstance(value,(list,tuple)):
+        return [_toJson(item) for item in value]
+    if isinstance(value,dict):
+        return dict((str(key),_toJson(item)) for key,item in value.items())
+    if isinstance(value,type) or hasattr(value,'__bases__'):
+        return value.__name__
+    if value is None or isinstance(value,(bool,int,long,float,basestring)):
+        return value
+    return str(value)
+
+
+def _isPlainValue(value):
+    """Whether _toJson keeps value as is, so equal settings give equal keys"""
+    if isinstance(value,(np.ndarray,list,tuple)):
+        return all(_isPlainValue(item) for item in value)
+    if isinstance(value,dict):
+        return all(isinstance(key,basestring) and _isPlainValue(item) for key,item in value.items())
+    return value is None or isinstance(value,(bool,int,long,float,basestring,np.number,np.bool_))
+
+
+def _getOptimizerSettingsKey(optimizerSettings):
+    """The optimizer settings without NON_SEMANTIC_SETTINGS, ValueError for a setting that is not a plain JSON value"""
+    settings={}
+    for name,value in (optimizerSettings or {}).items():
+        if name in NON_SEMANTIC_SETTINGS:
+            continue
+        if not _isPlainValue(value):
+            raise ValueError("Optimizer setting %s=%r has no stable cache key" % (name,value))
+        settings[name]=value
+    return settings
+
+
+def _getHash(value):
+    return hashlib.sha256(json.dumps(_toJson(value),sort_keys=True)).hexdigest()
+
+
+def _getStructure(instance):
+    structure={'class':instance.__class__.__name__}
+    for attribute in STRUCTURAL_ATTRIBUTES:
+        if hasattr(instance,attribute):
+            structure[attribute]=getattr(instance,attribute)
+    return structure
+
+
+def getDataFingerprint(events,numComponents=None):
+    """
+    sha256 of the event arrays and observation window, sequence by sequence for a MultiSequenceDataset
+    :return: (hexDigest,summary) where summary holds the per-component event rates used to match near-identical data
+    """
+    if isinstance(events,MultiSequenceDataset.MultiSequenceDataset):
+        sequences=list(events)
+        numComponents=events.numComponents
+    else:
+        sequences=[EventStore.asEventStore(events,numComponents)]
+        numComponents=sequences[0].numComponents
+
+    digest=hashlib.sha256()
+    digest.update(json.dumps([numComponents,len(sequences)]))
+    counts=np.zeros(numComponents)
+    duration=0.0
+    for sequence in sequences:
+        startTime,endTime=sequence.getObservationWindow()
+        digest.update(json.dumps([len(sequence),startTime,endTime]))
+        for values,dtype in [(sequence.times,np.float64),(sequence.components,np.int32),(sequence.marks,np.float64)]:
+            digest.update(np.ascontiguousarray(values,dtype=dtype).tostring())
+        counts+=np.bincount(sequence.components,minlength=numComponents)[0:numComponents]
+        duration+=sequence.getObservationLength()
+
+    rates=counts/duration if duration>0 else counts
+    return digest.hexdigest(),{'numEvents':int(np.sum(counts)),'rates':rates.tolist()}
+
+
+def getModelFingerprint(fitter):
+    """
+    sha256 of the model structure: the classes and structural settings of the branching parameters, of every
+    component's decay function and mark distribution, which components share an instance (the parameter layout of
+    the fitter) and the parameter bounds. Parameter values are not part of it.
+    """
+    hawkesProcess=fitter.hawkesProcess
+    decayIndices,markIndices=fitter.getComponentParameterIndices()
+    return _getHash({'numComponents':hawkesProcess.numComponents,
+                     'immigrationDescendantParameters':_getStructure(hawkesProcess.immigrationDescendantParameters),
+                     'decayFunctions':[_getStructure(decayFunction) for decayFunction in hawkesProcess.decayFunctions],
+                     'markDistributions':[_getStructure(markDistribution) for markDistribution in hawkesProcess.markDistributions],
+                     'decayIndices':decayIndices,'markIndices':markIndices,'parameterBounds':fitter.parameterBounds})
+
+
+class FitResultCache:
+    def __init__(self,directory,maxBytes=DEFAULT_MAX_BYTES):
+        """
+        On-disk cache of fit results shared by concurrent processes, one JSON file per fit in directory.
+
+        A fit is keyed by getDataFingerprint, getModelFingerprint and the optimizer settings (fitter method, its
+        keyword arguments except NON_SEMANTIC_SETTINGS, the initial guess and the scipy version), so an identical fit
+        returns the stored result without evaluating the likelihood (an instrumentation object then records nothing).
+        The other keyword arguments must be plain JSON values such as numbers, strings, lists and dicts, others raise
+        ValueError. For other data with the same model, getWarmStart returns the stored optimum whose per-component
+        event rates are closest.
+
+        Entries are written to a temporary file in directory and renamed into place, so readers never see a partial
+        entry. Beyond maxBytes the least recently used entries (file modification time, refreshed on every hit)
+        are deleted; an entry deleted by another process is a miss.
+
+        Entries never change once renamed into place, so the fingerprints getWarmStart compares are kept in memory
+        per (path,inode) and only entries written since the last lookup are read.
+        """
+        self.directory=directory
+        self.maxBytes=maxBytes
+        #path -> (inode,modelKey,dataKey,rates,params) of the entries seen so far
+        self.index={}
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def getKey(self,fitter,events,initialGuess,method='maximizeLikelihood',optimizerSettings=None):
+        """(key,dataKey,modelKey,dataSummary) of a fit"""
+        dataKey,dataSummary=getDataFingerprint(events,fitter.hawkesProcess.numComponents)
+        modelKey=getModelFingerprint(fitter)
+        optimizerKey=_getHash({'method':method,'settings':_getOptimizerSettingsKey(optimizerSettings),'scipy':scipy.__version__,
+                               'initialGuess':[float(value) for value in initialGuess]})
+        return _getHash([dataKey,modelKey,optimizerKey]),dataKey,modelKey,dataSummary
+
+    def __getPath(self,key):
+        return os.path.join(self.directory,key+ENTRY_SUFFIX)
+
+    def __readEntry(self,path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError,OSError,ValueError):
+            return None
+
+    def get(self,key):
+        """Stored entry dict (params, negativeLogLikelihood, info, dataKey, modelKey, dataSummary, created) or None"""
+        path=self.__getPath(key)
+        entry=self.__readEntry(path)
+        if entry is not None:
+            try:
+                os.utime(path,None)
+            except OSError:
+                pass
+        return entry
+
+    def put(self,key,entry):
+        """Atomically write an entry, then evict down to maxBytes"""
+        fileHandle,temporaryPath=tempfile.mkstemp(suffix='.tmp',dir=self.directory)
+        try:
+            with os.fdopen(fileHandle,'w') as f:
+                json.dump(_toJson(entry),f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temporaryPath,self.__getPath(key))
+            self.__addToIndex(self.__getPath(key),os.stat(self.__getPath(key)).st_ino,entry)
+        except:
+            if os.path.exists(temporaryPath):
+                os.remove(temporaryPath)
+            raise
+        self.evict()
+
+    def __getEntryFiles(self):
+        """(modificationTime,size,path,inode) of every entry, oldest first"""
+        entryFiles=[]
+        for fileName in os.listdir(self.directory):
+            if not fileName.endswith(ENTRY_SUFFIX):
+                continue
+            path=os.path.join(self.directory,fileName)
+            try:
+                fileStat=os.stat(path)
+            except OSError:
+                continue
+            entryFiles.append((fileStat.st_mtime,fileStat.st_size,path,fileStat.st_ino))
+        return sorted(entryFiles)
+
+    def evict(self):
+        """Delete least recently used entries until the cache holds at most maxBytes"""
+        entryFiles=self.__getEntryFiles()
+        totalBytes=sum(entryFile[1] for entryFile in entryFiles)
+        for modificationTime,size,path,inode in entryFiles:
+            if totalBytes<=self.maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.index.pop(path,None)
+            totalBytes-=size
+
+    def __addToIndex(self,path,inode,entry):
+        self.index[path]=(inode,entry['modelKey'],entry['dataKey'],np.array(entry['dataSummary']['rates'],dtype=float),
+                          np.array(entry['params'],dtype=float))
+
+    def __updateIndex(self):
+        """Read the entries written since the last call and drop the deleted ones"""
+        seen=set()
+        for modificationTime,size,path,inode in self.__getEntryFiles():
+            seen.add(path)
+            if path in self.index and self.index[path][0]==inode:
+                continue
+            entry=self.__readEntry(path)
+            if entry is not None:
+                self.__addToIndex(path,inode,entry)
+        for path in list(self.index):
+            if path not in seen:
+                del self.index[path]
+
+    def getWarmStart(self,fitter,events):
+        """
+        Optimum of the stored fit with the same model whose data has the closest per-component event rates
+        (relative distance), None without one
+        """
+        dataKey,dataSummary=getDataFingerprint(events,fitter.hawkesProcess.numComponents)
+        return self.__findWarmStart(getModelFingerprint(fitter),dataKey,dataSummary)
+
+    def __findWarmStart(self,modelKey,dataKey,dataSummary):
+        self.__updateIndex()
+        rates=np.array(dataSummary['rates'],dtype=float)
+        bestParams=None
+        bestDistance=None
+        for inode,entryModelKey,entryDataKey,entryRates,params in self.index.values():
+            if entryModelKey!=modelKey or len(entryRates)!=len(rates):
+                continue
+            distance=0.0 if entryDataKey==dataKey else np.sum(np.abs(entryRates-rates)/np.maximum(np.abs(rates),1e-300))
+            if bestDistance is None or distance<bestDistance:
+                bestParams=params.copy()
+                bestDistance=distance
+        return bestParams
+
+    def maximizeLikelihood(self,fitter,events,initialGuess,method='maximizeLikelihood',useWarmStart=True,**optimizerSettings):
+        """
+        fitter.<method>(events,initialGuess=...,**optimizerSettings) through the cache, for the methods in FIT_METHODS
+        (raises ValueError for others, such as maximizeLikelihoodMultiStart, which takes no single starting point).
+        On a miss with useWarmStart the fit starts from getWarmStart instead of initialGuess when one exists;
+        the key still uses initialGuess, so repeating the same call hits.
+        :return: (params,negativeLogLikelihood,infoDict) with infoDict as stored (JSON values) and key cached
+        """
+        if method not in FIT_METHODS:
+            raise ValueError("Fit method %s is not cached, use one of %s" % (method,', '.join(sorted(FIT_METHODS))))
+        key,dataKey,modelKey,dataSummary=self.getKey(fitter,events,initialGuess,method,optimizerSettings)
+        entry=self.get(key)
+        if entry is not None:
+            params=np.array(entry['params'],dtype=float)
+            fitter.setParameterValues(params)
+            info=dict(entry['info'])
+            info['cached']=True
+            return params,entry['negativeLogLikelihood'],info
+
+        startParams=initialGuess
+        if useWarmStart:
+            warmStart=self.__findWarmStart(modelKey,dataKey,dataSummary)
+            if warmStart is not None:
+                startParams=warmStart
+        optimizerSettings[FIT_METHODS[method]]=startParams
+        params,value,info=getattr(fitter,method)(events,**optimizerSettings)
+
+        info=_toJson(dict(info))
+        self.put(key,{'params':params,'negativeLogLikelihood':float(value),'info':info,'dataKey':dataKey,
+                      'modelKey':modelKey,'dataSummary':dataSummary,'created':time.time()})
+        info['cached']=False
+        return np.array(params,dtype=float),float(value),info
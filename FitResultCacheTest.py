@@ -0,0 +1,82 @@
+__author__ = 'tjohnson'
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import ClusterSimulator
+import DecayFunctions
+import EventStore
+import FitInstrumentation
+import FitResultCache
+import GenuineMultivariateHawkesProcess
+import GenuineMultivariateHawkesProcessFitter
+import ImmigrationDescendantParameters
+import MarkDistributions
+
+
+def buildFitter():
+    """Two exponential components without marks"""
+    hawkesProcess=GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        ImmigrationDescendantParameters.ImmigrationDescendantParameters(2,[0.2,0.1,0.3,0.2,0.1,0.4]),
+        [DecayFunctions.ExponentialDecayFunction([1.0]),DecayFunctions.ExponentialDecayFunction([0.5])],
+        [MarkDistributions.VoidMarkDistribution([]),MarkDistributions.VoidMarkDistribution([])])
+    return GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(hawkesProcess)
+
+
+class FitResultCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fitter=buildFitter()
+        cls.events=ClusterSimulator.ClusterSimulator(cls.fitter.hawkesProcess).simulate(1000.0,11,numWorkers=1)
+        cls.initialGuess=np.array([0.3,0.3,0.2,0.2,0.2,0.2,0.8,0.8])
+
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.cache=FitResultCache.FitResultCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testInstrumentationIsNotPartOfTheKey(self):
+        params,value,info=self.cache.maximizeLikelihood(self.fitter,self.events,self.initialGuess,
+                                                       instrumentation=FitInstrumentation.FitInstrumentation())
+        self.assertFalse(info['cached'])
+        cachedParams,cachedValue,cachedInfo=self.cache.maximizeLikelihood(self.fitter,self.events,self.initialGuess,
+                                                                         instrumentation=FitInstrumentation.FitInstrumentation())
+        self.assertTrue(cachedInfo['cached'])
+        np.testing.assert_array_equal(cachedParams,params)
+        self.assertEqual(cachedValue,value)
+
+    def testSecondCallHitsAcrossInstances(self):
+        params,value,info=self.cache.maximizeLikelihood(self.fitter,self.events,self.initialGuess)
+        self.assertFalse(info['cached'])
+        reopened=FitResultCache.FitResultCache(self.directory)
+        #Same events and observation window in a new store
+        copy=EventStore.EventStore.fromTriplets(self.events.toTriplets(),2,self.events.startTime,self.events.endTime)
+        cachedParams,cachedValue,cachedInfo=reopened.maximizeLikelihood(buildFitter(),copy,list(self.initialGuess))
+        self.assertTrue(cachedInfo['cached'])
+        np.testing.assert_array_equal(cachedParams,params)
+        self.assertEqual(cachedValue,value)
+
+        otherParams,otherValue,otherInfo=self.cache.maximizeLikelihood(self.fitter,self.events,self.initialGuess+0.01)
+        self.assertFalse(otherInfo['cached'])
+
+    def testWarmStartFromOtherData(self):
+        self.assertIsNone(self.cache.getWarmStart(self.fitter,self.events))
+        firstHalf=self.events[0:len(self.events)//2]
+        params,value,info=self.cache.maximizeLikelihood(self.fitter,firstHalf,self.initialGuess)
+        np.testing.assert_array_equal(self.cache.getWarmStart(self.fitter,self.events),params)
+
+        warmParams,warmValue,warmInfo=self.cache.maximizeLikelihood(self.fitter,self.events,self.initialGuess)
+        self.assertFalse(warmInfo['cached'])
+        coldParams,coldValue,coldInfo=buildFitter().maximizeLikelihood(self.events,self.initialGuess)
+        self.assertAlmostEqual(warmValue/coldValue,1.0,places=6)
+
+    def testUnkeyableSettingRaises(self):
+        self.assertRaises(ValueError,self.cache.getKey,self.fitter,self.events,self.initialGuess,
+                          'maximizeLikelihoodSeparable',{'tolerance':object()})
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+__author__ = 'tjohnson'
+import multiprocessing
+import numpy as np
+import scipy.linalg
+import DecayFunctions
+import EventStore
+import IntensityTracker
+import ThinningSimulator
+
+#Simulated paths per Monte Carlo forecast by default
+DEFAULT_NUM_PATHS=1000
+
+
+def _runForecastPaths(args):
+    """Sums over simulated paths of the intensities and counts at every horizon, for Forecaster.forecastMonteCarlo"""
+    hawkesProcess,history,t,horizons,seeds=args
+    intensitySums=np.zeros([len(horizons),hawkesProcess.numComponents])
+    countSums=np.zeros([len(horizons),hawkesProcess.numComponents])
+    simulator=ThinningSimulator.ThinningSimulator(hawkesProcess)
+    for seed in seeds:
+        path=simulator.simulate(randomState=seed,startTime=t,history=history,endTime=t+horizons[-1])
+
+        intensityTracker=IntensityTracker.IntensityTracker(hawkesProcess)
+        intensityTracker.pushEvents(history)
+        numPushed=0
+        for horizonIdx,horizon in enumerate(horizons):
+            numEvents=np.searchsorted(path.times,t+horizon,side='right')
+            intensityTracker.pushEvents(path[numPushed:numEvents])
+            numPushed=numEvents
+            intensitySums[horizonIdx]+=intensityTracker.intensities(t+horizon)
+            countSums[horizonIdx]+=np.bincount(path.components[0:numEvents],minlength=hawkesProcess.numComponents)
+    return intensitySums,countSums
+
+
+class Forecaster:
+    def __init__(self,hawkesProcess,meanImpacts=None,numPaths=DEFAULT_NUM_PATHS,numWorkers=1):
+        """
+        Expected intensities lambda_j(t+h) and expected event counts N_j(t,t+h] given the history up to t.
+
+        For decay functions with exponential terms (hasRecursiveDecayFunctions) the expected excitation y of every
+        term follows the linear ODE
+            dy_i/dt = -r_i*y_i + sum_k q[j_i,k]*E[g_k]*E[lambda_k],  E[lambda_j] = nu_j + sum_{i of j} c_i*r_i*y_i
+        so [y, int y, 1] evolves by the matrix exponential of an augmented (2n+1)x(2n+1) matrix, n being the number
+        of terms (K for exponential decay functions). The exponential of every horizon is cached, so a forecast
+        from an IntensityTracker state is a matrix-vector product. Other decay functions fall back to averaging
+        numPaths ThinningSimulator paths conditioned on the history, in numWorkers processes.
+        Model parameters are read when the forecaster is created.
+
+        :param meanImpacts: E[g_k(X)] per component, 1 by default as the impact functions are normalized (Liniger p. 33)
+        """
+        self.hawkesProcess=hawkesProcess
+        self.numPaths=numPaths
+        self.numWorkers=numWorkers
+        numComponents=hawkesProcess.numComponents
+        if meanImpacts is None:
+            meanImpacts=np.ones(numComponents)
+
+        self.nu=np.array(hawkesProcess.immigrationDescendantParameters.nu,dtype=float)
+        self.isClosedForm=hawkesProcess.hasRecursiveDecayFunctions()
+        self.transitions={}
+        if not self.isClosedForm:
+            return
+
+        termComponents,termWeights,rates=DecayFunctions.getStackedExponentialTerms(hawkesProcess.decayFunctions)
+        numTerms=len(termComponents)
+
+        #intensityWeights maps term excitations to component intensities
+        self.intensityWeights=np.zeros([numComponents,numTerms])
+        self.intensityWeights[termComponents,np.arange(numTerms)]=termWeights
+        excitationRates=np.array(hawkesProcess.immigrationDescendantParameters.q,dtype=float)[termComponents]*np.asarray(meanImpacts,dtype=float)
+
+        self.generator=np.zeros([2*numTerms+1,2*numTerms+1])
+        self.generator[0:numTerms,0:numTerms]=-np.diag(rates)+excitationRates.dot(self.intensityWeights)
+        self.generator[0:numTerms,2*numTerms]=excitationRates.dot(self.nu)
+        self.generator[numTerms:2*numTerms,0:numTerms]=np.eye(numTerms)
+        self.numTerms=numTerms
+
+    def getTransition(self,horizon):
+        """expm(generator*horizon), cached per horizon"""
+        horizon=float(horizon)
+        if horizon not in self.transitions:
+            self.transitions[horizon]=scipy.linalg.expm(self.generator*horizon)
+        return self.transitions[horizon]
+
+    def forecastFromTracker(self,intensityTracker,t,horizons):
+        """
+        Closed-form forecast from the state of an IntensityTracker fed with the history, events at t included
+        :param t: Forecast origin, not before the tracker's last event
+        :param horizons: Lengths h of the forecast intervals
+        :return: (intensities,counts), arrays of shape (len(horizons),K) with E[lambda_j(t+h)] and E[N_j(t,t+h]]
+        """
+        if not self.isClosedForm:
+            raise ValueError("Closed-form forecasts require decay functions with exponential terms")
+        numTerms=self.numTerms
+        excitations=intensityTracker.getExcitationState(t,includeT=True)[3]
+        initialState=np.concatenate([excitations,np.zeros(numTerms),[1.0]])
+
+        horizons=np.atleast_1d(np.asarray(horizons,dtype=float))
+        intensities=np.zeros([len(horizons),len(self.nu)])
+        counts=np.zeros([len(horizons),len(self.nu)])
+        for horizonIdx,horizon in enumerate(horizons):
+            state=self.getTransition(horizon).dot(initialState)
+            intensities[horizonIdx]=self.nu+self.intensityWeights.dot(state[0:numTerms])
+            counts[horizonIdx]=self.nu*horizon+self.intensityWeights.dot(state[numTerms:2*numTerms])
+        return intensities,counts
+
+    def forecast(self,history,t,horizons,randomState=None):
+        """
+        forecastFromTracker when closed-form, forecastMonteCarlo otherwise
+        :param history: Events up to t, EventStore or triplets
+        """
+        if self.isClosedForm:
+            intensityTracker=IntensityTracker.IntensityTracker(self.hawkesProcess)
+            intensityTracker.pushEvents(history)
+            return self.forecastFromTracker(intensityTracker,t,horizons)
+        return self.forecastMonteCarlo(history,t,horizons,randomState=randomState)
+
+    def forecastMonteCarlo(self,history,t,horizons,numPaths=None,randomState=None):
+        """
+        Average over simulated paths conditioned on the history, any decay function.
+        Only the history inside the longest decay quantile is passed to the paths, as IntensityTracker keeps no more.
+        Every path has its own seed drawn from randomState, so results do not depend on numWorkers.
+        :return: (intensities,counts) as forecastFromTracker
+        """
+        if numPaths is None:
+            numPaths=self.numPaths
+        randomState=ThinningSimulator.getRandomState(randomState)
+        seeds=randomState.randint(0,2**31-1,size=numPaths)
+
+        history=EventStore.asEventStore(history,self.hawkesProcess.numComponents)
+        window=max(decayFunction.getQ() for decayFunction in self.hawkesProcess.decayFunctions)
+        history=history[np.searchsorted(history.times,t-window,side='left'):len(history)]
+
+        horizons=np.atleast_1d(np.asarray(horizons,dtype=float))
+        order=np.argsort(horizons)
+        tasks=[(self.hawkesProcess,history,t,horizons[order],chunkSeeds) for chunkSeeds in np.array_split(seeds,max(self.numWorkers,1))]
+        if self.numWorkers==1:
+            results=map(_runForecastPaths,tasks)
+        else:
+            pool=multiprocessing.Pool(self.numWorkers)
+            try:
+                results=pool.map(_runForecastPaths,tasks,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        intensities=np.zeros([len(horizons),len(self.nu)])
+        counts=np.zeros([len(horizons),len(self.nu)])
+        intensities[order]=np.sum([result[0] for result in results],axis=0)/numPaths
+        counts[order]=np.sum([result[1] for result in results],axis=0)/numPaths
+        return intensities,counts
@@ -0,0 +1,61 @@
+__author__ = 'tjohnson'
+
+import unittest
+import numpy as np
+import ClusterSimulator
+import DecayFunctions
+import Forecaster
+import GenuineMultivariateHawkesProcess
+import ImmigrationDescendantParameters
+import MarkDistributions
+
+HORIZONS=[0.5,2.0,10.0]
+
+
+def buildProcess(decayFunctions):
+    return GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        ImmigrationDescendantParameters.ImmigrationDescendantParameters(2,[0.3,0.2,0.3,0.2,0.1,0.4]),
+        decayFunctions,
+        [MarkDistributions.VoidMarkDistribution([]),MarkDistributions.VoidMarkDistribution([])])
+
+
+class ForecasterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hawkesProcess=buildProcess([DecayFunctions.ExponentialDecayFunction([1.0]),DecayFunctions.ExponentialDecayFunction([0.5])])
+        cls.history=ClusterSimulator.ClusterSimulator(cls.hawkesProcess).simulate(50.0,5,numWorkers=1)
+        cls.t=50.0
+
+    def testEnoughHistory(self):
+        self.assertGreater(len(self.history),10)
+
+    def testClosedFormMatchesMonteCarlo(self):
+        forecaster=Forecaster.Forecaster(self.hawkesProcess,numPaths=2000)
+        self.assertTrue(forecaster.isClosedForm)
+        intensities,counts=forecaster.forecast(self.history,self.t,HORIZONS)
+        monteCarloIntensities,monteCarloCounts=forecaster.forecastMonteCarlo(self.history,self.t,HORIZONS,randomState=11)
+        np.testing.assert_allclose(monteCarloIntensities,intensities,rtol=0.1)
+        np.testing.assert_allclose(monteCarloCounts,counts,rtol=0.1)
+
+    def testEmptyHistoryCountsStartAtImmigration(self):
+        forecaster=Forecaster.Forecaster(self.hawkesProcess)
+        intensities,counts=forecaster.forecast([],0.0,[1e-6,1e4])
+        np.testing.assert_allclose(intensities[0],self.hawkesProcess.immigrationDescendantParameters.nu,rtol=1e-4)
+        #Long run rate (I-q)^-1 nu
+        q=self.hawkesProcess.immigrationDescendantParameters.q
+        stationaryRates=np.linalg.solve(np.eye(2)-q,self.hawkesProcess.immigrationDescendantParameters.nu)
+        np.testing.assert_allclose(intensities[1],stationaryRates,rtol=1e-6)
+        np.testing.assert_allclose(counts[1]/1e4,stationaryRates,rtol=1e-3)
+
+    def testMonteCarloFallback(self):
+        powerLawProcess=buildProcess([DecayFunctions.PowerLawDecayFunction([2.0,1.0]),DecayFunctions.PowerLawDecayFunction([2.0,2.0])])
+        forecaster=Forecaster.Forecaster(powerLawProcess,numPaths=20)
+        self.assertFalse(forecaster.isClosedForm)
+        intensities,counts=forecaster.forecast(self.history,self.t,HORIZONS[::-1],randomState=3)
+        self.assertEqual(intensities.shape,(3,2))
+        self.assertTrue(np.all(np.diff(counts[::-1],axis=0)>=0))
+        self.assertRaises(ValueError,forecaster.forecastFromTracker,None,self.t,HORIZONS)
+
+
+if __name__=='__main__':
+    unittest.main()
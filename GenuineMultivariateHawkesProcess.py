@@ -1,7 +1,43 @@
 import math
 
 __author__ = 'tjohnson'
+import collections
 import random
+import time
+import numpy as np
+import DecayFunctions
+import EventStore
+import ExponentialSums
+import MultiSequenceDataset
+
+#Largest number of (query,event) pairs evaluated at once by the windowed sums
+MAX_WINDOW_PAIRS=2**20
+
+#Events that can excite one target component, see GenuineMultivariateHawkesProcess.__getSourceEvents
+_SourceEvents=collections.namedtuple('_SourceEvents',['key','positions','times','components','timesToEnd','sources','rows'])
+
+
+class _TermTimer:
+    def __init__(self,termTimes):
+        """Adds the wall time since the previous lap to termTimes[term], for the termTimes argument of the likelihoods"""
+        self.termTimes=termTimes
+        self.lastTime=time.time()
+
+    def lap(self,term):
+        now=time.time()
+        self.termTimes[term]=self.termTimes.get(term,0.0)+now-self.lastTime
+        self.lastTime=now
+
+
+class _NullTermTimer:
+    def lap(self,term):
+        pass
+
+
+def _getTermTimer(termTimes):
+    if termTimes is None:
+        return _NullTermTimer()
+    return _TermTimer(termTimes)
 
 class GenuineMultivariateHawkesProcess:
     def __init__(self,immigrationDescendantParameters,decayFunctions,markDistributions):
@@ -10,8 +46,76 @@ class GenuineMultivariateHawkesProcess:
         self.decayFunctions=decayFunctions #w_j(t) in Liniger thesis
         self.markDistributions=markDistributions
 
+    def __getEventStore(self,timeComponentMarkTriplets):
+        """All public methods accept either an EventStore or a list of (time,component,mark) triplets"""
+        return EventStore.asEventStore(timeComponentMarkTriplets,self.numComponents)
+
+    def __getMarkKey(self,componentIdx):
+        """Cache key part identifying the mark distribution of a component and its current parameters"""
+        markDistribution=self.markDistributions[componentIdx]
+        return (componentIdx,markDistribution.__class__,tuple(markDistribution.getParams()))
+
+    def __getImpacts(self,eventStore):
+        """Impact function g_k(x) of every event, one vectorized call per component"""
+        impacts=np.zeros(len(eventStore))
+        for k in range(0,self.numComponents):
+            indices=eventStore.getComponentIndices(k)
+            impacts[indices]=eventStore.getCached(('impacts',)+self.__getMarkKey(k),
+                lambda: self.markDistributions[k].getImpactFunctionArray(eventStore.marks[indices]))
+        return impacts
+
+    def __getMarkDensityTermSums(self,eventStore):
+        markDensityTermSums=np.zeros(self.numComponents)
+        for k in range(0,self.numComponents):
+            marks=eventStore.marks[eventStore.getComponentIndices(k)]
+            markDensityTermSums[k]=eventStore.getCached(('markDensityTermSum',)+self.__getMarkKey(k),
+                lambda: np.sum(np.log(self.markDistributions[k].getDensityFunctionArray(marks))))
+        return markDensityTermSums
+
+    def __getSourceEvents(self,componentIdx,eventStore):
+        """
+        The events that can excite component componentIdx, those of its source components in the branching structure
+        (all events for a dense q). The per-target sums run over these only, so their cost scales with the nonzero edges.
+        positions are their indices in eventStore (None for all events), rows[i] the indices of the events of
+        sources[i] among them.
+        """
+        sources=self.immigrationDescendantParameters.getSourceComponents(componentIdx)
+        key=None if len(sources)==self.numComponents else tuple(sources)
+
+        def compute():
+            componentIndices=[eventStore.getComponentIndices(k) for k in sources]
+            if key is None:
+                positions=None
+                times=eventStore.times
+                components=eventStore.components
+                rows=componentIndices
+            else:
+                positions=np.sort(np.concatenate(componentIndices+[np.zeros(0,dtype=np.int64)]))
+                times=eventStore.times[positions]
+                components=eventStore.components[positions]
+                rows=[np.searchsorted(positions,indices) for indices in componentIndices]
+            endTime=eventStore.getObservationWindow()[1]
+            timesToEnd=endTime-times if endTime is not None else times
+            return _SourceEvents(key,positions,times,components,timesToEnd,np.asarray(sources),rows)
+
+        return eventStore.getCached(('sourceEvents',key),compute)
+
+    def __getSourceWeights(self,componentIdx,sourceEvents,impacts):
+        """q[j,k]*g_k(x) of the source events of component j"""
+        if sourceEvents.positions is not None:
+            impacts=impacts[sourceEvents.positions]
+        return self.immigrationDescendantParameters.q[componentIdx,sourceEvents.components]*impacts
+
+    def __getTargetWindowBounds(self,componentIdx,eventStore,sourceEvents,window):
+        """ExponentialSums.getWindowBounds of the source events for the events of component componentIdx as query times"""
+        return eventStore.getCached(('targetWindowBounds',componentIdx,sourceEvents.key,window),
+            lambda: ExponentialSums.getWindowBounds(sourceEvents.times,window,eventStore.times[eventStore.getComponentIndices(componentIdx)]))
+
     def getLambda(self,componentIdx,timeComponentMarkTriplets,t,includeT=False):
         """Returns lambda hat as defined in algorithm 1.28 at bottom of Liniger p. 41"""
+        if isinstance(timeComponentMarkTriplets,EventStore.EventStore):
+            return self.__getLambdaFromEventStore(componentIdx,timeComponentMarkTriplets,t,includeT)
+
         lambdaHat=self.immigrationDescendantParameters.nu[componentIdx]
 
         j=componentIdx
@@ -33,6 +137,136 @@ class GenuineMultivariateHawkesProcess:
 
         return lambdaHat
 
+    def __getLambdaFromEventStore(self,componentIdx,eventStore,t,includeT):
+        """getLambda on an EventStore, only the events inside the decay quantile window are touched"""
+        j=componentIdx
+        decayFunction=self.decayFunctions[j]
+
+        firstIdx=np.searchsorted(eventStore.times,t-decayFunction.getQ(),side='left')
+        lastIdx=np.searchsorted(eventStore.times,t,side='right' if includeT else 'left')
+        window=eventStore[firstIdx:lastIdx]
+
+        branchingFactors=self.immigrationDescendantParameters.q[j,window.components]
+        decayFunctionValues=decayFunction.getWArray(t-window.times)
+        impactFunctionValues=self.__getImpacts(window)
+
+        return self.immigrationDescendantParameters.nu[j]+np.sum(branchingFactors*decayFunctionValues*impactFunctionValues)
+
+    def __getWindowedSums(self,function,eventTimes,weights,queryTimes,windowBounds,getCachedPairs=None):
+        """
+        For every sorted query time t the sum of weights[s]*function(t-s) over the events s in the index range
+        windowBounds gives for t (ExponentialSums.getWindowBounds), the same events getLambda visits.
+        Pairs are evaluated in vectorized chunks. getCachedPairs(chunkStart,compute) may cache the pair indices
+        and time differences of every chunk.
+        """
+        firstEvents,lastEvents=windowBounds
+        counts=lastEvents-firstEvents
+        cumulativeCounts=np.cumsum(counts)
+
+        result=np.zeros(len(queryTimes))
+        start=0
+        while start<len(queryTimes):
+            previousCount=cumulativeCounts[start-1] if start>0 else 0
+            end=max(np.searchsorted(cumulativeCounts,previousCount+MAX_WINDOW_PAIRS,side='right'),start+1)
+            chunkCounts=counts[start:end]
+            numPairs=np.sum(chunkCounts)
+            if numPairs>0:
+                def computePairs():
+                    queryIndices=np.repeat(np.arange(0,end-start),chunkCounts)
+                    offsets=np.arange(numPairs)-np.repeat(np.cumsum(chunkCounts)-chunkCounts,chunkCounts)
+                    eventIndices=np.repeat(firstEvents[start:end],chunkCounts)+offsets
+                    return queryIndices,eventIndices,queryTimes[start:end][queryIndices]-eventTimes[eventIndices]
+                if getCachedPairs is None:
+                    queryIndices,eventIndices,timeDifferences=computePairs()
+                else:
+                    queryIndices,eventIndices,timeDifferences=getCachedPairs(start,computePairs)
+                values=function(timeDifferences)*weights[eventIndices]
+                result[start:end]=np.bincount(queryIndices,weights=values,minlength=end-start)
+            start=end
+
+        return result
+
+    def __getExponentialTermSums(self,decayFunction,eventTimes,weights,queryTimes,window,includeT=False,densities=True,getWindowBounds=None):
+        """
+        For every sorted query time t the sum of weights[s]*w(t-s) (with densities, else weights[s]*(1-wBar(t-s)))
+        over the events s with t-window <= s < t (s <= t if includeT), from the sum-of-exponentials representation
+        of the decay function (DecayFunctions.getExponentialTerms), one recursive exponential sum per term.
+        Terms are also cut once they have decayed below double precision. window=None for no truncation,
+        getWindowBounds(termWindow) may return cached bounds.
+        """
+        termWeights,rates=DecayFunctions.getExponentialTerms(decayFunction)
+        if densities:
+            termWeights=termWeights*rates
+
+        result=np.zeros(len(queryTimes))
+        for termWeight,rate in zip(termWeights,rates):
+            termWindow=ExponentialSums.UNTRUNCATED_WINDOW_EXPONENT/rate
+            if window is not None:
+                termWindow=min(window,termWindow)
+            windowBounds=None if getWindowBounds is None else getWindowBounds(termWindow)
+            result+=termWeight*ExponentialSums.getWindowedExponentialSums(eventTimes,weights,rate,termWindow,queryTimes,includeT,windowBounds=windowBounds)
+        return result
+
+    def getLambdaOnGrid(self,timeComponentMarkTriplets,times,includeT=False,returnCompensator=False):
+        """
+        getLambda for every component at every query time, with the same includeT semantics.
+        Events and sorted query times are matched by binary search, so the cost is O((N+M)log N) per
+        exponential term for decay functions with a sum-of-exponentials representation and O(M*window) otherwise,
+        instead of M independent history scans.
+
+        :param times: Query times, any order
+        :param returnCompensator: Also return int_{T0}^{t} lambda_j(u)du, T0 being the start of the observation window as in getCompensator.
+            Exact for decay functions with exponential terms; otherwise events older than the quantile count with wBar=1.
+        :return: Array of shape (M,K), or (lambdas,compensators) with returnCompensator
+        """
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        impacts=self.__getImpacts(eventStore)
+
+        queryTimes=np.asarray(times,dtype=float)
+        order=np.argsort(queryTimes,kind='mergesort')
+        sortedTimes=queryTimes[order]
+
+        lambdas=np.zeros([len(queryTimes),self.numComponents])
+        compensators=np.zeros([len(queryTimes),self.numComponents])
+        startTime=eventStore.getObservationWindow()[0]
+        if returnCompensator and startTime is not None:
+            elapsedTimes=np.maximum(sortedTimes-startTime,0.0)
+
+        for j in range(0,self.numComponents):
+            nu=self.immigrationDescendantParameters.nu[j]
+            decayFunction=self.decayFunctions[j]
+            isRecursive=DecayFunctions.getExponentialTerms(decayFunction) is not None
+            sourceEvents=self.__getSourceEvents(j,eventStore)
+            eventTimes=sourceEvents.times
+            weights=self.__getSourceWeights(j,sourceEvents,impacts)
+
+            if isRecursive:
+                excitations=self.__getExponentialTermSums(decayFunction,eventTimes,weights,sortedTimes,decayFunction.getQ(),includeT)
+            else:
+                windowBounds=ExponentialSums.getWindowBounds(eventTimes,decayFunction.getQ(),sortedTimes,includeT)
+                excitations=self.__getWindowedSums(decayFunction.getWArray,eventTimes,weights,sortedTimes,windowBounds)
+            lambdas[order,j]=nu+excitations
+
+            if not returnCompensator:
+                continue
+            if startTime is None:
+                compensators[:,j]=0.0
+                continue
+
+            #sum_s q*g*wBar(t-s) = sum_s q*g - sum_s q*g*(1-wBar(t-s))
+            cumulativeWeights=np.concatenate([[0.0],np.cumsum(weights)])
+            cumulativeWeightIndices=np.searchsorted(eventTimes,sortedTimes,side='right')
+            if isRecursive:
+                remainders=self.__getExponentialTermSums(decayFunction,eventTimes,weights,sortedTimes,None,includeT=True,densities=False)
+            else:
+                windowBounds=ExponentialSums.getWindowBounds(eventTimes,decayFunction.getQ(),sortedTimes,True)
+                remainders=self.__getWindowedSums(lambda u: 1.0-decayFunction.getWBarArray(u),eventTimes,weights,sortedTimes,windowBounds)
+            compensators[order,j]=nu*elapsedTimes+cumulativeWeights[cumulativeWeightIndices]-remainders
+
+        if returnCompensator:
+            return lambdas,compensators
+        return lambdas
+
     def __simulationInnerLoop(self,componentIdx,previousTime,timeComponentMarkTriplets):
         """Liniger thesis bottom p. 30"""
 
@@ -49,9 +283,269 @@ class GenuineMultivariateHawkesProcess:
             if u<=lambdaNew:
                 return tau
 
-    def getLogLikelihood(self,timeComponentMarkTriplets):
+    def hasExponentialDecayFunctions(self):
+        """True if every component decays exponentially, so the intensity has a recursive form"""
+        for decayFunction in self.decayFunctions:
+            if not isinstance(decayFunction,DecayFunctions.ExponentialDecayFunction):
+                return False
+        return True
+
+    def __getDecayFunctionNames(self):
+        return ', '.join(decayFunction.__class__.__name__ for decayFunction in self.decayFunctions)
+
+    def hasRecursiveDecayFunctions(self):
+        """
+        True if every decay function is a sum of exponentials (exponential decay functions, or power-law and
+        Mittag-Leffler decay functions created with numExponentialTerms or tolerance), so the intensity has a recursive form
+        """
+        for decayFunction in self.decayFunctions:
+            if DecayFunctions.getExponentialTerms(decayFunction) is None:
+                return False
+        return True
+
+    def getLogLikelihood(self,timeComponentMarkTriplets,truncated=False,termTimes=None):
         """
         Liniger thesis, Algorithm 1.27, p. 41
+        Sum of the terms from getLogLikelihoodTerms
+        """
+        lambdaTermSums,markDensityTermSums,compensators=self.getLogLikelihoodTerms(timeComponentMarkTriplets,truncated,termTimes)
+        return np.sum(lambdaTermSums)+np.sum(markDensityTermSums)-np.sum(compensators)
+
+    def getLogLikelihoodRecursive(self,timeComponentMarkTriplets):
+        """
+        Liniger thesis, Algorithm 1.27, p. 41, for decay functions that are sums of exponentials only.
+        For target component j the excitation sum_s q[j,k]*g_k(x)*exp(-alpha_j*(t-s)) is carried forward from event
+        to event instead of being rebuilt by getLambda, so the cost is O(N*K) per exponential term instead of O(N^2).
+        Events outside the decay quantile are dropped exactly as in getLambda, so for exponential decay functions
+        the result matches getLogLikelihoodDirect; approximated decay functions differ by their approximation error.
+        """
+        if not self.hasRecursiveDecayFunctions():
+            raise ValueError("Recursive likelihood requires ExponentialDecayFunction, or PowerLawDecayFunction or "
+                             "MittagLefflerDecayFunction created with numExponentialTerms or tolerance, for every component; got %s"
+                             % self.__getDecayFunctionNames())
+        return self.getLogLikelihood(timeComponentMarkTriplets)
+
+    def getLogLikelihoodTerms(self,timeComponentMarkTriplets,truncated=False,termTimes=None):
+        """
+        The three sums of Liniger Algorithm 1.27 split by component, arrays of length K:
+            lambdaTermSums[j]: sum of log lambda_j over the events of component j
+            markDensityTermSums[k]: sum of log f_k over the marks of component k
+            compensators[j]: getCompensator(j,truncated)
+        Components whose decay function is a sum of exponentials use the recursive form,
+        the others evaluate getLambda over the quantile window,
+        O(N*window) instead of O(N^2).
+
+        :param termTimes: Optional dict, the seconds spent on each term are added to its keys lambda, markDensity and compensator
+        :param timeComponentMarkTriplets: Events, or a MultiSequenceDataset whose per-sequence terms are summed
+        """
+        if isinstance(timeComponentMarkTriplets,MultiSequenceDataset.MultiSequenceDataset):
+            sequenceTerms=[self.getLogLikelihoodTerms(sequence,truncated,termTimes) for sequence in timeComponentMarkTriplets]
+            return tuple(np.sum([terms[idx] for terms in sequenceTerms],axis=0) for idx in range(0,3))
+
+        termTimer=_getTermTimer(termTimes)
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        impacts=self.__getImpacts(eventStore)
+
+        lambdaTermSums=np.zeros(self.numComponents)
+        compensators=np.zeros(self.numComponents)
+        for j in range(0,self.numComponents):
+            lambdaTermSums[j]=self.__getLambdaTermSum(j,eventStore,impacts)
+            termTimer.lap('lambda')
+            compensators[j]=self.__getCompensator(j,eventStore,impacts,truncated)
+            termTimer.lap('compensator')
+
+        markDensityTermSums=self.__getMarkDensityTermSums(eventStore)
+        termTimer.lap('markDensity')
+        return lambdaTermSums,markDensityTermSums,compensators
+
+    def getLogLikelihoodComponents(self,timeComponentMarkTriplets,truncated=False):
+        """
+        Log-likelihood split into parts that depend on separate parameter blocks:
+            componentTerms[j]=lambdaTermSums[j]-compensators[j], depends on nu[j], q[j,:], decay function j
+                (and on the mark parameters through the impact functions)
+            markDensityTerms[k], depends only on the mark parameters of component k
+        The log-likelihood is sum(componentTerms)+sum(markDensityTerms)
+        """
+        lambdaTermSums,markDensityTermSums,compensators=self.getLogLikelihoodTerms(timeComponentMarkTriplets,truncated)
+        return lambdaTermSums-compensators,markDensityTermSums
+
+    def getComponentLogLikelihood(self,componentIdx,timeComponentMarkTriplets,truncated=False):
+        """componentTerms[componentIdx] of getLogLikelihoodComponents, without evaluating the other components"""
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        impacts=self.__getImpacts(eventStore)
+        return self.__getLambdaTermSum(componentIdx,eventStore,impacts)-self.__getCompensator(componentIdx,eventStore,impacts,truncated)
+
+    def getEventLambdas(self,timeComponentMarkTriplets):
+        """
+        Intensity of every event's own component just before it, lambda_k(t) for each event (t,k,x) with the
+        includeT=False semantics of getLambda, as an array in event order. These are the lambda terms of the likelihood.
+        """
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        impacts=self.__getImpacts(eventStore)
+        lambdas=np.zeros(len(eventStore))
+        for j in range(0,self.numComponents):
+            lambdas[eventStore.getComponentIndices(j)]=self.__getTargetLambdas(j,eventStore,impacts)
+        return lambdas
+
+    def __getLambdaTermSum(self,componentIdx,eventStore,impacts):
+        return np.sum(np.log(self.__getTargetLambdas(componentIdx,eventStore,impacts)))
+
+    def __getTargetLambdas(self,componentIdx,eventStore,impacts):
+        """lambda_j at the events of component j"""
+        j=componentIdx
+        targetIndices=eventStore.getComponentIndices(j)
+        if len(targetIndices)==0:
+            return np.zeros(0)
+
+        decayFunction=self.decayFunctions[j]
+        sourceEvents=self.__getSourceEvents(j,eventStore)
+        weights=self.__getSourceWeights(j,sourceEvents,impacts)
+        window=decayFunction.getQ()
+        targetTimes=eventStore.times[targetIndices]
+
+        if DecayFunctions.getExponentialTerms(decayFunction) is None:
+            windowBounds=self.__getTargetWindowBounds(j,eventStore,sourceEvents,window)
+            getCachedPairs=lambda start,compute: eventStore.getCached(('windowPairs',j,sourceEvents.key,window,start),compute)
+            excitations=self.__getWindowedSums(decayFunction.getWArray,sourceEvents.times,weights,targetTimes,windowBounds,getCachedPairs)
+            return self.immigrationDescendantParameters.nu[j]+excitations
+
+        getWindowBounds=lambda termWindow: self.__getTargetWindowBounds(j,eventStore,sourceEvents,termWindow)
+        excitations=self.__getExponentialTermSums(decayFunction,sourceEvents.times,weights,targetTimes,window,getWindowBounds=getWindowBounds)
+        return self.immigrationDescendantParameters.nu[j]+excitations
+
+    def getLogLikelihoodAndGradient(self,timeComponentMarkTriplets,termTimes=None):
+        """
+        Log-likelihood and its exact gradient, computed in the same pass as getLogLikelihoodRecursive.
+        Only available when all decay functions are exponential.
+
+        :return: logLikelihood,(nuGradient,qGradient,decayGradients,markGradients)
+            nuGradient has shape (K), qGradient (K,K), decayGradients[j] and markGradients[k] hold the derivatives
+            with respect to the parameters of component j's decay function and component k's mark distribution
+        :param termTimes: Optional dict of seconds per term, see getLogLikelihoodTerms
+        """
+        if isinstance(timeComponentMarkTriplets,MultiSequenceDataset.MultiSequenceDataset):
+            return self.__sumSequenceGradients([self.getLogLikelihoodAndGradient(sequence,termTimes) for sequence in timeComponentMarkTriplets])
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        return self.__getLogLikelihoodAndGradient(eventStore,range(0,self.numComponents),True,termTimes)
+
+    def __sumSequenceGradients(self,sequenceResults):
+        """Sum (logLikelihood,gradient) pairs of getLogLikelihoodAndGradient over the sequences of a dataset"""
+        logLikelihood=0.0
+        nuGradient=np.zeros(self.numComponents)
+        qGradient=np.zeros([self.numComponents,self.numComponents])
+        decayGradients=[0.0]*self.numComponents
+        markGradients=[0.0]*self.numComponents
+        for sequenceLogLikelihood,(sequenceNuGradient,sequenceQGradient,sequenceDecayGradients,sequenceMarkGradients) in sequenceResults:
+            logLikelihood+=sequenceLogLikelihood
+            nuGradient+=sequenceNuGradient
+            qGradient+=sequenceQGradient
+            for j in range(0,self.numComponents):
+                decayGradients[j]=decayGradients[j]+sequenceDecayGradients[j]
+                markGradients[j]=markGradients[j]+sequenceMarkGradients[j]
+        return logLikelihood,(nuGradient,qGradient,decayGradients,markGradients)
+
+    def getComponentLogLikelihoodAndGradient(self,componentIdx,timeComponentMarkTriplets):
+        """getComponentLogLikelihood and its gradient, in the format of getLogLikelihoodAndGradient"""
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        return self.__getLogLikelihoodAndGradient(eventStore,[componentIdx],False)
+
+    def __getLogLikelihoodAndGradient(self,eventStore,targetComponents,includeMarkDensity,termTimes=None):
+        if not self.hasExponentialDecayFunctions():
+            raise ValueError("Analytic gradient requires ExponentialDecayFunction for every component, got %s; "
+                             "fit other decay functions without gradient" % self.__getDecayFunctionNames())
+        termTimer=_getTermTimer(termTimes)
+
+        numComponents=self.numComponents
+        nu=self.immigrationDescendantParameters.nu
+        q=self.immigrationDescendantParameters.q
+
+        impacts=self.__getImpacts(eventStore)
+        observationLength=eventStore.getObservationLength()
+
+        nuGradient=np.zeros(numComponents)
+        qGradient=np.zeros([numComponents,numComponents])
+        decayGradients=[np.zeros(1) for j in range(0,numComponents)]
+        markGradients=[np.zeros(markDistribution.getNumParameters()) for markDistribution in self.markDistributions]
+
+        impactGradients=[]
+        for k in range(0,numComponents):
+            sourceMarks=eventStore.marks[eventStore.getComponentIndices(k)]
+            impactGradients.append(eventStore.getCached(('impactGradients',)+self.__getMarkKey(k),
+                lambda: self.markDistributions[k].getImpactFunctionGradientArray(sourceMarks)))
+
+            termTimer.lap('lambda')
+            if includeMarkDensity:
+                markGradients[k]+=eventStore.getCached(('logDensityGradientSum',)+self.__getMarkKey(k),
+                    lambda: np.sum(self.markDistributions[k].getLogDensityGradientArray(sourceMarks),axis=0))
+                termTimer.lap('markDensity')
+
+        logLikelihood=0
+        for j in targetComponents:
+            alpha=self.decayFunctions[j].alpha
+            sourceEvents=self.__getSourceEvents(j,eventStore)
+            times=sourceEvents.times
+            weights=self.__getSourceWeights(j,sourceEvents,impacts)
+            sourceImpacts=impacts if sourceEvents.positions is None else impacts[sourceEvents.positions]
+
+            #Columns of the per-event weight matrix: one indicator column per source component, then the impact derivatives
+            markColumns=[]
+            numColumns=len(sourceEvents.sources)
+            for k in sourceEvents.sources:
+                markColumns.append(range(numColumns,numColumns+len(markGradients[k])))
+                numColumns+=len(markGradients[k])
+
+            columnWeights=np.zeros([len(times),numColumns])
+            for sourceIdx,k in enumerate(sourceEvents.sources):
+                rows=sourceEvents.rows[sourceIdx]
+                columnWeights[rows,sourceIdx]=sourceImpacts[rows]
+                if len(markColumns[sourceIdx])>0:
+                    columnWeights[np.ix_(rows,markColumns[sourceIdx])]=q[j,k]*impactGradients[k]
+
+            targetTimes=eventStore.times[eventStore.getComponentIndices(j)]
+            if len(targetTimes)>0:
+                window=self.decayFunctions[j].getQ()
+                windowBounds=self.__getTargetWindowBounds(j,eventStore,sourceEvents,window)
+                excitations=ExponentialSums.getWindowedExponentialSums(times,weights,alpha,window,targetTimes,windowBounds=windowBounds)
+                timeWeightedExcitations=ExponentialSums.getWindowedExponentialSums(times,weights,alpha,window,targetTimes,timeWeighted=True,windowBounds=windowBounds)
+                columnSums=ExponentialSums.getWindowedExponentialSums(times,columnWeights,alpha,window,targetTimes,windowBounds=windowBounds)
+
+                lambdas=nu[j]+alpha*excitations
+                inverseLambdas=1.0/lambdas
+                logLikelihood+=np.sum(np.log(lambdas))
+
+                weightedColumnSums=alpha*inverseLambdas.dot(columnSums)
+                nuGradient[j]+=np.sum(inverseLambdas)
+                qGradient[j,sourceEvents.sources]+=weightedColumnSums[0:len(sourceEvents.sources)]
+                decayGradients[j][0]+=inverseLambdas.dot(excitations-alpha*timeWeightedExcitations)
+                for sourceIdx,k in enumerate(sourceEvents.sources):
+                    markGradients[k]+=weightedColumnSums[markColumns[sourceIdx]]
+            termTimer.lap('lambda')
+
+            #Compensator, see getCompensator
+            timesToEnd=sourceEvents.timesToEnd
+            decays=np.exp(-alpha*timesToEnd)
+            wBarValues=self.decayFunctions[j].getWBarArray(timesToEnd)
+            logLikelihood-=nu[j]*observationLength+np.sum(weights*wBarValues)
+
+            nuGradient[j]-=observationLength
+            columnCompensators=wBarValues.dot(columnWeights)
+            qGradient[j,sourceEvents.sources]-=columnCompensators[0:len(sourceEvents.sources)]
+            decayGradients[j][0]-=np.sum(weights*timesToEnd*decays)
+            for sourceIdx,k in enumerate(sourceEvents.sources):
+                markGradients[k]-=columnCompensators[markColumns[sourceIdx]]
+            termTimer.lap('compensator')
+
+        if includeMarkDensity:
+            logLikelihood+=np.sum(self.__getMarkDensityTermSums(eventStore))
+            termTimer.lap('markDensity')
+
+        return logLikelihood,(nuGradient,qGradient,decayGradients,markGradients)
+
+    def getLogLikelihoodDirect(self,timeComponentMarkTriplets):
+        """
+        Liniger thesis, Algorithm 1.27, p. 41
+        Reference implementation, calls getLambda for every event so it is O(N^2)
+        (O(N*window) for an EventStore, where getLambda only visits the quantile window)
         """
 
         lambdaTermSum=0
@@ -67,29 +561,44 @@ class GenuineMultivariateHawkesProcess:
 
         return lambdaTermSum+markDensityTermSum-compensatorTermSum
 
-    def getCompensator(self,componentIdx,timeComponentMarkTriplets):
+    def getCompensator(self,componentIdx,timeComponentMarkTriplets,truncated=False):
         """
         Big Lambda from Liniger Thesis
         Algorithm from Liniger thesis p. 44
+
+        :param truncated: Use the approximation at the bottom of Liniger p. 44: events older than the decay quantile
+            q_j get wBar=1, so wBar is only evaluated inside the window. The error is at most epsilon*sum(q*g)
+        :param timeComponentMarkTriplets: Events, or a MultiSequenceDataset whose per-sequence compensators are summed
         """
-        #TODO: This can be made a little faster using the approximation at the bottom of Liniger p. 44.
-        #TODO: Just don't calculate wBar if lastTime-s > q_j
-        firstTime=timeComponentMarkTriplets[0][0]
-        lastTime=timeComponentMarkTriplets[-1][0]
-        firstTerm=self.immigrationDescendantParameters.nu[componentIdx]*(lastTime-firstTime)
+        if isinstance(timeComponentMarkTriplets,MultiSequenceDataset.MultiSequenceDataset):
+            return sum(self.getCompensator(componentIdx,sequence,truncated) for sequence in timeComponentMarkTriplets)
+        eventStore=self.__getEventStore(timeComponentMarkTriplets)
+        return self.__getCompensator(componentIdx,eventStore,self.__getImpacts(eventStore),truncated)
+
+    def __getCompensator(self,componentIdx,eventStore,impacts,truncated=False):
+        firstTerm=self.immigrationDescendantParameters.nu[componentIdx]*eventStore.getObservationLength()
 
         j=componentIdx
-        secondTerm=0
-        for s,k,x in timeComponentMarkTriplets:
-            branchingFactor=self.immigrationDescendantParameters.q[j,k]
-            wBarValue=self.decayFunctions[j].getWBar(lastTime-s)
-            gValue=self.markDistributions[k].getImpactFunction(x)
-            secondTerm+=branchingFactor*wBarValue*gValue
+        decayFunction=self.decayFunctions[j]
+        sourceEvents=self.__getSourceEvents(j,eventStore)
+        weights=self.__getSourceWeights(j,sourceEvents,impacts)
+        if truncated:
+            lastTime=eventStore.getObservationWindow()[1]
+            firstIdx=np.searchsorted(sourceEvents.times,lastTime-decayFunction.getQ(),side='left') if len(sourceEvents.times)>0 else 0
+            wBarValues=DecayFunctions.getWBarArray(decayFunction,sourceEvents.timesToEnd[firstIdx:])
+            secondTerm=np.sum(weights[:firstIdx])+np.sum(weights[firstIdx:]*wBarValues)
+        else:
+            wBarValues=DecayFunctions.getWBarArray(decayFunction,sourceEvents.timesToEnd)
+            secondTerm=np.sum(weights*wBarValues)
 
         retval=firstTerm+secondTerm
         return retval
 
     def simulate(self,numTimesteps):
+        """
+        Reference simulator, Liniger thesis p. 30. Every proposal rescans the history,
+        see ThinningSimulator for long paths.
+        """
         timeComponentMarkTriplets=[]
 
         currentTime=0
@@ -1,8 +1,226 @@
 __author__ = 'tjohnson'
-import ImmigrationDescendantParameters
+import CompiledDataset
+import EventStore
+import MultiSequenceDataset
+import multiprocessing
+import os
 import random
+import shutil
+import tempfile
+import numpy as np
 import scipy.optimize
 
+#Per-process state of pool workers, set once by _initializeFitterWorker
+_fitterWorker={}
+
+
+class _StartAborted(Exception):
+    pass
+
+
+def _initializeFitterWorker(fitter,eventStorePath,workerSettings):
+    """Pool initializer: the fitter is unpickled and the events memory-mapped once per worker, not once per task"""
+    _fitterWorker['fitter']=fitter
+    if os.path.isdir(eventStorePath):
+        _fitterWorker['events']=MultiSequenceDataset.MultiSequenceDataset.load(eventStorePath)
+    else:
+        _fitterWorker['events']=CompiledDataset.CompiledDataset(EventStore.EventStore.load(eventStorePath))
+    _fitterWorker.update(workerSettings)
+
+
+class _FitterWorkerPool:
+    def __init__(self,fitter,eventStore,numWorkers,workerSettings=None):
+        """
+        Process pool whose workers hold a copy of the fitter and a memory map of the events.
+        The events are written once to a temporary EventStore file (a directory for a MultiSequenceDataset).
+        numWorkers=1 runs tasks in this process.
+        """
+        if isinstance(eventStore,MultiSequenceDataset.MultiSequenceDataset):
+            self.eventStorePath=tempfile.mkdtemp(suffix='.sequences')
+        else:
+            fileHandle,self.eventStorePath=tempfile.mkstemp(suffix='.events')
+            os.close(fileHandle)
+        eventStore.save(self.eventStorePath)
+
+        initializerArgs=(fitter,self.eventStorePath,workerSettings or {})
+        if numWorkers==1:
+            _initializeFitterWorker(*initializerArgs)
+            self.pool=None
+        else:
+            self.pool=multiprocessing.Pool(numWorkers,initializer=_initializeFitterWorker,initargs=initializerArgs)
+
+    def map(self,function,tasks):
+        if self.pool is None:
+            return map(function,tasks)
+        return self.pool.map(function,tasks,chunksize=1)
+
+    def close(self):
+        if self.pool is None:
+            _fitterWorker.clear()
+        else:
+            self.pool.close()
+            self.pool.join()
+        if os.path.isdir(self.eventStorePath):
+            shutil.rmtree(self.eventStorePath)
+        else:
+            os.remove(self.eventStorePath)
+
+
+def _runSequenceLikelihoodTask(args):
+    """Negative log-likelihood (and gradient) of a chunk of the worker's MultiSequenceDataset, with the seconds per term"""
+    params,sequenceIndices,withGradient=args
+    fitter=_fitterWorker['fitter']
+    dataset=_fitterWorker['events']
+    termTimes={}
+    value=0.0
+    gradient=np.zeros(fitter.numParams)
+    for sequenceIdx in sequenceIndices:
+        if withGradient:
+            sequenceValue,sequenceGradient=fitter.getNegativeLogLikelihoodAndGradient(params,dataset[sequenceIdx],termTimes)
+            gradient+=sequenceGradient
+        else:
+            sequenceValue=fitter.getNegativeLogLikelihood(params,dataset[sequenceIdx],termTimes)
+        value+=sequenceValue
+    return value,gradient,termTimes
+
+
+class ParallelLikelihood:
+    def __init__(self,fitter,dataset,numWorkers=None,chunksPerWorker=1):
+        """
+        Negative log-likelihood of a MultiSequenceDataset evaluated by a persistent process pool.
+        Every worker memory-maps the whole dataset once when the pool starts; an evaluation only sends the
+        parameter vector and the sequence indices of each chunk, and gets back the chunk sums.
+        Sequences are split into numWorkers*chunksPerWorker chunks of similar event counts.
+        Close it (or use it in a with statement) to stop the workers.
+
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to evaluate in this process
+        """
+        self.fitter=fitter
+        if numWorkers is None:
+            numWorkers=multiprocessing.cpu_count()
+        self.chunks=dataset.getSequenceChunks(numWorkers*chunksPerWorker)
+        self.workerPool=_FitterWorkerPool(fitter,dataset,numWorkers)
+
+    def __evaluate(self,params,withGradient,termTimes):
+        params=np.array(params,dtype=float)
+        results=self.workerPool.map(_runSequenceLikelihoodTask,[(params,chunk,withGradient) for chunk in self.chunks])
+        if termTimes is not None:
+            for value,gradient,chunkTermTimes in results:
+                for term,seconds in chunkTermTimes.items():
+                    termTimes[term]=termTimes.get(term,0.0)+seconds
+        return sum(result[0] for result in results),np.sum([result[1] for result in results],axis=0)
+
+    def getNegativeLogLikelihood(self,params,termTimes=None):
+        """:param termTimes: Optional dict, receives the worker seconds per term summed over chunks"""
+        return self.__evaluate(params,False,termTimes)[0]
+
+    def getNegativeLogLikelihoodAndGradient(self,params,termTimes=None):
+        return self.__evaluate(params,True,termTimes)
+
+    def close(self):
+        self.workerPool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,excType,excValue,traceback):
+        self.close()
+
+
+def _runMultiStartTask(args):
+    startIdx,initialGuess=args
+    fitter=_fitterWorker['fitter']
+    events=_fitterWorker['events']
+    sharedBestValue=_fitterWorker['sharedBestValue']
+    abortAfterIterations=_fitterWorker['abortAfterIterations']
+    abortMargin=_fitterWorker['abortMargin']
+
+    progress={'iterations':0,'params':np.array(initialGuess,dtype=float),'value':float('inf'),'lastParams':None,'lastValue':None}
+
+    def recordEvaluation(x,value):
+        progress['lastParams']=np.array(x,dtype=float)
+        progress['lastValue']=value
+        if value<progress['value']:
+            progress['value']=value
+            progress['params']=progress['lastParams']
+
+    def objective(x):
+        value,gradient=fitter.getNegativeLogLikelihoodAndGradient(x,events)
+        recordEvaluation(x,value)
+        return value,gradient
+
+    def objectiveWithoutGradient(x):
+        value=fitter.getNegativeLogLikelihood(x,events)
+        recordEvaluation(x,value)
+        return value
+
+    def callback(x):
+        progress['iterations']+=1
+        with sharedBestValue.get_lock():
+            sharedBestValue.value=min(sharedBestValue.value,progress['value'])
+            bestValue=sharedBestValue.value
+        if abortAfterIterations is not None and progress['iterations']>=abortAfterIterations and progress['value']>bestValue+abortMargin:
+            raise _StartAborted()
+
+    aborted=False
+    message=''
+    try:
+        if fitter.hawkesProcess.hasExponentialDecayFunctions():
+            result=scipy.optimize.fmin_l_bfgs_b(objective,x0=initialGuess,bounds=fitter.parameterBounds,callback=callback)
+        else:
+            result=scipy.optimize.fmin_l_bfgs_b(objectiveWithoutGradient,x0=initialGuess,approx_grad=True,bounds=fitter.parameterBounds,callback=callback)
+        params,value,info=result
+        message=info['task']
+    except _StartAborted:
+        aborted=True
+        params,value=progress['params'],progress['value']
+        message='Aborted, worse than the best start by more than %s' % abortMargin
+
+    with sharedBestValue.get_lock():
+        sharedBestValue.value=min(sharedBestValue.value,value)
+
+    return {'start':startIdx,'initialGuess':np.array(initialGuess,dtype=float),'params':np.array(params,dtype=float),
+            'negativeLogLikelihood':float(value),'iterations':progress['iterations'],'aborted':aborted,'message':message}
+
+
+def _optimizeParameterBlock(fitter,params,blockIndices,objective):
+    """
+    L-BFGS-B over params[blockIndices] with the other parameters held fixed.
+    objective(fullParams) returns the negative log-likelihood, with its full gradient if the decay functions are exponential
+    """
+    params=np.array(params,dtype=float)
+    useGradient=fitter.hawkesProcess.hasExponentialDecayFunctions()
+
+    def blockObjective(blockValues):
+        fullParams=params.copy()
+        fullParams[blockIndices]=blockValues
+        if useGradient:
+            value,gradient=objective(fullParams)
+            return value,gradient[blockIndices]
+        return objective(fullParams)
+
+    bounds=[fitter.parameterBounds[idx] for idx in blockIndices]
+    blockValues,value,info=scipy.optimize.fmin_l_bfgs_b(blockObjective,x0=params[blockIndices],approx_grad=not useGradient,bounds=bounds)
+    return blockValues
+
+
+def _runComponentBlockTask(args):
+    """Optimize nu[j], q[j,:] (and decay function j if not shared) against component j's likelihood terms"""
+    componentIdx,params,blockIndices=args
+    fitter=_fitterWorker['fitter']
+    events=_fitterWorker['events']
+    hawkesProcess=fitter.hawkesProcess
+
+    def objective(fullParams):
+        fitter.setParameterValues(fullParams)
+        if hawkesProcess.hasExponentialDecayFunctions():
+            value,gradient=hawkesProcess.getComponentLogLikelihoodAndGradient(componentIdx,events)
+            return -value,-fitter.getParameterGradient(gradient)
+        return -hawkesProcess.getComponentLogLikelihood(componentIdx,events)
+
+    return componentIdx,_optimizeParameterBlock(fitter,params,blockIndices,objective)
+
+
 class GenuineMultivariateHawkesProcessFitter:
     def __init__(self,hawkesProcess):
         self.hawkesProcess=hawkesProcess
@@ -10,10 +228,12 @@ class GenuineMultivariateHawkesProcessFitter:
         totalNumParams=0
         parameterBounds=[]
 
+        #Dense or sparse (SparseImmigrationDescendantParameters) branching structure, asked through the instance
         numComponents=hawkesProcess.numComponents
-        self.immigrationDescendantNumParams=ImmigrationDescendantParameters.ImmigrationDescendantParameters.getNumParameters(numComponents)
+        immigrationDescendantParameters=hawkesProcess.immigrationDescendantParameters
+        self.immigrationDescendantNumParams=immigrationDescendantParameters.getNumParameters(numComponents)
         totalNumParams+=self.immigrationDescendantNumParams
-        parameterBounds.extend(ImmigrationDescendantParameters.ImmigrationDescendantParameters.getParameterBounds(numComponents))
+        parameterBounds.extend(immigrationDescendantParameters.getParameterBounds(numComponents))
 
         self.decayFunctionsNumParams=[]
         for decayFunction in self.__getDecayFunctions():
@@ -56,6 +276,52 @@ class GenuineMultivariateHawkesProcessFitter:
 
         return retval
 
+    def getComponentParameterIndices(self):
+        """
+        Positions of each component's decay function and mark distribution parameters in the parameter vector.
+        Components sharing an instance share positions.
+        :return: decayIndices,markIndices, lists of index lists with one entry per component
+        """
+        position=self.immigrationDescendantNumParams
+        componentIndices=[]
+        for functions,numParamsList in [(self.hawkesProcess.decayFunctions,self.decayFunctionsNumParams),(self.hawkesProcess.markDistributions,self.markDistributionsNumParams)]:
+            indices=[]
+            lastFunction=None
+            uniqueIdx=-1
+            for function in functions:
+                if function is not lastFunction:
+                    uniqueIdx+=1
+                    functionIndices=range(position,position+numParamsList[uniqueIdx])
+                    position+=numParamsList[uniqueIdx]
+                    lastFunction=function
+                indices.append(functionIndices)
+            componentIndices.append(indices)
+
+        return componentIndices[0],componentIndices[1]
+
+    def getSeparableParameterBlocks(self):
+        """
+        Parameter blocks for maximizeLikelihoodSeparable.
+        componentBlocks[j] holds nu[j], q[j,:] (the edges into j for a sparse q) and the parameters of decay function j unless another component shares it;
+        sharedBlock holds the mark parameters and the shared decay parameters.
+        """
+        numComponents=self.hawkesProcess.numComponents
+        decayIndices,markIndices=self.getComponentParameterIndices()
+
+        componentBlocks=[]
+        sharedBlock=set()
+        for j in range(0,numComponents):
+            block=self.hawkesProcess.immigrationDescendantParameters.getTargetParameterIndices(j)
+            if sum(1 for indices in decayIndices if indices==decayIndices[j])==1:
+                block.extend(decayIndices[j])
+            else:
+                sharedBlock.update(decayIndices[j])
+            componentBlocks.append(block)
+        for indices in markIndices:
+            sharedBlock.update(indices)
+
+        return componentBlocks,sorted(sharedBlock)
+
     def getInitialRandomVector(self):
         vector=[]
         for lowerBound,upperBound in self.parameterBounds:
@@ -84,21 +350,152 @@ class GenuineMultivariateHawkesProcessFitter:
 
             markDistribution.setParams(markDistributionParams)
 
-    def __getNegativeLogLikelihoodWithParameters(self,parameters,timeComponentMarkTriples):
-        print "Getting log likelihood with parameters",parameters
+    def getParameterGradient(self,gradient):
+        """
+        Flatten the gradient returned by GenuineMultivariateHawkesProcess.getLogLikelihoodAndGradient into the
+        parameter vector layout of setParameterValues. Components sharing a decay function or mark distribution
+        contribute to the same parameters.
+        """
+        nuGradient,qGradient,decayGradients,markGradients=gradient
+        parameterGradient=[self.hawkesProcess.immigrationDescendantParameters.getParameterGradient(nuGradient,qGradient)]
+
+        for functions,componentGradients in [(self.hawkesProcess.decayFunctions,decayGradients),(self.hawkesProcess.markDistributions,markGradients)]:
+            lastFunction=None
+            for function,componentGradient in zip(functions,componentGradients):
+                componentGradient=np.asarray(componentGradient,dtype=float)
+                if function is lastFunction:
+                    parameterGradient[-1]=parameterGradient[-1]+componentGradient
+                    continue
+                parameterGradient.append(componentGradient)
+                lastFunction=function
+
+        return np.concatenate(parameterGradient)
+
+    def getNegativeLogLikelihood(self,parameters,timeComponentMarkTriples,termTimes=None):
+        self.setParameterValues(parameters)
+        return -self.hawkesProcess.getLogLikelihood(timeComponentMarkTriples,termTimes=termTimes)
+
+    def getNegativeLogLikelihoodAndGradient(self,parameters,timeComponentMarkTriples,termTimes=None):
         self.setParameterValues(parameters)
-        negativeLogLikelihood=-self.hawkesProcess.getLogLikelihood(timeComponentMarkTriples)
-        print "Got",negativeLogLikelihood
-        return negativeLogLikelihood
+        logLikelihood,gradient=self.hawkesProcess.getLogLikelihoodAndGradient(timeComponentMarkTriples,termTimes)
+        return -logLikelihood,-self.getParameterGradient(gradient)
+
+    def maximizeLikelihood(self,timeComponentMarkTriples,initialGuess,instrumentation=None):
+        """
+        L-BFGS-B over all parameters. Uses the analytic gradient when all decay functions are exponential,
+        otherwise finite differences. A MultiSequenceDataset is evaluated sequence by sequence in this process,
+        see maximizeLikelihoodMultiSequence for a worker pool.
+        :param instrumentation: Optional FitInstrumentation.FitInstrumentation collecting per-evaluation timings
+            and per-iteration state, see FitInstrumentation.printProgress for console output
+        :return: (bestParams,negativeLogLikelihood,infoDict) as returned by scipy.optimize.fmin_l_bfgs_b
+        """
+        #Compile once so every evaluation works on the columnar arrays and reuses what did not change
+        if isinstance(timeComponentMarkTriples,MultiSequenceDataset.MultiSequenceDataset):
+            eventStore=timeComponentMarkTriples
+        else:
+            eventStore=CompiledDataset.asCompiledDataset(timeComponentMarkTriples,self.hawkesProcess.numComponents)
+        return self.__maximize(lambda x,termTimes=None: self.getNegativeLogLikelihood(x,eventStore,termTimes),
+                               lambda x,termTimes=None: self.getNegativeLogLikelihoodAndGradient(x,eventStore,termTimes),
+                               initialGuess,instrumentation)
 
-    def maximizeLikelihood(self,timeComponentMarkTriples,initialGuess):
+    def maximizeLikelihoodMultiSequence(self,dataset,initialGuess,numWorkers=None,instrumentation=None):
+        """
+        maximizeLikelihood for a MultiSequenceDataset with the per-sequence likelihoods evaluated in parallel by a
+        ParallelLikelihood pool that lives for the whole optimization
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to run in this process
+        """
+        with ParallelLikelihood(self,dataset,numWorkers) as parallelLikelihood:
+            return self.__maximize(parallelLikelihood.getNegativeLogLikelihood,parallelLikelihood.getNegativeLogLikelihoodAndGradient,
+                                   initialGuess,instrumentation)
+
+    def __maximize(self,negativeLogLikelihood,negativeLogLikelihoodAndGradient,initialGuess,instrumentation):
         self.setParameterValues(initialGuess)
-        negativeLogLikelihoodFunction=lambda x: self.__getNegativeLogLikelihoodWithParameters(x,timeComponentMarkTriples)
-        print "Initial Likelihood: %s" % negativeLogLikelihoodFunction(initialGuess)
 
-        bestParams=scipy.optimize.fmin_l_bfgs_b(negativeLogLikelihoodFunction,x0=initialGuess,approx_grad=True,bounds=self.parameterBounds,iprint=1)
-        print "BestParams:",bestParams
-        print "Best Log likelihood:",negativeLogLikelihoodFunction(bestParams)
+        useGradient=self.hawkesProcess.hasExponentialDecayFunctions()
+        objective=negativeLogLikelihoodAndGradient if useGradient else negativeLogLikelihood
+
+        callback=None
+        if instrumentation is not None:
+            instrumentation.reset()
+            objective=instrumentation.wrapObjective(objective)
+            callback=instrumentation.recordIteration
+
+        bestParams=scipy.optimize.fmin_l_bfgs_b(objective,x0=initialGuess,approx_grad=not useGradient,bounds=self.parameterBounds,callback=callback)
+        self.setParameterValues(bestParams[0])
+        return bestParams
+
+    def maximizeLikelihoodSeparable(self,timeComponentMarkTriples,initialGuess,numWorkers=None,tolerance=1e-8,maxRounds=100):
+        """
+        Block-coordinate maximization exploiting the separability of the likelihood (see getLogLikelihoodComponents).
+        Each round optimizes every component block of getSeparableParameterBlocks in parallel against that component's
+        terms only, then the shared block (mark and shared decay parameters) against the full likelihood.
+        Stops when a round improves the log-likelihood by less than tolerance*(1+|logLikelihood|).
+
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to run in this process
+        :return: (bestParams,negativeLogLikelihood,infoDict) with infoDict keys rounds and converged
+        """
+        eventStore=EventStore.asEventStore(timeComponentMarkTriples,self.hawkesProcess.numComponents)
+        componentBlocks,sharedBlock=self.getSeparableParameterBlocks()
+        useGradient=self.hawkesProcess.hasExponentialDecayFunctions()
+
+        params=np.array(initialGuess,dtype=float)
+        value=self.getNegativeLogLikelihood(params,eventStore)
+        converged=False
+        numRounds=0
+
+        workerPool=_FitterWorkerPool(self,eventStore,numWorkers)
+        try:
+            while numRounds<maxRounds and not converged:
+                numRounds+=1
+                tasks=[(j,params,block) for j,block in enumerate(componentBlocks)]
+                for j,blockValues in workerPool.map(_runComponentBlockTask,tasks):
+                    params[componentBlocks[j]]=blockValues
+
+                if len(sharedBlock)>0:
+                    if useGradient:
+                        objective=lambda x: self.getNegativeLogLikelihoodAndGradient(x,eventStore)
+                    else:
+                        objective=lambda x: self.getNegativeLogLikelihood(x,eventStore)
+                    params[sharedBlock]=_optimizeParameterBlock(self,params,sharedBlock,objective)
+
+                previousValue=value
+                value=self.getNegativeLogLikelihood(params,eventStore)
+                converged=previousValue-value<=tolerance*(1.0+abs(value))
+        finally:
+            workerPool.close()
+
+        self.setParameterValues(params)
+        return params,value,{'rounds':numRounds,'converged':converged}
+
+    def maximizeLikelihoodMultiStart(self,timeComponentMarkTriples,numStarts,numWorkers=None,initialGuesses=None,abortAfterIterations=20,abortMargin=10.0):
+        """
+        Run numStarts independent L-BFGS-B fits concurrently in a process pool.
+        The events are written once to a temporary EventStore file that every worker memory-maps, so they are not
+        pickled per start. A start is abandoned once it has run abortAfterIterations iterations and its objective is
+        still more than abortMargin (in log-likelihood units) worse than the best value seen by any start.
+
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to run the starts in this process
+        :param initialGuesses: Starting vectors, getInitialRandomVector() is used for missing ones
+        :param abortAfterIterations: None to never abort a start
+        :return: (bestParams,negativeLogLikelihood,summary) where summary has one dict per start with keys
+            start, initialGuess, params, negativeLogLikelihood, iterations, aborted and message
+        """
+        eventStore=EventStore.asEventStore(timeComponentMarkTriples,self.hawkesProcess.numComponents)
+        initialGuesses=list(initialGuesses) if initialGuesses is not None else []
+        while len(initialGuesses)<numStarts:
+            initialGuesses.append(self.getInitialRandomVector())
+        tasks=list(enumerate(initialGuesses[0:numStarts]))
+
+        workerSettings={'sharedBestValue':multiprocessing.Value('d',float('inf')),'abortAfterIterations':abortAfterIterations,'abortMargin':abortMargin}
+        workerPool=_FitterWorkerPool(self,eventStore,numWorkers,workerSettings)
+        try:
+            summary=workerPool.map(_runMultiStartTask,tasks)
+        finally:
+            workerPool.close()
+
+        best=min(summary,key=lambda startResult: startResult['negativeLogLikelihood'])
+        self.setParameterValues(best['params'])
+        return best['params'],best['negativeLogLikelihood'],summary
 
 
 if __name__=="__main__":
@@ -1,9 +1,15 @@
 __author__ = 'tjohnson'
 
+import unittest
+import ClusterSimulator
 import DecayFunctions
+import EventStore
+import GenuineMultivariateHawkesProcessFitter
+import IntensityTracker
 import MarkDistributions
 import GenuineMultivariateHawkesProcess
 import ImmigrationDescendantParameters
+import ThinningSimulator
 import numpy as np
 
 
@@ -43,4 +49,87 @@ badLogLikelihood=GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProce
     immigrationDescendantParameters,
     [badDecayFunction,badDecayFunction],
     [markDistribution1,markDistribution2]).getLogLikelihood(secondHalfTimeComponentMarkTriples)
-print badLogLikelihood
\ No newline at end of file
+print badLogLikelihood
+
+
+def buildPowerLawProcess():
+    """The process above with power-law decay functions, one instance per component"""
+    return GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        ImmigrationDescendantParameters.ImmigrationDescendantParameters(2,[0.021,0.029,0.61,0.16,0.6,0.06]),
+        [DecayFunctions.PowerLawDecayFunction([1.5,60.0]),DecayFunctions.PowerLawDecayFunction([2.0,40.0])],
+        [markDistribution1,markDistribution2])
+
+
+class LikelihoodTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.events=ClusterSimulator.ClusterSimulator(hawkesProcess).simulate(8000.0,12345,numWorkers=1)
+        cls.triplets=cls.events.toTriplets()
+
+    def testEnoughEvents(self):
+        self.assertGreater(len(self.events),100)
+
+    def testSimulatedWindow(self):
+        self.assertEqual(self.events.getObservationWindow(),(0.0,8000.0))
+
+    def testThinningWindow(self):
+        simulator=ThinningSimulator.ThinningSimulator(hawkesProcess)
+        self.assertEqual(simulator.simulate(randomState=3,startTime=100.0,endTime=2000.0).getObservationWindow(),(100.0,2000.0))
+        path=simulator.simulate(50,randomState=3,endTime=1e9)
+        self.assertEqual(len(path),50)
+        self.assertEqual(path.getObservationWindow(),(0.0,path.times[-1]))
+
+    def testRecursiveMatchesDirect(self):
+        #The triplets span the first to the last event, the simulated EventStore its window [0,8000]
+        for events in [self.triplets,self.events]:
+            direct=hawkesProcess.getLogLikelihoodDirect(events)
+            self.assertAlmostEqual(hawkesProcess.getLogLikelihood(events)/direct,1.0,places=10)
+
+    def testTruncatedMatchesDirect(self):
+        direct=hawkesProcess.getLogLikelihoodDirect(self.events)
+        self.assertAlmostEqual(hawkesProcess.getLogLikelihood(self.events,truncated=True)/direct,1.0,places=5)
+
+    def testWindowedMatchesDirect(self):
+        powerLawProcess=buildPowerLawProcess()
+        direct=powerLawProcess.getLogLikelihoodDirect(self.events)
+        self.assertAlmostEqual(powerLawProcess.getLogLikelihood(self.events,truncated=True)/direct,1.0,places=10)
+
+    def testUnsupportedDecayFunctionsRaise(self):
+        powerLawProcess=buildPowerLawProcess()
+        self.assertRaises(ValueError,powerLawProcess.getLogLikelihoodRecursive,self.events)
+        self.assertRaises(ValueError,powerLawProcess.getLogLikelihoodAndGradient,self.events)
+
+    def testGradientMatchesFiniteDifferences(self):
+        fitter=GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(hawkesProcess)
+        params=np.array([0.021,0.029,0.61,0.16,0.6,0.06,alpha,mu1,rho1,phi1,psi1,0.0,mu2,rho2,phi2,0.1,0.0])
+        value,gradient=fitter.getNegativeLogLikelihoodAndGradient(params,self.events)
+        for idx in range(0,len(params)):
+            step=1e-6*max(abs(params[idx]),1e-3)
+            upper=params.copy()
+            lower=params.copy()
+            upper[idx]+=step
+            lower[idx]-=step
+            difference=(fitter.getNegativeLogLikelihood(upper,self.events)-fitter.getNegativeLogLikelihood(lower,self.events))/(2*step)
+            self.assertAlmostEqual(gradient[idx],difference,delta=1e-4*max(1.0,abs(difference)))
+
+    def testGridMatchesGetLambda(self):
+        queryTimes=np.concatenate([self.events.times[::7],np.random.RandomState(0).uniform(0.0,self.events.times[-1],50)])
+        for includeT in [False,True]:
+            grid=hawkesProcess.getLambdaOnGrid(self.events,queryTimes,includeT)
+            for queryIdx,t in enumerate(queryTimes):
+                for j in range(0,hawkesProcess.numComponents):
+                    self.assertAlmostEqual(grid[queryIdx,j],hawkesProcess.getLambda(j,self.events,t,includeT),places=12)
+
+    def testIntensityTrackerMatchesGetLambda(self):
+        #The tracker keeps events beyond the decay quantile, which getLambda drops: relative difference below epsilon
+        intensityTracker=IntensityTracker.IntensityTracker(hawkesProcess)
+        for eventIdx in range(0,len(self.events)):
+            t,k,x=self.events[eventIdx]
+            for j in range(0,hawkesProcess.numComponents):
+                expected=hawkesProcess.getLambda(j,self.events,t,includeT=False)
+                self.assertAlmostEqual(intensityTracker.intensity(j,t)/expected,1.0,places=4)
+            intensityTracker.push(t,k,x)
+
+
+if __name__=='__main__':
+    unittest.main()
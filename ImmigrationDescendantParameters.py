@@ -6,6 +6,7 @@ class ImmigrationDescendantParameters:
         self.numComponents=numComponents
         self.nu=np.zeros(numComponents) #Immigration intensities
         self.q=np.zeros([numComponents,numComponents]) #Branching matrix
+        self.allComponents=np.arange(numComponents)
 
         self.setParameters(params)
 
@@ -28,6 +29,23 @@ class ImmigrationDescendantParameters:
         for qIdx,paramVal in zip(range(0,self.numComponents*self.numComponents),params[self.numComponents:]):
             self.q.put(qIdx,paramVal)
 
+    def getParameters(self):
+        """Parameter vector in the layout of setParameters"""
+        return np.concatenate([self.nu,self.q.ravel()])
+
+    def getSourceComponents(self,componentIdx):
+        """Components whose events can excite componentIdx, all of them for a dense q"""
+        return self.allComponents
+
+    def getTargetParameterIndices(self,componentIdx):
+        """Positions of nu[j] and q[j,:] in the parameter vector"""
+        numComponents=self.numComponents
+        return [componentIdx]+range(numComponents+componentIdx*numComponents,numComponents+(componentIdx+1)*numComponents)
+
+    def getParameterGradient(self,nuGradient,qGradient):
+        """Gradient with respect to the parameter vector, from the gradients with respect to nu and the KxK q"""
+        return np.concatenate([np.asarray(nuGradient,dtype=float),np.asarray(qGradient,dtype=float).ravel()])
+
     def getSpectralRadius(self):
         eigenVals,eigenVects=np.linalg.eig(self.q)
         maxVal=0
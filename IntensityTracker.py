@@ -0,0 +1,169 @@
+__author__ = 'tjohnson'
+import collections
+import numpy as np
+import DecayFunctions
+
+
+class _ExponentialIntensityState:
+    def __init__(self,hawkesProcess):
+        """
+        Decay functions are sums of exponentials w_j(t)=sum_i c_i*r_i*exp(-r_i*t) (DecayFunctions.getExponentialTerms),
+        one term for an exponential decay function. For every term excitations[i]=sum_s q[j,k]*g_k(x)*exp(-r_i*(t-s))
+        at the time of the last event, memory is O(K*terms).
+        Unlike getLambda nothing is dropped at the decay quantile, the difference is at most epsilon per event.
+        """
+        self.nu=np.array(hawkesProcess.immigrationDescendantParameters.nu,dtype=float)
+        q=np.array(hawkesProcess.immigrationDescendantParameters.q,dtype=float)
+        self.markDistributions=hawkesProcess.markDistributions
+
+        #Term i belongs to component termComponents[i] and contributes termWeights[i]*excitations[i] to its intensity
+        self.termComponents,self.termWeights,self.rates=DecayFunctions.getStackedExponentialTerms(hawkesProcess.decayFunctions)
+        self.q=q[self.termComponents]
+
+        self.time=None
+        self.excitations=np.zeros(len(self.rates))
+        #Part of excitations pushed exactly at self.time, removed again when includeT is False
+        self.lastTimeExcitations=np.zeros(len(self.rates))
+
+    def push(self,t,k,x):
+        newExcitations=self.q[:,k]*self.markDistributions[k].getImpactFunction(x)
+        if t==self.time:
+            self.lastTimeExcitations=self.lastTimeExcitations+newExcitations
+            self.excitations=self.excitations+newExcitations
+        else:
+            self.lastTimeExcitations=newExcitations
+            self.excitations=self.__getExcitations(t)+newExcitations
+        self.time=t
+
+    def __getExcitations(self,t):
+        if self.time is None or t==self.time:
+            return self.excitations
+        return self.excitations*np.exp(-self.rates*(t-self.time))
+
+    def intensity(self,j,t,includeT):
+        if self.time is None:
+            return self.nu[j]
+        terms=self.termComponents==j
+        excitations=self.excitations[terms]
+        if t==self.time:
+            if not includeT:
+                excitations=excitations-self.lastTimeExcitations[terms]
+        else:
+            excitations=excitations*np.exp(-self.rates[terms]*(t-self.time))
+        return self.nu[j]+np.sum(self.termWeights[terms]*excitations)
+
+    def getExcitations(self,t,includeT):
+        excitations=self.__getExcitations(t)
+        if t==self.time and not includeT:
+            excitations=excitations-self.lastTimeExcitations
+        return excitations
+
+    def intensities(self,t,includeT):
+        excitations=self.getExcitations(t,includeT)
+        return self.nu+np.bincount(self.termComponents,weights=self.termWeights*excitations,minlength=len(self.nu))
+
+
+class _WindowedIntensityState:
+    def __init__(self,hawkesProcess):
+        """
+        Keeps only the events inside the longest decay quantile window, memory is bounded by that window.
+        Gives exactly getLambda.
+        """
+        self.nu=np.array(hawkesProcess.immigrationDescendantParameters.nu,dtype=float)
+        self.q=np.array(hawkesProcess.immigrationDescendantParameters.q,dtype=float)
+        self.decayFunctions=hawkesProcess.decayFunctions
+        self.markDistributions=hawkesProcess.markDistributions
+        self.quantiles=[decayFunction.getQ() for decayFunction in self.decayFunctions]
+        self.window=max(self.quantiles)
+
+        self.time=None
+        self.events=collections.deque()
+
+    def push(self,t,k,x):
+        self.events.append((t,k,self.markDistributions[k].getImpactFunction(x)))
+        self.time=t
+        while t-self.events[0][0]>self.window:
+            self.events.popleft()
+
+    def __getWindow(self,t,includeT):
+        if len(self.events)==0:
+            return None
+        times,components,impacts=[np.array(column) for column in zip(*self.events)]
+        timesSinceEvents=t-times
+        counted=timesSinceEvents>=0 if includeT else timesSinceEvents>0
+        return timesSinceEvents[counted],components[counted],impacts[counted]
+
+    def __getExcitation(self,j,window):
+        timesSinceEvents,components,impacts=window
+        inWindow=timesSinceEvents<=self.quantiles[j]
+        decayFunctionValues=self.decayFunctions[j].getWArray(timesSinceEvents[inWindow])
+        return np.sum(self.q[j,components[inWindow]]*decayFunctionValues*impacts[inWindow])
+
+    def intensity(self,j,t,includeT):
+        window=self.__getWindow(t,includeT)
+        if window is None:
+            return self.nu[j]
+        return self.nu[j]+self.__getExcitation(j,window)
+
+    def intensities(self,t,includeT):
+        intensities=self.nu.copy()
+        window=self.__getWindow(t,includeT)
+        if window is None:
+            return intensities
+        for j in range(0,len(intensities)):
+            intensities[j]+=self.__getExcitation(j,window)
+        return intensities
+
+
+class IntensityTracker:
+    def __init__(self,hawkesProcess):
+        """
+        Streaming counterpart of GenuineMultivariateHawkesProcess.getLambda for live event feeds.
+        Events are pushed in time order and intensities are answered from a running state, independent of the
+        length of the history: O(K) per event and O(1) per component query for exponential decay functions
+        (times the number of terms for sums of exponentials, see DecayFunctions.getExponentialTerms),
+        bounded by the getQ quantile window for other decay functions.
+        Model parameters are read when the tracker is created.
+        """
+        self.numComponents=hawkesProcess.numComponents
+        if hawkesProcess.hasRecursiveDecayFunctions():
+            self.__state=_ExponentialIntensityState(hawkesProcess)
+        else:
+            self.__state=_WindowedIntensityState(hawkesProcess)
+        self.numEvents=0
+
+    def getLastTime(self):
+        """Time of the most recent event, None before the first push"""
+        return self.__state.time
+
+    def push(self,time,component,mark):
+        """Add an event, times must be non-decreasing"""
+        lastTime=self.__state.time
+        if lastTime is not None and time<lastTime:
+            raise ValueError("Event at %s pushed after event at %s" % (time,lastTime))
+        self.__state.push(time,component,mark)
+        self.numEvents+=1
+
+    def pushEvents(self,timeComponentMarkTriplets):
+        """Push a list of triplets or an EventStore"""
+        for time,component,mark in timeComponentMarkTriplets:
+            self.push(time,component,mark)
+
+    def intensity(self,componentIdx,t,includeT=False):
+        """Same as getLambda(componentIdx,history,t,includeT), t must not be before the last pushed event"""
+        return self.__state.intensity(componentIdx,t,includeT)
+
+    def intensities(self,t,includeT=False):
+        """Intensities of all components at t as an array"""
+        return self.__state.intensities(t,includeT)
+
+    def getExcitationState(self,t,includeT=True):
+        """
+        The recursive state at t as (termComponents,termWeights,rates,excitations): term i adds
+        termWeights[i]*excitations[i] to the intensity of component termComponents[i] and decays at rates[i].
+        Only for decay functions with exponential terms (hasRecursiveDecayFunctions).
+        """
+        if not isinstance(self.__state,_ExponentialIntensityState):
+            raise ValueError("Excitation state requires decay functions with exponential terms")
+        state=self.__state
+        return state.termComponents,state.termWeights,state.rates,state.getExcitations(t,includeT)
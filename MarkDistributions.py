@@ -1,6 +1,8 @@
 __author__ = 'tjohnson'
 import random
 import math
+import numpy as np
+import scipy.special
 
 class ParetoMarkDistribution:
     def __init__(self,params):
@@ -39,10 +41,18 @@ class ParetoMarkDistribution:
         self.beta=params[3]
         self.gamma=params[4]
 
+    def getParams(self):
+        """Current parameters in the order of setParams"""
+        return [self.mu,self.rho,self.alpha,self.beta,self.gamma]
+
     def getRandomValue(self):
         randomVal=random.random()
         return self.__inverseCumulativeDistribution(randomVal)
 
+    def getRandomValues(self,n,randomState=np.random):
+        """Draw n marks at once, randomState is a numpy.random.RandomState (default: numpy's global state)"""
+        return self.__inverseCumulativeDistribution(randomState.random_sample(n))
+
     def __inverseCumulativeDistribution(self,x):
         """From wolfram alpha"""
         firstMultiplier=(1.0-x)**(1.0/self.rho)-1.0
@@ -68,6 +78,48 @@ class ParetoMarkDistribution:
 
         return term1Numerator/term1Denominator*term2
 
+    def getImpactFunctionGradient(self,x):
+        """Derivatives of the impact function with respect to [mu,rho,alpha,beta,gamma]"""
+        numerator=(self.rho-1.0)*(self.rho-2.0)
+        denominator=self.alpha*(self.rho-1.0)*(self.rho-2.0)+self.beta*self.mu*(self.rho-2.0)+2.0*self.gamma*self.mu*self.mu
+        normalization=numerator/denominator
+        polynomial=self.alpha+self.beta*x+self.gamma*x*x
+        impact=normalization*polynomial
+
+        muDerivative=-impact/denominator*(self.beta*(self.rho-2.0)+4.0*self.gamma*self.mu)
+        rhoDerivative=polynomial*((2.0*self.rho-3.0)*denominator-numerator*(self.alpha*(2.0*self.rho-3.0)+self.beta*self.mu))/(denominator*denominator)
+        alphaDerivative=normalization-impact/denominator*numerator
+        betaDerivative=normalization*x-impact/denominator*self.mu*(self.rho-2.0)
+        gammaDerivative=normalization*x*x-impact/denominator*2.0*self.mu*self.mu
+        return [muDerivative,rhoDerivative,alphaDerivative,betaDerivative,gammaDerivative]
+
+    def getLogDensityGradient(self,x):
+        """Derivatives of log f_u,p(x) with respect to [mu,rho,alpha,beta,gamma]"""
+        muDerivative=self.rho/self.mu-(self.rho+1.0)/(x+self.mu)
+        rhoDerivative=1.0/self.rho+math.log(self.mu)-math.log(x+self.mu)
+        return [muDerivative,rhoDerivative,0.0,0.0,0.0]
+
+    def getDensityFunctionArray(self,x):
+        return self.getDensityFunction(np.asarray(x,dtype=float))
+
+    def getCumulativeDistributionFunctionArray(self,x):
+        return self.getCumulativeDistributionFunction(np.asarray(x,dtype=float))
+
+    def getImpactFunctionArray(self,x):
+        return self.getImpactFunction(np.asarray(x,dtype=float))
+
+    def getImpactFunctionGradientArray(self,x):
+        """getImpactFunctionGradient for an array of marks, returns shape (len(x),5)"""
+        return np.column_stack(self.getImpactFunctionGradient(np.asarray(x,dtype=float)))
+
+    def getLogDensityGradientArray(self,x):
+        """getLogDensityGradient for an array of marks, returns shape (len(x),5)"""
+        x=np.asarray(x,dtype=float)
+        gradient=np.zeros([len(x),5])
+        gradient[:,0]=self.rho/self.mu-(self.rho+1.0)/(x+self.mu)
+        gradient[:,1]=1.0/self.rho+math.log(self.mu)-np.log(x+self.mu)
+        return gradient
+
 
 class VoidMarkDistribution:
     def __init__(self,params):
@@ -88,6 +140,9 @@ class VoidMarkDistribution:
     def setParams(self, params):
         pass
 
+    def getParams(self):
+        return []
+
     def getRandomValue(self):
         return 1.0
 
@@ -100,6 +155,30 @@ class VoidMarkDistribution:
     def getImpactFunction(self,x):
         return 1.0
 
+    def getImpactFunctionGradient(self,x):
+        return []
+
+    def getLogDensityGradient(self,x):
+        return []
+
+    def getRandomValues(self,n,randomState=np.random):
+        return np.ones(n)
+
+    def getDensityFunctionArray(self,x):
+        return np.ones(len(x))
+
+    def getCumulativeDistributionFunctionArray(self,x):
+        return np.ones(len(x))
+
+    def getImpactFunctionArray(self,x):
+        return np.ones(len(x))
+
+    def getImpactFunctionGradientArray(self,x):
+        return np.zeros([len(x),0])
+
+    def getLogDensityGradientArray(self,x):
+        return np.zeros([len(x),0])
+
 
 class _NonNormalizedExponentialImpactFunction3Params:
     def __init__(self,params):
@@ -122,6 +201,9 @@ class _NonNormalizedExponentialImpactFunction3Params:
         self.beta=params[1]
         self.gamma=params[2]
 
+    def getParams(self):
+        return [self.alpha,self.beta,self.gamma]
+
     def getImpactFunction(self,lambd,x):
         term1Numerator=lambd*lambd
         term1Denominator=self.alpha*lambd*lambd+self.beta*lambd+2.0*self.gamma
@@ -129,6 +211,25 @@ class _NonNormalizedExponentialImpactFunction3Params:
 
         return (term1Numerator/term1Denominator)*term2
 
+    def getImpactFunctionGradient(self,lambd,x):
+        """Derivatives with respect to [lambd,alpha,beta,gamma]"""
+        denominator=self.alpha*lambd*lambd+self.beta*lambd+2.0*self.gamma
+        normalization=lambd*lambd/denominator
+        polynomial=self.alpha+self.beta*x+self.gamma*x*x
+        impact=normalization*polynomial
+
+        lambdDerivative=polynomial*(2.0*lambd*denominator-lambd*lambd*(2.0*self.alpha*lambd+self.beta))/(denominator*denominator)
+        alphaDerivative=normalization-impact/denominator*lambd*lambd
+        betaDerivative=normalization*x-impact/denominator*lambd
+        gammaDerivative=normalization*x*x-impact/denominator*2.0
+        return [lambdDerivative,alphaDerivative,betaDerivative,gammaDerivative]
+
+    def getImpactFunctionArray(self,lambd,x):
+        return self.getImpactFunction(lambd,np.asarray(x,dtype=float))
+
+    def getImpactFunctionGradientArray(self,lambd,x):
+        return np.column_stack(self.getImpactFunctionGradient(lambd,np.asarray(x,dtype=float)))
+
 
 class _NonNormalizedExponentialImpactFunction1Params:
     def __init__(self, params):
@@ -149,12 +250,36 @@ class _NonNormalizedExponentialImpactFunction1Params:
     def setParams(self, params):
         self.alpha = params[0]
 
+    def getParams(self):
+        return [self.alpha]
+
     def getImpactFunction(self, lambd, x):
         term1Numerator=lambd**self.alpha
         term1Denominator=math.gamma(self.alpha+1.0)
         term2=x**self.alpha
         return (term1Numerator/term1Denominator)*term2
 
+    def getImpactFunctionGradient(self,lambd,x):
+        """Derivatives with respect to [lambd,alpha]"""
+        impact=self.getImpactFunction(lambd,x)
+        if impact==0.0:
+            return [0.0,0.0]
+        lambdDerivative=impact*self.alpha/lambd
+        alphaDerivative=impact*(math.log(lambd)+math.log(x)-scipy.special.digamma(self.alpha+1.0))
+        return [lambdDerivative,alphaDerivative]
+
+    def getImpactFunctionArray(self,lambd,x):
+        return self.getImpactFunction(lambd,np.asarray(x,dtype=float))
+
+    def getImpactFunctionGradientArray(self,lambd,x):
+        x=np.asarray(x,dtype=float)
+        impact=self.getImpactFunctionArray(lambd,x)
+        logX=np.log(np.where(impact==0.0,1.0,x))
+        gradient=np.zeros([len(x),2])
+        gradient[:,0]=impact*self.alpha/lambd
+        gradient[:,1]=impact*(math.log(lambd)+logX-scipy.special.digamma(self.alpha+1.0))
+        return gradient
+
 
 
 class _GenericExponentialMarkDistribution:
@@ -180,6 +305,9 @@ class _GenericExponentialMarkDistribution:
         self.lambd=params[0]
         self.impactFunctionClass.setParams(params[1:])
 
+    def getParams(self):
+        return [self.lambd]+self.impactFunctionClass.getParams()
+
     def getRandomValue(self):
         return random.expovariate(self.lambd)
 
@@ -192,6 +320,33 @@ class _GenericExponentialMarkDistribution:
     def getImpactFunction(self,x):
         return self.impactFunctionClass.getImpactFunction(self.lambd,x)
 
+    def getImpactFunctionGradient(self,x):
+        return self.impactFunctionClass.getImpactFunctionGradient(self.lambd,x)
+
+    def getLogDensityGradient(self,x):
+        return [1.0/self.lambd-x]+[0.0]*self.impactFunctionClass.getNumParameters()
+
+    def getRandomValues(self,n,randomState=np.random):
+        return randomState.exponential(1.0/self.lambd,n)
+
+    def getDensityFunctionArray(self,x):
+        return self.lambd*np.exp(-self.lambd*np.asarray(x,dtype=float))
+
+    def getCumulativeDistributionFunctionArray(self,x):
+        return 1.0-np.exp(-self.lambd*np.asarray(x,dtype=float))
+
+    def getImpactFunctionArray(self,x):
+        return self.impactFunctionClass.getImpactFunctionArray(self.lambd,x)
+
+    def getImpactFunctionGradientArray(self,x):
+        return self.impactFunctionClass.getImpactFunctionGradientArray(self.lambd,x)
+
+    def getLogDensityGradientArray(self,x):
+        x=np.asarray(x,dtype=float)
+        gradient=np.zeros([len(x),self.getNumParameters()])
+        gradient[:,0]=1.0/self.lambd-x
+        return gradient
+
 class ExponentialMarkDistribution1Param:
     def __init__(self,params):
         self.impactFunction=_NonNormalizedExponentialImpactFunction1Params(params[1:])
@@ -210,6 +365,9 @@ class ExponentialMarkDistribution1Param:
     def setParams(self,params):
         self.delegateMarkDistribution.setParams(params)
 
+    def getParams(self):
+        return self.delegateMarkDistribution.getParams()
+
     def getRandomValue(self):
         return self.delegateMarkDistribution.getRandomValue()
 
@@ -222,4 +380,28 @@ class ExponentialMarkDistribution1Param:
     def getImpactFunction(self,x):
         return self.delegateMarkDistribution.getImpactFunction(x)
 
+    def getImpactFunctionGradient(self,x):
+        return self.delegateMarkDistribution.getImpactFunctionGradient(x)
+
+    def getLogDensityGradient(self,x):
+        return self.delegateMarkDistribution.getLogDensityGradient(x)
+
+    def getRandomValues(self,n,randomState=np.random):
+        return self.delegateMarkDistribution.getRandomValues(n,randomState)
+
+    def getDensityFunctionArray(self,x):
+        return self.delegateMarkDistribution.getDensityFunctionArray(x)
+
+    def getCumulativeDistributionFunctionArray(self,x):
+        return self.delegateMarkDistribution.getCumulativeDistributionFunctionArray(x)
+
+    def getImpactFunctionArray(self,x):
+        return self.delegateMarkDistribution.getImpactFunctionArray(x)
+
+    def getImpactFunctionGradientArray(self,x):
+        return self.delegateMarkDistribution.getImpactFunctionGradientArray(x)
+
+    def getLogDensityGradientArray(self,x):
+        return self.delegateMarkDistribution.getLogDensityGradientArray(x)
+
 
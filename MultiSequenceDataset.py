@@ -0,0 +1,102 @@
+__author__ = 'tjohnson'
+import json
+import os
+import numpy as np
+import CompiledDataset
+import EventStore
+
+INDEX_FILE_NAME='sequences.json'
+
+
+class MultiSequenceDataset:
+    def __init__(self,sequences,numComponents=None,observationWindows=None,maxCacheBytes=CompiledDataset.DEFAULT_MAX_CACHE_BYTES):
+        """
+        Independent realizations of one process, such as one sequence per trading day or per instrument.
+        The log-likelihood of the dataset is the sum of the per-sequence log-likelihoods, each with its own
+        observation window, which concatenating the sequences would get wrong (the compensator would span the gaps
+        and events of one sequence would excite the next). GenuineMultivariateHawkesProcess.getLogLikelihood,
+        getLogLikelihoodAndGradient and getCompensator accept a MultiSequenceDataset and sum over the sequences.
+
+        Every sequence is kept as a CompiledDataset with maxCacheBytes of cache.
+
+        :param sequences: EventStores or lists of (time,component,mark) triplets
+        :param observationWindows: (startTime,endTime) per sequence, None (or a None entry) keeps the window of the
+            EventStore, by default its first and last event times. An empty sequence contributes nu*(endTime-startTime)
+            to the compensator, nothing without a window; one with only one bound raises ValueError.
+        """
+        if observationWindows is None:
+            observationWindows=[None]*len(sequences)
+        if len(observationWindows)!=len(sequences):
+            raise ValueError("%s observation windows for %s sequences" % (len(observationWindows),len(sequences)))
+
+        eventStores=[EventStore.asEventStore(sequence,numComponents) for sequence in sequences]
+        if numComponents is None:
+            numComponents=max([eventStore.numComponents for eventStore in eventStores]+[0])
+        self.numComponents=numComponents
+
+        self.sequences=[]
+        for eventStore,observationWindow in zip(eventStores,observationWindows):
+            if observationWindow is not None:
+                startTime,endTime=observationWindow
+                eventStore=EventStore.EventStore(eventStore.times,eventStore.components,eventStore.marks,eventStore.numComponents,
+                                                 eventStore.componentOrder,eventStore.componentOffsets,startTime,endTime)
+            #Raises for an empty sequence with only one bound
+            eventStore.getObservationLength()
+            self.sequences.append(CompiledDataset.CompiledDataset(eventStore,numComponents,maxCacheBytes))
+
+    def __len__(self):
+        return len(self.sequences)
+
+    def __getitem__(self,idx):
+        return self.sequences[idx]
+
+    def __iter__(self):
+        return iter(self.sequences)
+
+    def getNumEvents(self):
+        return sum(len(sequence) for sequence in self.sequences)
+
+    def getObservationWindows(self):
+        return [sequence.getObservationWindow() for sequence in self.sequences]
+
+    def getSequenceChunks(self,numChunks):
+        """
+        Split the sequence indices into at most numChunks groups of similar total event count,
+        largest sequences first onto the currently lightest group
+        """
+        numChunks=max(min(numChunks,len(self.sequences)),1)
+        chunks=[[] for chunkIdx in range(0,numChunks)]
+        chunkEvents=np.zeros(numChunks)
+        for sequenceIdx in sorted(range(0,len(self.sequences)),key=lambda idx: -len(self.sequences[idx])):
+            chunkIdx=int(np.argmin(chunkEvents))
+            chunks[chunkIdx].append(sequenceIdx)
+            chunkEvents[chunkIdx]+=len(self.sequences[sequenceIdx])
+        return [sorted(chunk) for chunk in chunks if len(chunk)>0]
+
+    def save(self,directory):
+        """
+        Write every sequence as an EventStore file into directory, with an index holding the observation windows.
+        The directory is created if needed.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        index={'numComponents':self.numComponents,'sequences':[]}
+        for sequenceIdx,sequence in enumerate(self.sequences):
+            fileName='sequence%06d.events' % sequenceIdx
+            sequence.save(os.path.join(directory,fileName))
+            startTime,endTime=sequence.getObservationWindow()
+            index['sequences'].append({'file':fileName,'startTime':startTime,'endTime':endTime})
+        with open(os.path.join(directory,INDEX_FILE_NAME),'w') as f:
+            json.dump(index,f)
+
+    @staticmethod
+    def load(directory,mmap=True,maxCacheBytes=CompiledDataset.DEFAULT_MAX_CACHE_BYTES):
+        """Open a directory written by save(), see EventStore.load for mmap"""
+        with open(os.path.join(directory,INDEX_FILE_NAME)) as f:
+            index=json.load(f)
+        sequences=[]
+        observationWindows=[]
+        for entry in index['sequences']:
+            sequences.append(EventStore.EventStore.load(os.path.join(directory,entry['file']),mmap))
+            observationWindows.append((entry['startTime'],entry['endTime']))
+        return MultiSequenceDataset(sequences,index['numComponents'],observationWindows,maxCacheBytes)
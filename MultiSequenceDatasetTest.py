@@ -0,0 +1,47 @@
+__author__ = 'tjohnson'
+
+import unittest
+import numpy as np
+import ClusterSimulator
+import EventStore
+import MultiSequenceDataset
+import StreamingLikelihoodTest
+
+
+class MultiSequenceDatasetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hawkesProcess=StreamingLikelihoodTest.buildProcess()
+        cls.sequences=[ClusterSimulator.ClusterSimulator(cls.hawkesProcess).simulate(2000.0,seed,numWorkers=1) for seed in [5,6]]
+        cls.windows=[(0.0,2000.0),(0.0,2000.0)]
+        cls.empty=EventStore.EventStore(np.zeros(0),np.zeros(0),np.zeros(0),2)
+
+    def testSumsSequences(self):
+        dataset=MultiSequenceDataset.MultiSequenceDataset(self.sequences,2,self.windows)
+        expected=sum(self.hawkesProcess.getLogLikelihood(sequence) for sequence in dataset)
+        self.assertAlmostEqual(self.hawkesProcess.getLogLikelihood(dataset),expected,places=8)
+
+    def testEmptySequenceWithoutWindow(self):
+        dataset=MultiSequenceDataset.MultiSequenceDataset(self.sequences,2,self.windows)
+        withEmpty=MultiSequenceDataset.MultiSequenceDataset(self.sequences+[self.empty],2,self.windows+[None])
+        self.assertAlmostEqual(self.hawkesProcess.getLogLikelihood(withEmpty),self.hawkesProcess.getLogLikelihood(dataset),places=8)
+        self.assertAlmostEqual(self.hawkesProcess.getLogLikelihood(withEmpty,truncated=True),
+                               self.hawkesProcess.getLogLikelihood(dataset,truncated=True),places=8)
+        logLikelihood,gradients=self.hawkesProcess.getLogLikelihoodAndGradient(withEmpty)
+        expectedLogLikelihood,expectedGradients=self.hawkesProcess.getLogLikelihoodAndGradient(dataset)
+        self.assertAlmostEqual(logLikelihood,expectedLogLikelihood,places=8)
+        np.testing.assert_allclose(gradients[0],expectedGradients[0])
+
+    def testEmptySequenceWithWindow(self):
+        dataset=MultiSequenceDataset.MultiSequenceDataset(self.sequences,2,self.windows)
+        withEmpty=MultiSequenceDataset.MultiSequenceDataset(self.sequences+[self.empty],2,self.windows+[(10.0,110.0)])
+        nu=self.hawkesProcess.immigrationDescendantParameters.nu
+        self.assertAlmostEqual(self.hawkesProcess.getLogLikelihood(withEmpty),
+                               self.hawkesProcess.getLogLikelihood(dataset)-100.0*np.sum(nu),places=8)
+
+    def testEmptySequenceWithOneBoundRaises(self):
+        self.assertRaises(ValueError,MultiSequenceDataset.MultiSequenceDataset,self.sequences+[self.empty],2,self.windows+[(0.0,None)])
+
+
+if __name__=='__main__':
+    unittest.main()
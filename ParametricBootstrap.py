@@ -0,0 +1,183 @@
+__author__ = 'tjohnson'
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import ClusterSimulator
+import ThinningSimulator
+
+#Bumped when the per-path results change meaning, so stale checkpoints are not resumed
+CHECKPOINT_VERSION=2
+DEFAULT_QUANTILES=(0.025,0.5,0.975)
+
+#Per-process state of pool workers, set once by _initializeBootstrapWorker
+_bootstrapWorker={}
+
+
+def _initializeBootstrapWorker(fitter,settings):
+    _bootstrapWorker['fitter']=fitter
+    _bootstrapWorker.update(settings)
+
+
+def _runBootstrapPath(args):
+    """Simulate one path from the fitted parameters with its own seed and refit it"""
+    pathIdx,seed=args
+    fitter=_bootstrapWorker['fitter']
+    fittedParams=_bootstrapWorker['fittedParams']
+    endTime=_bootstrapWorker['endTime']
+    startTime=time.time()
+
+    fitter.setParameterValues(fittedParams)
+    hawkesProcess=fitter.hawkesProcess
+    if _bootstrapWorker['simulator']=='cluster':
+        events=ClusterSimulator.ClusterSimulator(hawkesProcess).simulate(endTime,seed,numWorkers=1)
+    else:
+        events=ThinningSimulator.ThinningSimulator(hawkesProcess).simulate(randomState=seed,endTime=endTime)
+    #The path carries the simulated interval [0,endTime] as its observation window, the refit integrates over it
+
+    result={'path':pathIdx,'seed':int(seed),'numEvents':len(events),'params':None,'negativeLogLikelihood':None,'message':''}
+    if len(events)<2:
+        result['message']='Too few events to refit'
+    else:
+        try:
+            params,value,info=fitter.maximizeLikelihood(events,_bootstrapWorker['initialGuess'])
+            result['params']=[float(param) for param in params]
+            result['negativeLogLikelihood']=float(value)
+            result['message']=str(info['task'])
+        except (ValueError,FloatingPointError,ZeroDivisionError) as e:
+            result['message']='Refit failed: %s' % e
+    result['wallTime']=time.time()-startTime
+    return result
+
+
+def aggregate(pathResults,numParams,quantiles=DEFAULT_QUANTILES):
+    """
+    Summary of the refitted parameters over the successful paths
+    :return: dict with params (paths x parameters, in path order), mean, std, quantiles (len(quantiles) x parameters),
+        quantileLevels, numPaths and failedPaths
+    """
+    pathResults=sorted(pathResults,key=lambda pathResult: pathResult['path'])
+    succeeded=[pathResult for pathResult in pathResults if pathResult['params'] is not None]
+    params=np.array([pathResult['params'] for pathResult in succeeded],dtype=float).reshape(len(succeeded),numParams)
+
+    summary={'params':params,'quantileLevels':np.array(quantiles,dtype=float),'numPaths':len(succeeded),
+             'failedPaths':[pathResult['path'] for pathResult in pathResults if pathResult['params'] is None]}
+    if len(succeeded)>0:
+        summary['mean']=np.mean(params,axis=0)
+        summary['std']=np.std(params,axis=0,ddof=1) if len(succeeded)>1 else np.zeros(numParams)
+        summary['quantiles']=np.array([np.percentile(params,100.0*level,axis=0) for level in quantiles])
+    else:
+        summary['mean']=summary['std']=np.zeros(numParams)+np.nan
+        summary['quantiles']=np.zeros([len(quantiles),numParams])+np.nan
+    return summary
+
+
+class ParametricBootstrap:
+    def __init__(self,fitter,numWorkers=None,checkpointPath=None,checkpointEvery=1,simulator='cluster'):
+        """
+        Parametric bootstrap of a GenuineMultivariateHawkesProcessFitter fit: paths are simulated from the fitted
+        parameters and refitted in a process pool, and the refitted parameters give their sampling distribution.
+
+        Path i is simulated with its own numpy RandomState seeded from the run seed, so results do not depend on
+        numWorkers or on the order in which paths finish. Marks are drawn in batches by the simulators.
+        With checkpointPath the finished paths are written there (atomically, by replacing the file) every
+        checkpointEvery paths, and a run with the same settings resumes from it.
+
+        :param numWorkers: Size of the process pool, None for one per CPU, 1 to run in this process
+        :param simulator: 'cluster' (ClusterSimulator, requires a subcritical branching matrix) or 'thinning'
+        """
+        if simulator not in ('cluster','thinning'):
+            raise ValueError("Unknown simulator %s" % simulator)
+        self.fitter=fitter
+        self.numWorkers=numWorkers
+        self.checkpointPath=checkpointPath
+        self.checkpointEvery=checkpointEvery
+        self.simulator=simulator
+
+    def __getRunSettings(self,fittedParams,numPaths,endTime,seed,initialGuess):
+        return {'version':CHECKPOINT_VERSION,'fittedParams':[float(param) for param in fittedParams],
+                'initialGuess':[float(param) for param in initialGuess],'numPaths':numPaths,'endTime':float(endTime),
+                'seed':seed,'simulator':self.simulator}
+
+    def __readCheckpoint(self):
+        if self.checkpointPath is None or not os.path.exists(self.checkpointPath):
+            return None
+        with open(self.checkpointPath) as f:
+            return json.load(f)
+
+    def loadCheckpoint(self,runSettings):
+        """Finished path results of an earlier run with the same settings, [] without a checkpoint"""
+        checkpoint=self.__readCheckpoint()
+        if checkpoint is None:
+            return []
+        checkpointSettings=dict(checkpoint['settings'])
+        if checkpointSettings!=runSettings:
+            raise ValueError("Checkpoint %s was written by a run with different settings" % self.checkpointPath)
+        return checkpoint['paths']
+
+    def saveCheckpoint(self,runSettings,pathResults):
+        """Write to a temporary file next to the checkpoint and rename it over the checkpoint"""
+        temporaryPath='%s.%d.tmp' % (self.checkpointPath,os.getpid())
+        with open(temporaryPath,'w') as f:
+            json.dump({'settings':runSettings,'paths':pathResults},f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporaryPath,self.checkpointPath)
+
+    def run(self,fittedParams,numPaths,endTime,seed=None,initialGuess=None,quantiles=DEFAULT_QUANTILES):
+        """
+        :param fittedParams: Parameter vector the paths are simulated from
+        :param endTime: Every path is simulated on [0,endTime)
+        :param seed: Integer seed of the run, the path seeds are drawn from it. None resumes with the seed stored in
+            the checkpoint, or draws a new one without a checkpoint
+        :param initialGuess: Starting point of the refits, fittedParams by default
+        :return: aggregate() of the refitted parameters, with key seed holding the seed of the run and key paths
+            holding the per-path dicts (path, seed, numEvents, params, negativeLogLikelihood, message, wallTime)
+        """
+        if initialGuess is None:
+            initialGuess=fittedParams
+        if seed is None:
+            checkpoint=self.__readCheckpoint()
+            seed=checkpoint['settings']['seed'] if checkpoint is not None else np.random.randint(0,2**31-1)
+        seed=int(seed)
+        runSettings=self.__getRunSettings(fittedParams,numPaths,endTime,seed,initialGuess)
+        pathSeeds=np.random.RandomState(seed).randint(0,2**31-1,size=numPaths)
+
+        pathResults=self.loadCheckpoint(runSettings)
+        finishedPaths=set(pathResult['path'] for pathResult in pathResults)
+        tasks=[(pathIdx,pathSeeds[pathIdx]) for pathIdx in range(0,numPaths) if pathIdx not in finishedPaths]
+
+        settings={'fittedParams':np.array(fittedParams,dtype=float),'initialGuess':np.array(initialGuess,dtype=float),
+                  'endTime':endTime,'simulator':self.simulator}
+        if self.numWorkers==1:
+            _initializeBootstrapWorker(self.fitter,settings)
+            pool=None
+            results=(_runBootstrapPath(task) for task in tasks)
+        else:
+            pool=multiprocessing.Pool(self.numWorkers,initializer=_initializeBootstrapWorker,initargs=(self.fitter,settings))
+            results=pool.imap_unordered(_runBootstrapPath,tasks)
+
+        try:
+            sinceCheckpoint=0
+            for pathResult in results:
+                pathResults.append(pathResult)
+                sinceCheckpoint+=1
+                if self.checkpointPath is not None and sinceCheckpoint>=self.checkpointEvery:
+                    self.saveCheckpoint(runSettings,pathResults)
+                    sinceCheckpoint=0
+            if self.checkpointPath is not None and sinceCheckpoint>0:
+                self.saveCheckpoint(runSettings,pathResults)
+        finally:
+            if pool is None:
+                _bootstrapWorker.clear()
+            else:
+                pool.terminate()
+                pool.join()
+
+        #The fitter of this process is only used directly with numWorkers=1, leave it at the fitted parameters
+        self.fitter.setParameterValues(fittedParams)
+        summary=aggregate(pathResults,len(fittedParams),quantiles)
+        summary['seed']=seed
+        summary['paths']=sorted(pathResults,key=lambda pathResult: pathResult['path'])
+        return summary
@@ -0,0 +1,39 @@
+__author__ = 'tjohnson'
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import FitResultCacheTest
+import ParametricBootstrap
+
+
+class ParametricBootstrapTest(unittest.TestCase):
+    def setUp(self):
+        self.fitter=FitResultCacheTest.buildFitter()
+        self.params=np.array([0.2,0.1,0.3,0.2,0.1,0.4,1.0,0.5])
+        self.directory=tempfile.mkdtemp()
+        self.checkpointPath=os.path.join(self.directory,'bootstrap.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testResumesWithStoredSeed(self):
+        bootstrap=ParametricBootstrap.ParametricBootstrap(self.fitter,numWorkers=1,checkpointPath=self.checkpointPath)
+        summary=bootstrap.run(self.params,3,500.0)
+        self.assertEqual(summary['numPaths'],3)
+        resumed=bootstrap.run(self.params,3,500.0)
+        self.assertEqual(resumed['seed'],summary['seed'])
+        #Every path comes from the checkpoint, including its wall time
+        self.assertEqual(resumed['paths'],summary['paths'])
+
+    def testNumpyIntegerSeed(self):
+        bootstrap=ParametricBootstrap.ParametricBootstrap(self.fitter,numWorkers=1,checkpointPath=self.checkpointPath)
+        summary=bootstrap.run(self.params,2,500.0,seed=np.int32(17))
+        expected=ParametricBootstrap.ParametricBootstrap(self.fitter,numWorkers=1).run(self.params,2,500.0,seed=17)
+        np.testing.assert_array_equal(summary['params'],expected['params'])
+
+
+if __name__=='__main__':
+    unittest.main()
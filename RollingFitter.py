@@ -0,0 +1,253 @@
+__author__ = 'tjohnson'
+import time
+import numpy as np
+import scipy.optimize
+import CompiledDataset
+import EventStore
+import IntensityTracker
+
+#Initial capacity of the event buffer, doubled as needed
+INITIAL_CAPACITY=1024
+#(s,y) pairs of the previous refit used for the diagonal preconditioner
+CURVATURE_HISTORY=10
+#Preconditioner scales are clipped to this ratio around 1
+MAX_SCALE_RATIO=1e4
+
+REFIT_TRACE_DTYPE=[('refit','i8'),('endTime','f8'),('windowEvents','i8'),('appendedEvents','i8'),('expiredEvents','i8'),
+                   ('iterations','i8'),('evaluations','i8'),('prepareTime','f8'),('optimizeTime','f8'),('totalTime','f8'),
+                   ('negativeLogLikelihood','f8')]
+
+
+class _GrowableColumn:
+    def __init__(self,dtype):
+        """Array with amortized O(1) appends at the end and O(1) removal from the front"""
+        self.values=np.zeros(INITIAL_CAPACITY,dtype=dtype)
+        self.start=0
+        self.end=0
+
+    def __len__(self):
+        return self.end-self.start
+
+    def append(self,values):
+        values=np.asarray(values,dtype=self.values.dtype)
+        if self.end+len(values)>len(self.values):
+            #Move the live values to the front, growing the buffer if they still do not fit
+            numLive=self.end-self.start
+            capacity=len(self.values)
+            while numLive+len(values)>capacity:
+                capacity*=2
+            live=self.values[self.start:self.end]
+            self.values=np.concatenate([live,np.zeros(capacity-numLive,dtype=self.values.dtype)])
+            self.start=0
+            self.end=numLive
+        self.values[self.end:self.end+len(values)]=values
+        self.end+=len(values)
+
+    def dropFront(self,count):
+        self.start+=count
+
+    def view(self):
+        return self.values[self.start:self.end]
+
+
+class RollingFitter:
+    def __init__(self,fitter,windowLength,initialGuess,precondition=True):
+        """
+        Refits a GenuineMultivariateHawkesProcessFitter model on a sliding window [endTime-windowLength,endTime]
+        of an event feed, for refits every few minutes on recent events.
+
+        Appending and expiring events is incremental: times, components, marks and the per-component indices are
+        kept in growable arrays, so a refit builds its CompiledDataset from views of the columns without sorting,
+        concatenating only the per-component indices. The IntensityTracker is fed as events arrive and, after a
+        refit changed the parameters, rebuilt from the events inside the longest decay quantile only.
+
+        Every refit starts L-BFGS-B from the previous optimum. scipy does not accept an initial L-BFGS memory, so
+        with precondition the (s,y) pairs of the previous refit give a diagonal curvature estimate
+        sum(s_i^2)/sum(s_i*y_i) per parameter and the next refit optimizes in parameters rescaled by its square root.
+        Needs the analytic gradient (exponential decay functions), without it only the warm start applies.
+
+        Known limitation: the CompiledDataset and its cache are reused only while no event is appended or expired,
+        as its cached terms (impacts, window bounds) belong to the events of its window. A refit after new events
+        builds a new one, so setup and likelihood evaluations cost O(window), not O(events that changed).
+        Latencies of every refit are kept, see getRefitTrace.
+        """
+        self.fitter=fitter
+        self.hawkesProcess=fitter.hawkesProcess
+        self.windowLength=windowLength
+        self.params=np.array(initialGuess,dtype=float)
+        self.precondition=precondition and self.hawkesProcess.hasExponentialDecayFunctions()
+        self.scales=np.ones(fitter.numParams)
+        self.negativeLogLikelihood=None
+
+        numComponents=self.hawkesProcess.numComponents
+        self.times=_GrowableColumn(np.float64)
+        self.components=_GrowableColumn(np.int32)
+        self.marks=_GrowableColumn(np.float64)
+        #Absolute positions (counted from the first event ever appended) of every component's events
+        self.componentPositions=[_GrowableColumn(np.int64) for k in range(0,numComponents)]
+        self.numDropped=0
+
+        self.fitter.setParameterValues(self.params)
+        self.intensityTracker=IntensityTracker.IntensityTracker(self.hawkesProcess)
+        self.numAppended=0
+        self.numExpired=0
+        self.refits=[]
+        #CompiledDataset of the last refit with its (startTime,endTime), dropped when the buffers change
+        self.dataset=None
+        self.datasetWindow=None
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self,events):
+        """Add events (EventStore or triplets) at or after the last appended event"""
+        numComponents=self.hawkesProcess.numComponents
+        eventStore=EventStore.asEventStore(events,numComponents)
+        if len(eventStore)==0:
+            return
+        if len(self.times)>0 and eventStore.times[0]<self.times.view()[-1]:
+            raise ValueError("Events starting at %s appended after event at %s" % (eventStore.times[0],self.times.view()[-1]))
+
+        firstPosition=self.numDropped+len(self.times)
+        self.times.append(eventStore.times)
+        self.components.append(eventStore.components)
+        self.marks.append(eventStore.marks)
+        for k in range(0,numComponents):
+            self.componentPositions[k].append(firstPosition+eventStore.getComponentIndices(k))
+
+        self.intensityTracker.pushEvents(eventStore)
+        self.numAppended+=len(eventStore)
+        self.dataset=None
+
+    def expire(self,startTime):
+        """Drop the events before startTime"""
+        count=int(np.searchsorted(self.times.view(),startTime,side='left'))
+        if count==0:
+            return
+        self.times.dropFront(count)
+        self.components.dropFront(count)
+        self.marks.dropFront(count)
+        self.numDropped+=count
+        for positions in self.componentPositions:
+            positions.dropFront(int(np.searchsorted(positions.view(),self.numDropped,side='left')))
+        self.numExpired+=count
+        self.dataset=None
+
+    def getDataset(self,startTime=None,endTime=None):
+        """CompiledDataset of the current window, from views of the buffers"""
+        componentOrder=np.concatenate([positions.view() for positions in self.componentPositions])-self.numDropped
+        counts=[len(positions) for positions in self.componentPositions]
+        componentOffsets=np.concatenate([[0],np.cumsum(counts)]).astype(np.int64)
+        eventStore=EventStore.EventStore(self.times.view(),self.components.view(),self.marks.view(),self.hawkesProcess.numComponents,
+                                         componentOrder,componentOffsets,startTime,endTime)
+        return CompiledDataset.CompiledDataset(eventStore,self.hawkesProcess.numComponents)
+
+    def __rebuildIntensityTracker(self):
+        times=self.times.view()
+        window=max(decayFunction.getQ() for decayFunction in self.hawkesProcess.decayFunctions)
+        first=np.searchsorted(times,times[-1]-window,side='left') if len(times)>0 else 0
+        self.intensityTracker=IntensityTracker.IntensityTracker(self.hawkesProcess)
+        self.intensityTracker.pushEvents(EventStore.EventStore(times[first:],self.components.view()[first:],self.marks.view()[first:],
+                                                              self.hawkesProcess.numComponents))
+
+    def intensities(self,t,includeT=False):
+        """Intensities of all components at t under the latest parameters"""
+        return self.intensityTracker.intensities(t,includeT)
+
+    def __updateScales(self,iterates,gradients):
+        """Diagonal inverse-Hessian estimate from the (s,y) pairs of the accepted iterates, in original coordinates"""
+        steps=np.diff(iterates,axis=0)[-CURVATURE_HISTORY:]
+        gradientChanges=np.diff(gradients,axis=0)[-CURVATURE_HISTORY:]
+        if len(steps)==0:
+            return
+        curvatures=np.sum(steps*gradientChanges,axis=0)
+        squaredSteps=np.sum(steps*steps,axis=0)
+        valid=(curvatures>0)&(squaredSteps>0)
+        if not np.any(valid):
+            return
+        inverseHessian=np.ones(len(self.scales))
+        inverseHessian[valid]=squaredSteps[valid]/curvatures[valid]
+        #Unobserved directions keep the geometric mean of the observed ones
+        inverseHessian[~valid]=np.exp(np.mean(np.log(inverseHessian[valid])))
+        scales=np.sqrt(inverseHessian)
+        scales/=np.exp(np.mean(np.log(scales)))
+        self.scales=np.clip(scales,1.0/MAX_SCALE_RATIO,MAX_SCALE_RATIO)
+
+    def refit(self,endTime=None):
+        """
+        Expire the events before endTime-windowLength and refit on [endTime-windowLength,endTime]
+        :param endTime: End of the window, the last appended event time by default
+        :return: (params,negativeLogLikelihood,infoDict) with infoDict the REFIT_TRACE_DTYPE fields of this refit
+        """
+        startClock=time.time()
+        if endTime is None:
+            if len(self.times)==0:
+                raise ValueError("No events to fit")
+            endTime=float(self.times.view()[-1])
+        startTime=endTime-self.windowLength
+        self.expire(startTime)
+        if len(self.times)>0 and self.times.view()[-1]>endTime:
+            raise ValueError("Events after the window end %s" % endTime)
+        if self.dataset is None or self.datasetWindow!=(startTime,endTime):
+            self.dataset=self.getDataset(startTime,endTime)
+            self.datasetWindow=(startTime,endTime)
+        dataset=self.dataset
+        prepareTime=time.time()-startClock
+
+        useGradient=self.hawkesProcess.hasExponentialDecayFunctions()
+        scales=self.scales if self.precondition else np.ones(len(self.params))
+        iterates=[]
+        gradients=[]
+        lastEvaluation={}
+        counters={'evaluations':0,'iterations':0}
+
+        def objective(scaledParams):
+            counters['evaluations']+=1
+            params=scaledParams*scales
+            if useGradient:
+                value,gradient=self.fitter.getNegativeLogLikelihoodAndGradient(params,dataset)
+                lastEvaluation['params']=params
+                lastEvaluation['gradient']=gradient
+                return value,gradient*scales
+            return self.fitter.getNegativeLogLikelihood(params,dataset)
+
+        def callback(scaledParams):
+            counters['iterations']+=1
+            if 'gradient' in lastEvaluation:
+                iterates.append(lastEvaluation['params'])
+                gradients.append(lastEvaluation['gradient'])
+
+        bounds=[(None if lowerBound is None else lowerBound/scale,None if upperBound is None else upperBound/scale)
+                for (lowerBound,upperBound),scale in zip(self.fitter.parameterBounds,scales)]
+        optimizeClock=time.time()
+        scaledParams,value,info=scipy.optimize.fmin_l_bfgs_b(objective,x0=self.params/scales,approx_grad=not useGradient,
+                                                              bounds=bounds,callback=callback)
+        optimizeTime=time.time()-optimizeClock
+
+        self.params=scaledParams*scales
+        self.negativeLogLikelihood=float(value)
+        if self.precondition:
+            self.__updateScales(np.array(iterates),np.array(gradients))
+        self.fitter.setParameterValues(self.params)
+        self.__rebuildIntensityTracker()
+
+        record=(len(self.refits)+1,endTime,len(dataset),self.numAppended,self.numExpired,counters['iterations'],
+                counters['evaluations'],prepareTime,optimizeTime,time.time()-startClock,self.negativeLogLikelihood)
+        self.refits.append(record)
+        self.numAppended=0
+        self.numExpired=0
+        return self.params.copy(),self.negativeLogLikelihood,dict(zip([name for name,dtype in REFIT_TRACE_DTYPE],record))
+
+    def getRefitTrace(self):
+        """Structured array with the fields of REFIT_TRACE_DTYPE, one row per refit"""
+        return np.array(self.refits,dtype=REFIT_TRACE_DTYPE)
+
+    def getLatencySummary(self,percentiles=(50,95,99)):
+        """Percentiles and maximum of the total refit time in seconds, as a dict"""
+        totalTimes=self.getRefitTrace()['totalTime']
+        if len(totalTimes)==0:
+            return {}
+        summary=dict(('p%g' % percentile,float(np.percentile(totalTimes,percentile))) for percentile in percentiles)
+        summary['max']=float(np.max(totalTimes))
+        summary['mean']=float(np.mean(totalTimes))
+        return summary
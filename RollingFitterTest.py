@@ -0,0 +1,55 @@
+__author__ = 'tjohnson'
+
+import unittest
+import numpy as np
+import ClusterSimulator
+import EventStore
+import FitResultCacheTest
+import RollingFitter
+
+
+class RollingFitterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.params=np.array([0.2,0.1,0.3,0.2,0.1,0.4,1.0,0.5])
+        fitter=FitResultCacheTest.buildFitter()
+        cls.events=ClusterSimulator.ClusterSimulator(fitter.hawkesProcess).simulate(3000.0,23,numWorkers=1)
+
+    def setUp(self):
+        self.fitter=FitResultCacheTest.buildFitter()
+        self.rollingFitter=RollingFitter.RollingFitter(self.fitter,1000.0,self.params)
+
+    def testSameWindowReusesDataset(self):
+        self.rollingFitter.append(self.events[0:len(self.events)//2])
+        self.rollingFitter.refit(1500.0)
+        dataset=self.rollingFitter.dataset
+        misses=dataset.getCacheInfo()['misses']
+        self.rollingFitter.refit(1500.0)
+        self.assertIs(self.rollingFitter.dataset,dataset)
+        #Only the terms of parameters the second refit moves are recomputed
+        self.assertLess(dataset.getCacheInfo()['misses']-misses,misses)
+        self.rollingFitter.append(self.events[len(self.events)//2:])
+        self.rollingFitter.refit(3000.0)
+        self.assertIsNot(self.rollingFitter.dataset,dataset)
+
+    def testRefitsMatchDirectFits(self):
+        numAppended=0
+        for refitIdx,endTime in enumerate([1200.0,1800.0,2400.0,3000.0]):
+            numEvents=int(np.searchsorted(self.events.times,endTime,side='right'))
+            self.rollingFitter.append(self.events[numAppended:numEvents])
+            numAppended=numEvents
+            params,value,info=self.rollingFitter.refit(endTime)
+
+            first=int(np.searchsorted(self.events.times,endTime-1000.0,side='left'))
+            window=EventStore.EventStore(self.events.times[first:numEvents],self.events.components[first:numEvents],
+                                         self.events.marks[first:numEvents],2,startTime=endTime-1000.0,endTime=endTime)
+            self.assertEqual(len(self.rollingFitter),len(window))
+            self.assertEqual(info['windowEvents'],len(window))
+            directParams,directValue,directInfo=FitResultCacheTest.buildFitter().maximizeLikelihood(window,self.params)
+            self.assertAlmostEqual(value/directValue,1.0,places=6)
+            np.testing.assert_allclose(params,directParams,rtol=1e-2,atol=1e-3)
+        self.assertEqual(len(self.rollingFitter.getRefitTrace()),4)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+__author__ = 'tjohnson'
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+#Below this size the spectral radius is computed from the dense eigenvalues
+DENSE_EIGENVALUE_MAX_COMPONENTS=16
+
+
+class SparseImmigrationDescendantParameters:
+    def __init__(self,numComponents,pattern,params):
+        """
+        Immigration intensities and a branching matrix q whose nonzero entries are restricted to a fixed pattern,
+        for processes with many components and few cross-excitations. Only nu and the pattern entries (edges) are
+        parameters, and the likelihood of target j only visits the events of its source components, so its cost
+        scales with the number of edges instead of K^2.
+        q is also kept as a dense KxK array, read by the simulators and the intensity tracker.
+
+        :param pattern: KxK boolean array or scipy.sparse matrix of allowed entries, or a list of (target,source) pairs
+        :param params: nu (K) followed by the edge values, ordered by target then source
+        """
+        self.numComponents=numComponents
+
+        if isinstance(pattern,list):
+            edges=sorted(set((int(target),int(source)) for target,source in pattern))
+            targets=np.array([edge[0] for edge in edges],dtype=np.int64)
+            sources=np.array([edge[1] for edge in edges],dtype=np.int64)
+        else:
+            allowed=scipy.sparse.coo_matrix(pattern)
+            allowed.sum_duplicates()
+            nonzero=allowed.data!=0
+            order=np.lexsort((allowed.col[nonzero],allowed.row[nonzero]))
+            targets=allowed.row[nonzero][order].astype(np.int64)
+            sources=allowed.col[nonzero][order].astype(np.int64)
+        if len(targets)>0 and (min(targets.min(),sources.min())<0 or max(targets.max(),sources.max())>=numComponents):
+            raise ValueError("Sparsity pattern does not fit %s components" % numComponents)
+
+        self.edgeTargets=targets
+        self.edgeSources=sources
+        self.targetOffsets=np.concatenate([[0],np.cumsum(np.bincount(targets,minlength=numComponents))]).astype(np.int64)
+
+        self.nu=np.zeros(numComponents) #Immigration intensities
+        self.edgeValues=np.zeros(len(targets)) #q[edgeTargets[i],edgeSources[i]]
+        self.q=np.zeros([numComponents,numComponents]) #Dense branching matrix, zero outside the pattern
+
+        self.setParameters(params)
+
+    def getNumEdges(self):
+        return len(self.edgeValues)
+
+    def getNumParameters(self,numComponents=None):
+        """nu plus one parameter per edge, numComponents is accepted for the interface of ImmigrationDescendantParameters"""
+        return self.numComponents+self.getNumEdges()
+
+    def getParameterBounds(self,numComponents=None):
+        #All parameters are >= 0
+        return [[1e-5,None]]*self.getNumParameters()
+
+    def setParameters(self,params):
+        params=np.asarray(params,dtype=float)
+        self.nu[:]=params[0:self.numComponents]
+        self.edgeValues[:]=params[self.numComponents:self.numComponents+self.getNumEdges()]
+        self.q[self.edgeTargets,self.edgeSources]=self.edgeValues
+
+    def getParameters(self):
+        """Parameter vector in the layout of setParameters"""
+        return np.concatenate([self.nu,self.edgeValues])
+
+    def getSourceComponents(self,componentIdx):
+        """Components whose events can excite componentIdx"""
+        return self.edgeSources[self.targetOffsets[componentIdx]:self.targetOffsets[componentIdx+1]]
+
+    def getTargetParameterIndices(self,componentIdx):
+        """Positions of nu[j] and the edges into j in the parameter vector"""
+        start=self.numComponents+self.targetOffsets[componentIdx]
+        end=self.numComponents+self.targetOffsets[componentIdx+1]
+        return [componentIdx]+range(start,end)
+
+    def getParameterGradient(self,nuGradient,qGradient):
+        """Gradient with respect to the parameter vector, from the gradients with respect to nu and the KxK q"""
+        qGradient=np.asarray(qGradient,dtype=float)
+        return np.concatenate([np.asarray(nuGradient,dtype=float),qGradient[self.edgeTargets,self.edgeSources]])
+
+    def getSparseQ(self):
+        """Branching matrix as a scipy.sparse CSR matrix"""
+        return scipy.sparse.csr_matrix((self.edgeValues,self.edgeSources,self.targetOffsets),shape=(self.numComponents,self.numComponents))
+
+    def getSpectralRadius(self):
+        """Largest absolute eigenvalue of q, by ARPACK on the sparse form for large K"""
+        if self.getNumEdges()==0:
+            return 0.0
+        if self.numComponents<=DENSE_EIGENVALUE_MAX_COMPONENTS:
+            return np.max(np.abs(np.linalg.eigvals(self.q)))
+        try:
+            eigenVals=scipy.sparse.linalg.eigs(self.getSparseQ(),k=1,which='LM',return_eigenvectors=False)
+        except scipy.sparse.linalg.ArpackNoConvergence:
+            return np.max(np.abs(np.linalg.eigvals(self.q)))
+        return abs(eigenVals[0])
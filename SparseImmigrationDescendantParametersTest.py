@@ -0,0 +1,72 @@
+__author__ = 'tjohnson'
+
+import unittest
+import numpy as np
+import ClusterSimulator
+import DecayFunctions
+import GenuineMultivariateHawkesProcess
+import GenuineMultivariateHawkesProcessFitter
+import ImmigrationDescendantParameters
+import MarkDistributions
+import SparseImmigrationDescendantParameters
+
+NUM_COMPONENTS=4
+NU=[0.05,0.04,0.03,0.06]
+#Ordered by target then source, the layout of the edge parameters
+EDGES=[(0,0),(0,2),(1,0),(2,1),(2,2),(3,1),(3,3)]
+EDGE_VALUES=[0.3,0.2,0.4,0.25,0.1,0.15,0.35]
+
+
+def buildProcess(immigrationDescendantParameters):
+    return GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        immigrationDescendantParameters,
+        [DecayFunctions.ExponentialDecayFunction([0.5+0.1*j]) for j in range(0,NUM_COMPONENTS)],
+        [MarkDistributions.ExponentialMarkDistribution1Param([1.0,0.5]) for k in range(0,NUM_COMPONENTS)])
+
+
+class SparseImmigrationDescendantParametersTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        q=np.zeros([NUM_COMPONENTS,NUM_COMPONENTS])
+        for (target,source),value in zip(EDGES,EDGE_VALUES):
+            q[target,source]=value
+        cls.sparseProcess=buildProcess(SparseImmigrationDescendantParameters.SparseImmigrationDescendantParameters(
+            NUM_COMPONENTS,EDGES,NU+EDGE_VALUES))
+        cls.denseProcess=buildProcess(ImmigrationDescendantParameters.ImmigrationDescendantParameters(
+            NUM_COMPONENTS,NU+list(q.ravel())))
+        cls.events=ClusterSimulator.ClusterSimulator(cls.denseProcess).simulate(3000.0,9,numWorkers=1)
+
+    def testEnoughEvents(self):
+        self.assertGreater(len(self.events),100)
+
+    def testSameQ(self):
+        np.testing.assert_array_equal(self.sparseProcess.immigrationDescendantParameters.q,self.denseProcess.immigrationDescendantParameters.q)
+        self.assertAlmostEqual(self.sparseProcess.immigrationDescendantParameters.getSpectralRadius(),
+                               self.denseProcess.immigrationDescendantParameters.getSpectralRadius(),places=12)
+
+    def testLikelihoodMatchesDense(self):
+        for truncated in [False,True]:
+            np.testing.assert_allclose(self.sparseProcess.getLogLikelihoodTerms(self.events,truncated),
+                                       self.denseProcess.getLogLikelihoodTerms(self.events,truncated),rtol=1e-12)
+
+    def testGradientMatchesDense(self):
+        sparseLogLikelihood,sparseGradients=self.sparseProcess.getLogLikelihoodAndGradient(self.events)
+        denseLogLikelihood,denseGradients=self.denseProcess.getLogLikelihoodAndGradient(self.events)
+        self.assertAlmostEqual(sparseLogLikelihood/denseLogLikelihood,1.0,places=12)
+        np.testing.assert_allclose(sparseGradients[0],denseGradients[0],rtol=1e-10)
+        targets,sources=zip(*EDGES)
+        np.testing.assert_allclose(sparseGradients[1][targets,sources],denseGradients[1][targets,sources],rtol=1e-10)
+
+        sparseFitter=GenuineMultivariateHawkesProcessFitter.GenuineMultivariateHawkesProcessFitter(self.sparseProcess)
+        self.assertEqual(sparseFitter.numParams,NUM_COMPONENTS+len(EDGES)+NUM_COMPONENTS*(1+2))
+
+    def testSpectralRadiusOfLargeSparseMatrix(self):
+        numComponents=60
+        edges=[(j,(j+1)%numComponents) for j in range(0,numComponents)]+[(j,j) for j in range(0,numComponents,3)]
+        values=list(np.random.RandomState(4).uniform(0.1,0.4,len(edges)))
+        sparse=SparseImmigrationDescendantParameters.SparseImmigrationDescendantParameters(numComponents,edges,[0.1]*numComponents+values)
+        self.assertAlmostEqual(sparse.getSpectralRadius(),np.max(np.abs(np.linalg.eigvals(sparse.q))),places=8)
+
+
+if __name__=='__main__':
+    unittest.main()
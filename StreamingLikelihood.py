@@ -0,0 +1,153 @@
+__author__ = 'tjohnson'
+import numpy as np
+import DecayFunctions
+import EventStore
+
+#Events read per chunk by default
+DEFAULT_CHUNK_SIZE=2**18
+
+
+class StreamingLikelihood:
+    def __init__(self,hawkesProcess,chunkSize=DEFAULT_CHUNK_SIZE):
+        """
+        Log-likelihood of histories too large for memory, read in chunks of chunkSize events from an EventStore file,
+        an EventStore or any iterable of (time,component,mark) triplets or EventStore chunks, in time order.
+
+        Across chunk boundaries two things are carried:
+            a tail buffer with the events inside the longest decay quantile getQ(), so the intensities of the next
+            chunk see exactly the events getLogLikelihood sees;
+            for decay functions with exponential terms (DecayFunctions.getExponentialTerms) the excitation of every
+            term, sum_s q[j,k]*g_k(x)*exp(-r*(t-s)), which gives the untruncated compensator at the end.
+        The result equals GenuineMultivariateHawkesProcess.getLogLikelihood up to rounding. Peak memory is bounded
+        by the chunk plus the events of one quantile window, independent of the length of the history.
+        """
+        self.hawkesProcess=hawkesProcess
+        self.chunkSize=chunkSize
+
+    def __getChunks(self,events):
+        """EventStore chunks of at most chunkSize events"""
+        numComponents=self.hawkesProcess.numComponents
+        if isinstance(events,EventStore.EventStore):
+            for start in range(0,len(events),self.chunkSize):
+                yield events[start:start+self.chunkSize]
+            return
+
+        batch=[]
+        for item in events:
+            if isinstance(item,EventStore.EventStore):
+                for start in range(0,len(item),self.chunkSize):
+                    yield item[start:start+self.chunkSize]
+                continue
+            batch.append(item)
+            if len(batch)==self.chunkSize:
+                yield EventStore.EventStore.fromTriplets(batch,numComponents)
+                batch=[]
+        if len(batch)>0:
+            yield EventStore.EventStore.fromTriplets(batch,numComponents)
+
+    def __getImpacts(self,eventStore):
+        impacts=np.zeros(len(eventStore))
+        for k in range(0,self.hawkesProcess.numComponents):
+            indices=eventStore.getComponentIndices(k)
+            impacts[indices]=self.hawkesProcess.markDistributions[k].getImpactFunctionArray(eventStore.marks[indices])
+        return impacts
+
+    def getLogLikelihood(self,events,truncated=False,startTime=None,endTime=None):
+        """Sum of the terms from getLogLikelihoodTerms"""
+        lambdaTermSums,markDensityTermSums,compensators=self.getLogLikelihoodTerms(events,truncated,startTime,endTime)
+        return np.sum(lambdaTermSums)+np.sum(markDensityTermSums)-np.sum(compensators)
+
+    def getLogLikelihoodTerms(self,events,truncated=False,startTime=None,endTime=None):
+        """
+        The terms of GenuineMultivariateHawkesProcess.getLogLikelihoodTerms, one pass over the chunks.
+        The untruncated compensator needs decay functions with exponential terms, otherwise use truncated=True.
+
+        :param events: EventStore file path (opened memory-mapped), EventStore or iterable of triplets or EventStore chunks
+        :param startTime,endTime: Observation window, default the window of an EventStore or EventStore file, otherwise
+            the first and last event times
+        """
+        hawkesProcess=self.hawkesProcess
+        numComponents=hawkesProcess.numComponents
+        nu=hawkesProcess.immigrationDescendantParameters.nu
+        q=hawkesProcess.immigrationDescendantParameters.q
+        if not truncated and not hawkesProcess.hasRecursiveDecayFunctions():
+            raise ValueError("Untruncated streaming compensator requires decay functions with exponential terms, use truncated=True")
+        if isinstance(events,basestring):
+            events=EventStore.EventStore.load(events)
+        if isinstance(events,EventStore.EventStore):
+            startTime=events.startTime if startTime is None else startTime
+            endTime=events.endTime if endTime is None else endTime
+
+        window=max(decayFunction.getQ() for decayFunction in hawkesProcess.decayFunctions)
+        terms=[DecayFunctions.getExponentialTerms(decayFunction) for decayFunction in hawkesProcess.decayFunctions]
+
+        lambdaTermSums=np.zeros(numComponents)
+        markDensityTermSums=np.zeros(numComponents)
+        #Impacts per source component of all events, and of the events dropped from the tail buffer
+        impactTotals=np.zeros(numComponents)
+        evictedImpactTotals=np.zeros(numComponents)
+        #carries[j][i]: excitation of term i of decay function j at carryTime
+        carries=[np.zeros(0) if componentTerms is None else np.zeros(len(componentTerms[0])) for componentTerms in terms]
+        carryTime=None
+
+        buffer=EventStore.EventStore(np.zeros(0),np.zeros(0),np.zeros(0),numComponents)
+        firstTime=None
+        for chunk in self.__getChunks(events):
+            if len(chunk)==0:
+                continue
+            if carryTime is not None and chunk.times[0]<carryTime:
+                raise ValueError("Chunk starting at %s follows events up to %s" % (chunk.times[0],carryTime))
+            if firstTime is None:
+                firstTime=float(chunk.times[0])
+            chunk=EventStore.EventStore(chunk.times,chunk.components,chunk.marks,numComponents)
+
+            combined=EventStore.EventStore(np.concatenate([buffer.times,chunk.times]),np.concatenate([buffer.components,chunk.components]),
+                                           np.concatenate([buffer.marks,chunk.marks]),numComponents)
+            lambdas=hawkesProcess.getEventLambdas(combined)[len(buffer):]
+            lambdaTermSums+=np.bincount(chunk.components,weights=np.log(lambdas),minlength=numComponents)
+
+            impacts=self.__getImpacts(chunk)
+            for k in range(0,numComponents):
+                indices=chunk.getComponentIndices(k)
+                markDensityTermSums[k]+=np.sum(np.log(hawkesProcess.markDistributions[k].getDensityFunctionArray(chunk.marks[indices])))
+            impactTotals+=np.bincount(chunk.components,weights=impacts,minlength=numComponents)
+
+            chunkEndTime=float(chunk.times[-1])
+            if not truncated:
+                for j in range(0,numComponents):
+                    termWeights,rates=terms[j]
+                    weights=q[j,chunk.components]*impacts
+                    if carryTime is not None:
+                        carries[j]=carries[j]*np.exp(-rates*(chunkEndTime-carryTime))
+                    for termIdx,rate in enumerate(rates):
+                        carries[j][termIdx]+=np.dot(weights,np.exp(-rate*(chunkEndTime-chunk.times)))
+            carryTime=chunkEndTime
+
+            kept=combined.times>=chunkEndTime-window
+            evicted=combined[0:len(combined)-np.sum(kept)]
+            evictedImpactTotals+=np.bincount(evicted.components,weights=self.__getImpacts(evicted),minlength=numComponents)
+            buffer=combined[len(evicted):]
+
+        if firstTime is None:
+            if startTime is None or endTime is None:
+                raise ValueError("No events and no observation window")
+            firstTime=carryTime=startTime
+        startTime=firstTime if startTime is None else startTime
+        endTime=carryTime if endTime is None else endTime
+
+        compensators=nu*(endTime-startTime)
+        bufferImpacts=self.__getImpacts(buffer)
+        for j in range(0,numComponents):
+            if truncated:
+                #As GenuineMultivariateHawkesProcess.getCompensator: wBar=1 beyond the quantile
+                decayFunction=hawkesProcess.decayFunctions[j]
+                weights=q[j,buffer.components]*bufferImpacts
+                firstIdx=np.searchsorted(buffer.times,endTime-decayFunction.getQ(),side='left')
+                wBarValues=DecayFunctions.getWBarArray(decayFunction,endTime-buffer.times[firstIdx:])
+                compensators[j]+=q[j].dot(evictedImpactTotals)+np.sum(weights[:firstIdx])+np.sum(weights[firstIdx:]*wBarValues)
+            else:
+                termWeights,rates=terms[j]
+                remainders=carries[j]*np.exp(-rates*(endTime-carryTime))
+                compensators[j]+=q[j].dot(impactTotals)-termWeights.dot(remainders)
+
+        return lambdaTermSums,markDensityTermSums,compensators
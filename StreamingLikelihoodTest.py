@@ -0,0 +1,81 @@
+__author__ = 'tjohnson'
+
+import os
+import tempfile
+import unittest
+import numpy as np
+import ClusterSimulator
+import DecayFunctions
+import EventStore
+import GenuineMultivariateHawkesProcess
+import ImmigrationDescendantParameters
+import MarkDistributions
+import StreamingLikelihood
+
+
+def buildProcess():
+    """Two exponential components with Pareto marks"""
+    return GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+        ImmigrationDescendantParameters.ImmigrationDescendantParameters(2,[0.021,0.029,0.61,0.16,0.6,0.06]),
+        [DecayFunctions.ExponentialDecayFunction([0.015]),DecayFunctions.ExponentialDecayFunction([0.02])],
+        [MarkDistributions.ParetoMarkDistribution([3.6,5.6,0.47,0.22,0.0]),MarkDistributions.ParetoMarkDistribution([4.2,7.2,1.1,0.0,0.0])])
+
+
+class StreamingLikelihoodTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hawkesProcess=buildProcess()
+        simulated=ClusterSimulator.ClusterSimulator(cls.hawkesProcess).simulate(6000.0,321,numWorkers=1)
+        #Window wider than the events on both sides, so the defaults of first and last event time would differ
+        cls.events=EventStore.EventStore(simulated.times,simulated.components,simulated.marks,2,
+                                         startTime=-50.0,endTime=6000.0)
+        fileHandle,cls.path=tempfile.mkstemp(suffix='.events')
+        os.close(fileHandle)
+        cls.events.save(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def testEnoughEvents(self):
+        self.assertGreater(len(self.events),100)
+
+    def testPathMatchesStoreAndInMemory(self):
+        streamingLikelihood=StreamingLikelihood.StreamingLikelihood(self.hawkesProcess,chunkSize=97)
+        expected=self.hawkesProcess.getLogLikelihood(self.events)
+        self.assertAlmostEqual(streamingLikelihood.getLogLikelihood(self.events)/expected,1.0,places=10)
+        self.assertAlmostEqual(streamingLikelihood.getLogLikelihood(self.path)/expected,1.0,places=10)
+
+    def testTripletsMatchInMemory(self):
+        #Triplets span the first to the last event, chunk boundaries fall inside the decay quantile window
+        triplets=self.events.toTriplets()
+        streamingLikelihood=StreamingLikelihood.StreamingLikelihood(self.hawkesProcess,chunkSize=50)
+        expectedTerms=self.hawkesProcess.getLogLikelihoodTerms(triplets)
+        for terms,expected in zip(streamingLikelihood.getLogLikelihoodTerms(iter(triplets)),expectedTerms):
+            np.testing.assert_allclose(terms,expected,rtol=1e-10)
+
+    def testEventStoreChunksMatchInMemory(self):
+        streamingLikelihood=StreamingLikelihood.StreamingLikelihood(self.hawkesProcess)
+        chunks=[self.events[start:start+113] for start in range(0,len(self.events),113)]
+        expected=self.hawkesProcess.getLogLikelihood(self.events)
+        self.assertAlmostEqual(streamingLikelihood.getLogLikelihood(chunks,startTime=-50.0,endTime=6000.0)/expected,1.0,places=10)
+
+    def testTruncatedMatchesInMemory(self):
+        powerLawProcess=GenuineMultivariateHawkesProcess.GenuineMultivariateHawkesProcess(
+            self.hawkesProcess.immigrationDescendantParameters,
+            [DecayFunctions.PowerLawDecayFunction([1.5,60.0]),DecayFunctions.PowerLawDecayFunction([2.0,40.0])],
+            self.hawkesProcess.markDistributions)
+        streamingLikelihood=StreamingLikelihood.StreamingLikelihood(powerLawProcess,chunkSize=97)
+        self.assertRaises(ValueError,streamingLikelihood.getLogLikelihood,self.events)
+        expected=powerLawProcess.getLogLikelihood(self.events,truncated=True)
+        self.assertAlmostEqual(streamingLikelihood.getLogLikelihood(self.path,truncated=True)/expected,1.0,places=10)
+
+    def testPathWindowCanBeOverridden(self):
+        streamingLikelihood=StreamingLikelihood.StreamingLikelihood(self.hawkesProcess,chunkSize=97)
+        expected=self.hawkesProcess.getLogLikelihood(self.events.toTriplets())
+        self.assertAlmostEqual(streamingLikelihood.getLogLikelihood(self.path,startTime=float(self.events.times[0]),
+                                                                    endTime=float(self.events.times[-1]))/expected,1.0,places=10)
+
+
+if __name__=='__main__':
+    unittest.main()
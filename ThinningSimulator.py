@@ -0,0 +1,89 @@
+__author__ = 'tjohnson'
+import numbers
+import numpy as np
+import EventStore
+import IntensityTracker
+
+#Marks are drawn per component in batches of this size
+MARK_BATCH_SIZE=1024
+
+
+def getRandomState(randomState):
+    """Accept None, an integer seed or a numpy.random.RandomState"""
+    if randomState is None or isinstance(randomState,numbers.Integral):
+        return np.random.RandomState(randomState)
+    return randomState
+
+
+class ThinningSimulator:
+    def __init__(self,hawkesProcess):
+        """
+        Ogata thinning against the total intensity of all components.
+        The intensity is kept in an IntensityTracker, so a step costs O(K) for exponential decay functions
+        (O(K*window) otherwise) instead of the history scans done by GenuineMultivariateHawkesProcess.simulate.
+        Requires non-increasing decay functions, so the intensity right after the last event bounds it until the next one.
+        """
+        self.hawkesProcess=hawkesProcess
+
+    def simulate(self,numEvents=None,randomState=None,startTime=0.0,history=None,endTime=None):
+        """
+        :param numEvents: Number of events to generate, None to stop at endTime only
+        :param randomState: Seed or numpy.random.RandomState, for reproducible paths
+        :param startTime: Time the simulation starts from
+        :param history: Events up to startTime the path is conditioned on (EventStore or triplets), none by default
+        :param endTime: Stop at this time even if fewer than numEvents events were generated
+        :return: EventStore of the new events, with the simulated interval as its observation window: from startTime
+            to endTime, or to the last event if numEvents were generated first
+        """
+        if numEvents is None and endTime is None:
+            raise ValueError("Give numEvents or endTime")
+        randomState=getRandomState(randomState)
+        numComponents=self.hawkesProcess.numComponents
+        markDistributions=self.hawkesProcess.markDistributions
+
+        intensityTracker=IntensityTracker.IntensityTracker(self.hawkesProcess)
+        if history is not None:
+            intensityTracker.pushEvents(history)
+            if intensityTracker.getLastTime() is not None and intensityTracker.getLastTime()>startTime:
+                raise ValueError("History ends at %s, after the start time %s" % (intensityTracker.getLastTime(),startTime))
+        markBuffers=[[] for k in range(0,numComponents)]
+
+        maxEvents=numEvents if numEvents is not None else float('inf')
+        times=[]
+        components=[]
+        marks=[]
+
+        t=startTime
+        upperBound=intensityTracker.intensities(t,includeT=True).sum()
+        numAccepted=0
+        observedUntil=None
+        while numAccepted<maxEvents:
+            t+=randomState.exponential(1.0/upperBound)
+            if endTime is not None and t>endTime:
+                observedUntil=endTime
+                break
+            cumulativeIntensities=intensityTracker.intensities(t).cumsum()
+            totalIntensity=cumulativeIntensities[-1]
+
+            u=randomState.random_sample()*upperBound
+            if u>totalIntensity:
+                upperBound=totalIntensity
+                continue
+
+            #u is uniform on [0,totalIntensity], so it also picks the component
+            k=min(cumulativeIntensities.searchsorted(u),numComponents-1)
+            if len(markBuffers[k])==0:
+                markBuffers[k]=list(markDistributions[k].getRandomValues(MARK_BATCH_SIZE,randomState))
+            x=markBuffers[k].pop()
+
+            intensityTracker.push(t,k,x)
+            times.append(t)
+            components.append(k)
+            marks.append(x)
+            numAccepted+=1
+
+            upperBound=intensityTracker.intensities(t,includeT=True).sum()
+
+        if observedUntil is None:
+            observedUntil=t
+        return EventStore.EventStore(times,components,marks,numComponents,startTime=startTime,endTime=observedUntil)